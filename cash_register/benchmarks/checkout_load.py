@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Concurrent checkout load generator for POST /purchase.
+
+Start the cash register once per mode and point this at it, e.g.
+
+    CASH_REGISTER_DB_MODE=sync  uvicorn main:app --port 8000
+    CASH_REGISTER_DB_MODE=async uvicorn main:app --port 8000
+    python -m benchmarks.checkout_load --url http://localhost:8000 --concurrency 200 --requests 5000
+
+The service's /health response shows which mode it is running in.
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+
+def post_purchase(url: str, payload: bytes) -> Tuple[float, int]:
+    request = urllib.request.Request(
+        f"{url}/purchase", data=payload, headers={"Content-Type": "application/json"}, method="POST"
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return (time.perf_counter() - started) * 1000, status
+
+
+def fetch_json(url: str) -> Dict[str, Any]:
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive concurrent checkouts against the cash register")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--customers", type=int, default=500, help="Distinct customers cycled through")
+    parser.add_argument("--supermarket-id", default="SMKT001")
+    parser.add_argument("--items", nargs="+", default=["milk", "bread", "eggs"])
+    args = parser.parse_args()
+
+    mode = fetch_json(f"{args.url}/health").get("mode", "unknown")
+    counter = iter(range(args.requests))
+    lock = threading.Lock()
+
+    def worker(_: int) -> List[Tuple[float, int]]:
+        results = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return results
+            payload = json.dumps({
+                "real_id": f"load{i % args.customers:06d}",
+                "supermarket_id": args.supermarket_id,
+                "item_names": args.items
+            }).encode()
+            results.append(post_purchase(args.url, payload))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = [r for batch in executor.map(worker, range(args.concurrency)) for r in batch]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, status in results if status == 200)
+    errors = sum(1 for _, status in results if status != 200)
+    if not latencies:
+        print(f"❌ All {len(results)} requests failed")
+        return
+
+    print(f"🛒 mode={mode} concurrency={args.concurrency} requests={len(results)} errors={errors}")
+    print(f"   throughput: {len(latencies) / elapsed:.1f} checkouts/s")
+    print(f"   latency ms: mean={statistics.fmean(latencies):.2f} p50={percentile(latencies, 0.50):.2f} "
+          f"p95={percentile(latencies, 0.95):.2f} p99={percentile(latencies, 0.99):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark for the purchases import: loads the same file with the serial
+chunked loader and with the parallel loader at several worker counts, each time
+into a fresh scratch schema so the real tables are never touched.
+
+    python -m benchmarks.parallel_load --purchases 2000000 --workers 1 2 4 8
+
+Stores and customers referenced by the file are created in the scratch schema.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import List, Optional
+
+import psycopg2
+
+from shared.db_config import get_db_config
+
+SCRATCH_SCHEMA = "bench_load"
+# Tables resolve to the scratch schema first; the partition functions still come from public
+SCRATCH_PGOPTIONS = f"-c search_path={SCRATCH_SCHEMA},public"
+
+
+def reset_scratch_schema(stores: List[str]) -> None:
+    conn = psycopg2.connect(**get_db_config())
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE;")
+    cur.execute(f"CREATE SCHEMA {SCRATCH_SCHEMA};")
+    for table in ("customers", "supermarkets", "products", "data_load_progress"):
+        # Defaults are excluded so the scratch tables don't draw from the real id sequences
+        cur.execute(f"CREATE TABLE {SCRATCH_SCHEMA}.{table} (LIKE public.{table} INCLUDING ALL EXCLUDING DEFAULTS);")
+    # Partitioned like the real table; the loaders create the months they need
+    cur.execute(f"""
+        CREATE TABLE {SCRATCH_SCHEMA}.purchases (LIKE public.purchases INCLUDING ALL EXCLUDING DEFAULTS)
+            PARTITION BY RANGE (timestamp);
+        CREATE TABLE {SCRATCH_SCHEMA}.purchases_default PARTITION OF {SCRATCH_SCHEMA}.purchases DEFAULT;
+    """)
+    for table in ("products", "purchases"):
+        cur.execute(f"ALTER TABLE {SCRATCH_SCHEMA}.{table} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY;")
+    cur.execute(f"""
+        ALTER TABLE {SCRATCH_SCHEMA}.purchases
+            ADD FOREIGN KEY (supermarket_id) REFERENCES {SCRATCH_SCHEMA}.supermarkets(id),
+            ADD FOREIGN KEY (user_id) REFERENCES {SCRATCH_SCHEMA}.customers(uuid);
+    """)
+    cur.executemany(f"INSERT INTO {SCRATCH_SCHEMA}.supermarkets (id) VALUES (%s);", [(s,) for s in stores])
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def drop_scratch_schema() -> None:
+    conn = psycopg2.connect(**get_db_config())
+    conn.cursor().execute(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE;")
+    conn.commit()
+    conn.close()
+
+
+def time_load(csv_path: str, workers: Optional[int], range_bytes: int) -> float:
+    # Imported late so their module-level connections pick up the scratch search_path
+    from db.load_purchases import load_purchases
+    from db.parallel_load_purchases import load_purchases_parallel
+
+    started = time.monotonic()
+    if workers is None:
+        load_purchases(csv_path)
+    else:
+        load_purchases_parallel(csv_path, workers, range_bytes=range_bytes)
+    return time.monotonic() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark serial vs parallel purchases import")
+    parser.add_argument("--csv", help="Existing purchases CSV (default: generate a synthetic one)")
+    parser.add_argument("--purchases", type=int, default=1_000_000, help="Rows to generate when --csv is not given")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--range-mb", type=int, default=16)
+    args = parser.parse_args()
+
+    # Every connection opened from here on (including worker processes) uses the scratch schema
+    os.environ["PGOPTIONS"] = SCRATCH_PGOPTIONS
+
+    stores = [f"SMKT{i:03d}" for i in range(1, 21)]
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = args.csv
+        if csv_path is None:
+            from benchmarks.synthetic_data import make_products, write_purchases_csv
+            import random
+            csv_path = os.path.join(tmp, "purchases.csv")
+            print(f"🧪 Generating {args.purchases:,} synthetic purchases...")
+            write_purchases_csv(csv_path, args.purchases, make_products(500, random.Random(1)), stores,
+                                customers=max(1, args.purchases // 4))
+
+        with open(csv_path, encoding="utf-8-sig") as f:
+            rows = sum(1 for _ in f) - 1
+
+        results = []
+        for workers in [None] + sorted(set(args.workers)):
+            reset_scratch_schema(stores)
+            label = "serial" if workers is None else f"{workers} workers"
+            print(f"⏳ {label}")
+            elapsed = time_load(csv_path, workers, args.range_mb * 1024 * 1024)
+            results.append((label, elapsed))
+        drop_scratch_schema()
+
+    baseline = results[0][1]
+    print(f"\n📊 {rows:,} purchases, {os.cpu_count()} CPUs")
+    print(f"{'loader':<12}{'seconds':>10}{'rows/s':>12}{'speedup':>10}")
+    for label, elapsed in results:
+        print(f"{label:<12}{elapsed:>10.1f}{rows / elapsed:>12,.0f}{baseline / elapsed:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Latency comparison between the step-by-step purchase path (validate_supermarket,
+validate_and_price_items, get_or_create_user_uuid, insert_purchase) and the fused
+single-statement path (record_purchase).
+
+Run inside the cash register container against a loaded database:
+
+    python -m benchmarks.purchase_pipeline --iterations 500 --items 30 --seed-products 30
+
+Both paths write real purchases for synthetic ``bench*`` customers.
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from shared.db_config import init_db_pool, close_db_pool, pooled_connection
+from main import (
+    validate_supermarket,
+    validate_and_price_items,
+    get_or_create_user_uuid,
+    insert_purchase,
+    record_purchase,
+)
+
+
+def stepwise_purchase(store_id: str, real_id: str, item_names: List[str]) -> None:
+    validate_supermarket(store_id)
+    total = validate_and_price_items(item_names)
+    user_uuid = get_or_create_user_uuid(real_id)
+    insert_purchase(store_id, user_uuid, item_names, total)
+
+
+def fused_purchase(store_id: str, real_id: str, item_names: List[str]) -> None:
+    record_purchase(store_id, real_id, item_names)
+
+
+def seed_products(count: int) -> None:
+    """Make sure the catalog holds at least ``count`` products"""
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO products (name, price) VALUES (%s, %s) ON CONFLICT (name) DO NOTHING;",
+            [(f"bench product {i:05d}", 1.0 + (i % 50) / 10) for i in range(count)]
+        )
+        conn.commit()
+        cur.close()
+
+
+def load_basket(size: int) -> List[str]:
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name FROM products ORDER BY name LIMIT %s;", (size,))
+        basket = [row[0] for row in cur.fetchall()]
+        cur.close()
+    return basket
+
+
+def load_store() -> str:
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM supermarkets ORDER BY id LIMIT 1;")
+        store_id = cur.fetchone()[0]
+        cur.close()
+    return store_id
+
+
+def run(name: str, fn: Callable[[str, str, List[str]], None], store_id: str, basket: List[str],
+        iterations: int, customers: int) -> Dict[str, float]:
+    timings: List[float] = []
+    for i in range(iterations):
+        real_id = f"bench{name}{i % customers:06d}"
+        started = time.perf_counter()
+        fn(store_id, real_id, basket)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return {
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "throughput_per_s": 1000 * len(timings) / sum(timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare step-by-step and fused purchase latency")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--items", type=int, default=10, help="Basket size")
+    parser.add_argument("--customers", type=int, default=50, help="Distinct customers cycled through (repeat shoppers)")
+    parser.add_argument("--seed-products", type=int, default=0, help="Insert synthetic products so large baskets are possible")
+    args = parser.parse_args()
+
+    init_db_pool("benchmark")
+    try:
+        if args.seed_products:
+            seed_products(args.seed_products)
+        store_id = load_store()
+        basket = load_basket(args.items)
+        print(f"🧺 Basket of {len(basket)} items, {args.iterations} iterations per path")
+
+        results = {}
+        for name, fn in (("stepwise", stepwise_purchase), ("fused", fused_purchase)):
+            fn(store_id, f"benchwarmup{name}", basket)
+            results[name] = run(name, fn, store_id, basket, args.iterations, args.customers)
+
+        print(f"{'path':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>10}")
+        for name, r in results.items():
+            print(f"{name:<10}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['throughput_per_s']:>10.1f}")
+        print(f"⚡ Fused path speedup (mean): {results['stepwise']['mean_ms'] / results['fused']['mean_ms']:.2f}x")
+    finally:
+        close_db_pool()
+
+
+if __name__ == "__main__":
+    main()
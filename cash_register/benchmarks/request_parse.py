@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+CPU cost of one POST /purchase from request body to response bytes, without the
+database: JSON parsing, PurchaseRequest validation, store and basket pricing against
+an in-memory catalog, and rendering the response with the standard JSONResponse and
+with FastJSONResponse. A dashboard-sized payload is rendered both ways as well.
+
+Run inside the cash register container (the catalog is synthetic):
+
+    python -m benchmarks.request_parse --items 500 --iterations 2000
+"""
+
+import argparse
+import json
+import statistics
+import time
+import uuid
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from catalog_cache import CatalogSnapshot
+from main import PurchaseRequest, validate_supermarket, validate_and_price_items
+from shared.json_response import FastJSONResponse, orjson
+
+STORE_ID = "SMKT001"
+
+
+def synthetic_catalog(products: int) -> CatalogSnapshot:
+    names = [f"bench product {i:05d}" for i in range(products)]
+    prices = [Decimal(100 + i % 900) / 100 for i in range(products)]
+    return CatalogSnapshot(
+        version=1,
+        loaded_at=time.time(),
+        prices=dict(zip(names, prices)),
+        products=[{"name": name, "price": float(price)} for name, price in zip(names, prices)],
+        supermarkets=[STORE_ID]
+    )
+
+
+def time_stage(fn: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    timings: List[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    timings.sort()
+    return {"mean_us": statistics.fmean(timings), "p50_us": timings[len(timings) // 2],
+            "p95_us": timings[min(len(timings) - 1, int(len(timings) * 0.95))]}
+
+
+def checkout(body: bytes, snapshot: CatalogSnapshot, response_class: type) -> bytes:
+    """What FastAPI does for POST /purchase, minus routing and the database"""
+    purchase = PurchaseRequest(**json.loads(body))
+    validate_supermarket(purchase.supermarket_id, snapshot)
+    total = validate_and_price_items(purchase.item_names, snapshot)
+    content = {"status": "success", "uuid": str(uuid.uuid4()), "total": float(total), "message": "Purchase recorded"}
+    return response_class(jsonable_encoder(content)).body
+
+
+def dashboard_page(rows: int) -> Dict[str, Any]:
+    """A /loyal-customers page of the given size"""
+    return {
+        "customers": [{"customer_id": f"{100000000 + i}", "customer_uuid": uuid.uuid4(), "purchase_count": 10 + i % 50,
+                       "total_spent": Decimal(1000 + i) / 10} for i in range(rows)],
+        "next_cursor": "eyJjIjpbMTAsIjEwMC4wIiwiYWJjIl19", "count": rows
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time request parsing, validation, pricing and response rendering")
+    parser.add_argument("--items", type=int, default=500, help="Basket size")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--page-rows", type=int, default=1000, help="Rows in the dashboard payload")
+    args = parser.parse_args()
+
+    snapshot = synthetic_catalog(max(args.items, 1000))
+    basket = [f"  {name} " for name in list(snapshot.prices)[:args.items]]
+    body = json.dumps({"real_id": " 123456789 ", "supermarket_id": STORE_ID, "item_names": basket}).encode()
+    data = json.loads(body)
+    purchase = PurchaseRequest(**data)
+    content = {"status": "success", "uuid": str(uuid.uuid4()), "total": 123.45, "message": "Purchase recorded"}
+    page = dashboard_page(args.page_rows)
+
+    encoder = "orjson" if orjson is not None else "json (orjson not installed)"
+    print(f"🧺 Basket of {args.items} items ({len(body):,} byte body), {args.iterations} iterations, "
+          f"FastJSONResponse encoder: {encoder}")
+    stages = {
+        "parse body": lambda: json.loads(body),
+        "validate model": lambda: PurchaseRequest(**data),
+        "price basket": lambda: (validate_supermarket(purchase.supermarket_id, snapshot),
+                                 validate_and_price_items(purchase.item_names, snapshot)),
+        "render (JSONResponse)": lambda: JSONResponse(jsonable_encoder(content)).body,
+        "render (FastJSONResponse)": lambda: FastJSONResponse(jsonable_encoder(content)).body,
+        "end to end (JSONResponse)": lambda: checkout(body, snapshot, JSONResponse),
+        "end to end (FastJSONResponse)": lambda: checkout(body, snapshot, FastJSONResponse),
+        f"{args.page_rows}-row page (JSONResponse)": lambda: JSONResponse(jsonable_encoder(page)).body,
+        f"{args.page_rows}-row page (FastJSONResponse)": lambda: FastJSONResponse(page).body,
+    }
+
+    print(f"{'stage':<34}{'mean us':>10}{'p50 us':>10}{'p95 us':>10}")
+    for name, fn in stages.items():
+        fn()
+        r = time_stage(fn, args.iterations)
+        print(f"{name:<34}{r['mean_us']:>10.1f}{r['p50_us']:>10.1f}{r['p95_us']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for comparing commits: seeds a synthetic dataset, then drives
+POST /purchase, POST /purchases/batch, the serial and parallel loaders and every
+dashboard endpoint at each --concurrency level, and writes latency percentiles,
+throughput and the database work of every scenario to a JSON file.
+
+    docker compose up -d --build
+    docker compose run --rm -v "$PWD/bench:/app/bench" init_data python -m benchmarks.suite \\
+        --cash-register-url http://cash_register:8000 --dashboard-url http://dashboard:8000 \\
+        --seed-purchases 2000000 --label "$(git rev-parse --short HEAD)" --output bench/head.json
+    docker compose run --rm -v "$PWD/bench:/app/bench" init_data python -m benchmarks.suite \\
+        --compare bench/base.json bench/head.json
+
+Seeding generates CSVs shaped like purchases.csv (skewed baskets, a loyal tail
+of repeat customers) into --data-dir and loads them with the regular loaders;
+a file that is already loaded is skipped, so reruns reuse the dataset. The
+loader scenarios run in the scratch schema of benchmarks.parallel_load.
+
+Dashboard endpoints are measured twice: "cached" repeats one query so the
+result cache answers, "uncached" adds a unique parameter to every request so
+each one is computed. Database work comes from pg_stat_statements when the
+extension is loaded (the compose db service preloads it), otherwise from the
+pg_stat_database counters, which backends only flush about once a second.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from benchmarks.checkout_load import fetch_json, percentile
+from shared.db_config import get_db_config
+
+DASHBOARD_ENDPOINTS = {
+    "unique-customers": "/unique-customers",
+    "unique-customers-exact": "/unique-customers?exact=true",
+    "loyal-customers": "/loyal-customers?limit=100",
+    "loyal-customers-export": "/loyal-customers/export?format=ndjson",
+    "top-products": "/top-products",
+    "sales-timeseries": "/sales/timeseries?start={start}&end={end}&interval=day",
+    "basket-rules": "/basket-rules",
+}
+# Streamed straight from the database, never through the result cache
+UNCACHED_ENDPOINTS = {"loyal-customers-export"}
+
+STATEMENTS_QUERY = """
+    SELECT queryid, calls, total_exec_time, query
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND query NOT LIKE '%%pg_stat_%%';
+"""
+
+DATABASE_COUNTERS_QUERY = """
+    SELECT xact_commit + xact_rollback, tup_returned, tup_fetched, tup_inserted, tup_updated,
+           tup_deleted, blks_read, blks_hit
+    FROM pg_stat_database
+    WHERE datname = current_database();
+"""
+DATABASE_COUNTERS = ("transactions", "tup_returned", "tup_fetched", "tup_inserted", "tup_updated",
+                     "tup_deleted", "blks_read", "blks_hit")
+STATS_FLUSH_WAIT = 1.1
+
+
+# ----- Database work -----
+class DatabaseStats:
+    """Snapshots of the server's query counters, diffed around each scenario"""
+
+    def __init__(self) -> None:
+        self.conn = psycopg2.connect(**get_db_config())
+        self.conn.autocommit = True
+        cur = self.conn.cursor()
+        cur.execute("SHOW shared_preload_libraries;")
+        self.source = "pg_stat_database"
+        if "pg_stat_statements" in cur.fetchone()[0]:
+            try:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements;")
+                self.source = "pg_stat_statements"
+            except psycopg2.Error as e:
+                print(f"⚠️ pg_stat_statements unavailable, using pg_stat_database: {e}")
+        cur.close()
+
+    def snapshot(self) -> Dict[Any, Any]:
+        cur = self.conn.cursor()
+        if self.source == "pg_stat_statements":
+            cur.execute(STATEMENTS_QUERY)
+            snapshot = {row[0]: row[1:] for row in cur.fetchall()}
+        else:
+            time.sleep(STATS_FLUSH_WAIT)
+            cur.execute("SELECT pg_stat_clear_snapshot();")
+            cur.execute(DATABASE_COUNTERS_QUERY)
+            snapshot = dict(zip(DATABASE_COUNTERS, cur.fetchone()))
+        cur.close()
+        return snapshot
+
+    def delta(self, before: Dict[Any, Any], after: Dict[Any, Any], requests: int) -> Dict[str, Any]:
+        if self.source == "pg_stat_database":
+            counters = {name: after[name] - before[name] for name in DATABASE_COUNTERS}
+            counters['transactions_per_request'] = round(counters['transactions'] / max(requests, 1), 2)
+            return counters
+
+        statements = []
+        for queryid, (calls, total_ms, query) in after.items():
+            prev_calls, prev_ms, _ = before.get(queryid, (0, 0.0, None))
+            if calls > prev_calls:
+                statements.append((calls - prev_calls, total_ms - prev_ms, " ".join(query.split())))
+        queries = sum(calls for calls, _, _ in statements)
+        statements.sort(key=lambda s: s[1], reverse=True)
+        return {
+            'queries': queries,
+            'query_ms': round(sum(ms for _, ms, _ in statements), 2),
+            'queries_per_request': round(queries / max(requests, 1), 2),
+            'top_statements': [{'calls': calls, 'ms': round(ms, 2), 'query': query[:200]}
+                               for calls, ms, query in statements[:5]]
+        }
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def dataset_summary() -> Dict[str, Any]:
+    conn = psycopg2.connect(**get_db_config())
+    cur = conn.cursor()
+    summary = {}
+    for table in ("supermarkets", "products", "customers", "purchases"):
+        cur.execute(f"SELECT count(*) FROM {table};")
+        summary[table] = cur.fetchone()[0]
+    cur.execute("SELECT min(timestamp), max(timestamp) FROM purchases;")
+    first, last = cur.fetchone()
+    summary['first_purchase'] = first.isoformat() if first else None
+    summary['last_purchase'] = last.isoformat() if last else None
+    cur.execute("SHOW server_version;")
+    summary['server_version'] = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return summary
+
+
+# ----- Dataset -----
+def seed_dataset(args: argparse.Namespace) -> None:
+    """Generate the synthetic CSVs (once per parameter set) and load them"""
+    # Imported late: the loaders validate the environment and read DB settings on import
+    from benchmarks.synthetic_data import (make_products, write_products_csv, write_purchases_csv,
+                                           write_supermarkets_csv)
+    from db.load_products import load_products
+    from db.load_purchases import load_purchases
+    from db.load_supermarkets import load_supermarkets
+    from db.parallel_load_purchases import load_purchases_parallel
+
+    customers = args.seed_customers or max(1, args.seed_purchases // 4)
+    tag = f"{args.seed_purchases}_{args.stores}s_{args.products}p_{customers}c_{args.seed}"
+    os.makedirs(args.data_dir, exist_ok=True)
+    stores_csv = os.path.join(args.data_dir, f"supermarkets_{args.stores}.csv")
+    products_csv = os.path.join(args.data_dir, f"products_{args.products}_{args.seed}.csv")
+    purchases_csv = os.path.join(args.data_dir, f"purchases_{tag}.csv")
+
+    stores = [f"SMKT{i:03d}" for i in range(1, args.stores + 1)]
+    products = make_products(args.products, random.Random(args.seed))
+    write_supermarkets_csv(stores_csv, stores)
+    write_products_csv(products_csv, products)
+    if not os.path.exists(purchases_csv):
+        print(f"🧪 Generating {args.seed_purchases:,} synthetic purchases in {purchases_csv}...")
+        write_purchases_csv(purchases_csv + ".tmp", args.seed_purchases, products, stores, customers, seed=args.seed)
+        os.replace(purchases_csv + ".tmp", purchases_csv)
+
+    print("🌱 Seeding the database (files that are already loaded are skipped)...")
+    load_supermarkets(stores_csv)
+    load_products(products_csv)
+    if args.load_workers and max(args.load_workers) > 1:
+        load_purchases_parallel(purchases_csv, max(args.load_workers))
+    else:
+        load_purchases(purchases_csv)
+
+
+def load_catalog() -> Tuple[List[str], List[str]]:
+    conn = psycopg2.connect(**get_db_config())
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM supermarkets ORDER BY id;")
+    stores = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT name FROM products ORDER BY id;")
+    products = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.close()
+    return stores, products
+
+
+def make_baskets(count: int, stores: List[str], products: List[str], customers: int,
+                 seed: int, timestamps: bool = False) -> List[Dict[str, Any]]:
+    """Checkout payloads with Zipf-like item popularity and a loyal tail, as in synthetic_data"""
+    rng = random.Random(seed)
+    popularity = [1.0 / (rank + 1) for rank in range(len(products))]
+    loyal = max(1, customers // 10)
+    baskets = []
+    for _ in range(count):
+        size = min(len(products), max(1, int(rng.expovariate(1 / 3.0)) + 1))
+        basket: List[str] = []
+        while len(basket) < size:
+            name = rng.choices(products, popularity)[0]
+            if name not in basket:
+                basket.append(name)
+        customer = rng.randrange(loyal) if rng.random() < 0.5 else rng.randrange(customers)
+        purchase = {"real_id": f"bench{customer:07d}", "supermarket_id": rng.choice(stores), "item_names": basket}
+        if timestamps:
+            purchase["timestamp"] = datetime.now(timezone.utc).isoformat()
+        baskets.append(purchase)
+    return baskets
+
+
+# ----- Load generation -----
+def timed_request(url: str, payload: Optional[bytes] = None) -> Tuple[float, int]:
+    """Latency in ms and HTTP status of one request; the body is read in full"""
+    headers = {"Content-Type": "application/json"} if payload is not None else {}
+    request = urllib.request.Request(url, data=payload, headers=headers, method="POST" if payload else "GET")
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            while response.read(65536):
+                pass
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return (time.perf_counter() - started) * 1000, status
+
+
+def drive(send: Callable[[int], Tuple[float, int]], requests: int, concurrency: int) -> Tuple[List[Tuple[float, int]], float]:
+    """Issue requests 0..requests-1 from ``concurrency`` closed-loop workers"""
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker(_: int) -> List[Tuple[float, int]]:
+        results = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return results
+            results.append(send(i))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [r for batch in executor.map(worker, range(concurrency)) for r in batch]
+    return results, time.perf_counter() - started
+
+
+def summarize(name: str, concurrency: int, results: List[Tuple[float, int]], elapsed: float,
+              units_per_request: int = 1) -> Dict[str, Any]:
+    latencies = sorted(latency for latency, status in results if 200 <= status < 300)
+    summary: Dict[str, Any] = {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': len(results) - len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_per_s': round(len(latencies) * units_per_request / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': None
+    }
+    if latencies:
+        summary['latency_ms'] = {
+            'mean': round(statistics.fmean(latencies), 2),
+            'p50': round(percentile(latencies, 0.50), 2),
+            'p95': round(percentile(latencies, 0.95), 2),
+            'p99': round(percentile(latencies, 0.99), 2),
+            'max': round(latencies[-1], 2)
+        }
+    return summary
+
+
+def measure(db: DatabaseStats, name: str, concurrency: int, send: Callable[[int], Tuple[float, int]],
+            requests: int, warmup: int, units_per_request: int = 1) -> Dict[str, Any]:
+    if warmup:
+        drive(send, warmup, min(concurrency, warmup))
+    before = db.snapshot()
+    results, elapsed = drive(send, requests, concurrency)
+    summary = summarize(name, concurrency, results, elapsed, units_per_request)
+    summary['db'] = db.delta(before, db.snapshot(), len(results))
+    report(summary)
+    return summary
+
+
+def report(summary: Dict[str, Any]) -> None:
+    latency = summary['latency_ms']
+    line = (f"   {summary['scenario']:<40} c={summary['concurrency']:<4} "
+            f"{summary['throughput_per_s']:>10,.1f}/s  errors={summary['errors']}")
+    if latency:
+        line += f"  p50={latency['p50']:.1f} p95={latency['p95']:.1f} p99={latency['p99']:.1f} ms"
+    print(line)
+
+
+# ----- Scenarios -----
+def checkout_scenarios(args: argparse.Namespace, db: DatabaseStats) -> List[Dict[str, Any]]:
+    stores, products = load_catalog()
+    results = []
+    baskets = make_baskets(args.requests + args.warmup, stores, products, args.checkout_customers, args.seed)
+    payloads = [json.dumps(basket).encode() for basket in baskets]
+    for concurrency in args.concurrency:
+        results.append(measure(
+            db, "checkout", concurrency,
+            lambda i: timed_request(f"{args.cash_register_url}/purchase", payloads[i % len(payloads)]),
+            args.requests, args.warmup
+        ))
+
+    if args.batch_size:
+        batches = max(1, args.requests // args.batch_size)
+        baskets = make_baskets(batches * args.batch_size, stores, products, args.checkout_customers,
+                               args.seed + 1, timestamps=True)
+        bodies = [json.dumps({"purchases": baskets[i:i + args.batch_size]}).encode()
+                  for i in range(0, len(baskets), args.batch_size)]
+        for concurrency in args.concurrency:
+            results.append(measure(
+                db, f"purchase-batch-{args.batch_size}", concurrency,
+                lambda i: timed_request(f"{args.cash_register_url}/purchases/batch", bodies[i % len(bodies)]),
+                len(bodies), 0, units_per_request=args.batch_size
+            ))
+    return results
+
+
+def loader_scenarios(args: argparse.Namespace, db: DatabaseStats) -> List[Dict[str, Any]]:
+    from benchmarks.parallel_load import (SCRATCH_PGOPTIONS, drop_scratch_schema, reset_scratch_schema,
+                                          time_load)
+    from benchmarks.synthetic_data import make_products, write_purchases_csv
+
+    stores = [f"SMKT{i:03d}" for i in range(1, args.stores + 1)]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "purchases.csv")
+        write_purchases_csv(csv_path, args.load_purchases, make_products(args.products, random.Random(args.seed)),
+                            stores, customers=max(1, args.load_purchases // 4), seed=args.seed + 2)
+        # Connections opened by the loaders (and their worker processes) use the scratch schema
+        previous = os.environ.get("PGOPTIONS")
+        os.environ["PGOPTIONS"] = SCRATCH_PGOPTIONS
+        try:
+            for workers in [None] + sorted(set(args.load_workers)):
+                reset_scratch_schema(stores)
+                before = db.snapshot()
+                elapsed = time_load(csv_path, workers, args.range_mb * 1024 * 1024)
+                name = "load-serial" if workers is None else "load-parallel"
+                summary = summarize(name, workers or 1, [], elapsed)
+                summary.update(requests=1, rows=args.load_purchases,
+                               throughput_per_s=round(args.load_purchases / elapsed, 2))
+                summary['db'] = db.delta(before, db.snapshot(), 1)
+                report(summary)
+                results.append(summary)
+        finally:
+            if previous is None:
+                os.environ.pop("PGOPTIONS", None)
+            else:
+                os.environ["PGOPTIONS"] = previous
+            drop_scratch_schema()
+    return results
+
+
+def dashboard_scenarios(args: argparse.Namespace, db: DatabaseStats, dataset: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # A month of daily buckets ending at the newest purchase
+    last = datetime.fromisoformat(dataset['last_purchase']) if dataset['last_purchase'] else datetime.now()
+    end = datetime.combine(last.date() + timedelta(days=1), datetime.min.time())
+    window = {"start": (end - timedelta(days=31)).isoformat(), "end": end.isoformat()}
+
+    results = []
+    run_id = int(time.time())
+    for name, path in DASHBOARD_ENDPOINTS.items():
+        if args.endpoints and name not in args.endpoints:
+            continue
+        url = args.dashboard_url + path.format(**window)
+        separator = "&" if "?" in url else "?"
+        for concurrency in args.concurrency:
+            if name in UNCACHED_ENDPOINTS:
+                results.append(measure(db, f"dashboard:{name}", concurrency,
+                                       lambda i: timed_request(url), args.dashboard_requests, 0))
+                continue
+            results.append(measure(db, f"dashboard:{name}:cached", concurrency,
+                                   lambda i: timed_request(url), args.dashboard_requests, 1))
+            # Unknown query parameters are ignored by the endpoint but make every cache key unique
+            results.append(measure(db, f"dashboard:{name}:uncached", concurrency,
+                                   lambda i: timed_request(f"{url}{separator}_bench={run_id}-{concurrency}-{i}"),
+                                   args.dashboard_requests, 0))
+    return results
+
+
+# ----- Comparison -----
+def scenario_key(summary: Dict[str, Any]) -> str:
+    return f"{summary['scenario']}@{summary['concurrency']}"
+
+
+def compare(base_path: str, head_path: str, threshold: float) -> int:
+    """Print p95 and throughput changes per scenario; returns 1 if any regressed past the threshold"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+    base_results = {scenario_key(s): s for s in base['scenarios']}
+
+    def change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+        return None if not old or new is None else (new - old) / old * 100
+
+    print(f"📊 {base.get('label')} -> {head.get('label')} (regression threshold {threshold:.0f}%)")
+    print(f"{'scenario':<48}{'p95 ms':>22}{'throughput/s':>28}")
+    regressions = 0
+    for summary in head['scenarios']:
+        old = base_results.get(scenario_key(summary))
+        if old is None:
+            continue
+        p95 = (old['latency_ms'] or {}).get('p95'), (summary['latency_ms'] or {}).get('p95')
+        tput = old['throughput_per_s'], summary['throughput_per_s']
+        p95_change, tput_change = change(*p95), change(*tput)
+        regressed = (p95_change is not None and p95_change > threshold) or \
+                    (tput_change is not None and tput_change < -threshold)
+        regressions += regressed
+        p95_text = "-" if p95_change is None else f"{p95[0]:.1f} -> {p95[1]:.1f} ({p95_change:+.0f}%)"
+        tput_text = "-" if tput_change is None else f"{tput[0]:,.0f} -> {tput[1]:,.0f} ({tput_change:+.0f}%)"
+        print(f"{scenario_key(summary):<48}{p95_text:>22}{tput_text:>28}{'  ❌' if regressed else ''}")
+
+    if regressions:
+        print(f"❌ {regressions} scenario(s) regressed by more than {threshold:.0f}%")
+        return 1
+    print("✅ No regressions")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark checkouts, loaders and dashboard endpoints")
+    parser.add_argument("--cash-register-url", default="http://localhost:8000")
+    parser.add_argument("--dashboard-url", default="http://localhost:8001")
+    parser.add_argument("--scenarios", nargs="+", choices=["checkout", "loaders", "dashboard"],
+                        default=["checkout", "loaders", "dashboard"])
+    parser.add_argument("--endpoints", nargs="+", choices=sorted(DASHBOARD_ENDPOINTS),
+                        help="Dashboard endpoints to measure (default: all)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64],
+                        help="Concurrent clients; every HTTP scenario runs at each level")
+    parser.add_argument("--requests", type=int, default=2000, help="Checkouts per concurrency level")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="Purchases per POST /purchases/batch request (0 skips the batch scenario)")
+    parser.add_argument("--dashboard-requests", type=int, default=200, help="Requests per endpoint and level")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured checkouts before each level")
+    parser.add_argument("--checkout-customers", type=int, default=50_000,
+                        help="Distinct customers the checkouts are drawn from")
+    parser.add_argument("--seed-purchases", type=int, default=0,
+                        help="Synthetic purchases to seed before measuring (0 = use the data already loaded)")
+    parser.add_argument("--seed-customers", type=int, help="Distinct customers in the seed (default: purchases/4)")
+    parser.add_argument("--stores", type=int, default=20)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "supermarket-bench"),
+                        help="Where generated CSVs are kept between runs")
+    parser.add_argument("--load-purchases", type=int, default=200_000, help="Rows per loader scenario")
+    parser.add_argument("--load-workers", type=int, nargs="+", default=[2, 4],
+                        help="Parallel loader worker counts (the serial loader always runs)")
+    parser.add_argument("--range-mb", type=int, default=16)
+    parser.add_argument("--label", default="", help="Name of this run, e.g. the git commit")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"),
+                        help="Compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="With --compare, exit 1 when p95 or throughput worsens by more than this percent")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    if args.seed_purchases:
+        seed_dataset(args)
+    dataset = dataset_summary()
+    db = DatabaseStats()
+    run: Dict[str, Any] = {
+        'label': args.label,
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'host': {'cpus': os.cpu_count(), 'python': platform.python_version(), 'platform': platform.platform()},
+        'config': {k: v for k, v in vars(args).items() if k not in ("compare", "output", "threshold")},
+        'dataset': dataset,
+        'db_stats_source': db.source,
+        'scenarios': []
+    }
+    print(f"🏁 {dataset['purchases']:,} purchases, {dataset['customers']:,} customers, "
+          f"{dataset['products']:,} products, {dataset['supermarkets']} stores (db stats: {db.source})")
+
+    try:
+        if "checkout" in args.scenarios:
+            run['cash_register'] = fetch_json(f"{args.cash_register_url}/health").get("mode")
+            print(f"🛒 Checkouts (mode={run['cash_register']})")
+            run['scenarios'] += checkout_scenarios(args, db)
+        if "dashboard" in args.scenarios:
+            print("📈 Dashboard endpoints")
+            run['scenarios'] += dashboard_scenarios(args, db, dataset)
+        if "loaders" in args.scenarios:
+            print(f"💾 Loaders ({args.load_purchases:,} purchases into a scratch schema)")
+            run['scenarios'] += loader_scenarios(args, db)
+    finally:
+        db.close()
+
+    run['finished_at'] = datetime.now(timezone.utc).isoformat()
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Synthetic CSV generator shaped like the sample data: most customers shop once
+while a small loyal tail shops repeatedly, baskets hold a few items, and a few
+staple products appear in most baskets (Zipf-like popularity).
+
+    python -m benchmarks.synthetic_data --purchases 1000000 --out /tmp/purchases.csv
+"""
+
+import argparse
+import csv
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+
+def make_products(count: int, rng: random.Random) -> Dict[str, float]:
+    return {f"product {i:05d}": round(rng.uniform(0.5, 20.0), 2) for i in range(count)}
+
+
+def write_products_csv(path: str, products: Dict[str, float]) -> None:
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(["product_name", "unit_price"])
+        writer.writerows(products.items())
+
+
+def write_supermarkets_csv(path: str, stores: List[str]) -> None:
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id"])
+        writer.writerows([store] for store in stores)
+
+
+def write_purchases_csv(path: str, purchases: int, products: Dict[str, float], stores: List[str],
+                        customers: int, loyal_share: float = 0.1, seed: int = 42) -> None:
+    """Write ``purchases`` rows; ``loyal_share`` of the customers make most repeat visits"""
+    rng = random.Random(seed)
+    names = list(products)
+    popularity = [1.0 / (rank + 1) for rank in range(len(names))]
+    customer_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(customers)]
+    loyal = customer_ids[:max(1, int(customers * loyal_share))]
+    start = datetime(2025, 1, 1)
+
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(["supermarket_id", "timestamp", "user_id", "items_list", "total_amount"])
+        for _ in range(purchases):
+            size = min(len(names), max(1, int(rng.expovariate(1 / 3.0)) + 1))
+            basket: List[str] = []
+            while len(basket) < size:
+                name = rng.choices(names, popularity)[0]
+                if name not in basket:
+                    basket.append(name)
+            user = rng.choice(loyal) if rng.random() < 0.5 else rng.choice(customer_ids)
+            timestamp = start + timedelta(seconds=rng.randrange(365 * 24 * 3600), microseconds=rng.randrange(10 ** 6))
+            writer.writerow([
+                rng.choice(stores),
+                timestamp.isoformat(),
+                user,
+                ",".join(basket),
+                round(sum(products[name] for name in basket), 2)
+            ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic supermarket CSV files")
+    parser.add_argument("--purchases", type=int, default=100_000)
+    parser.add_argument("--customers", type=int, default=50_000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--stores", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="purchases_synthetic.csv", help="Purchases CSV path")
+    parser.add_argument("--products-out", help="Also write the matching products CSV here")
+    parser.add_argument("--stores-out", help="Also write the matching supermarkets CSV here")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    products = make_products(args.products, rng)
+    stores = [f"SMKT{i:03d}" for i in range(1, args.stores + 1)]
+    write_purchases_csv(args.out, args.purchases, products, stores, args.customers, seed=args.seed)
+    if args.products_out:
+        write_products_csv(args.products_out, products)
+    if args.stores_out:
+        write_supermarkets_csv(args.stores_out, stores)
+    print(f"✅ Wrote {args.purchases:,} purchases to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
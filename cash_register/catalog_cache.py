@@ -0,0 +1,196 @@
+"""
+In-process cache of the product catalog and supermarket list.
+
+The products and supermarkets tables are nearly static, so the cash register keeps
+them in memory and prices/validates purchases without touching the database.
+A snapshot is reloaded when its TTL expires or when it is invalidated, either
+explicitly or by a ``catalog_changed`` NOTIFY sent by the triggers in db/init.sql.
+"""
+import asyncio
+import os
+import select
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence
+
+import psycopg2
+import psycopg2.extensions
+
+from shared.db_config import get_db_config, get_async_db_pool, pooled_connection
+
+CATALOG_CHANNEL = "catalog_changed"
+PRODUCTS_QUERY = "SELECT name, price FROM products ORDER BY name"
+SUPERMARKETS_QUERY = "SELECT id FROM supermarkets ORDER BY id"
+
+
+def get_catalog_cache_config() -> Dict[str, Any]:
+    """Get catalog cache settings from environment variables"""
+    return {
+        'ttl': float(os.getenv("CATALOG_CACHE_TTL", "300")),
+        'listen': os.getenv("CATALOG_CACHE_LISTEN", "true").lower() in ("1", "true", "yes")
+    }
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Immutable view of the catalog; readers never see a half-loaded state"""
+    version: int
+    loaded_at: float
+    prices: Dict[str, Decimal]
+    products: List[Dict[str, Any]]
+    supermarkets: List[str]
+    supermarket_ids: FrozenSet[str] = field(init=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, 'supermarket_ids', frozenset(self.supermarkets))
+
+    @property
+    def product_count(self) -> int:
+        return len(self.prices)
+
+
+class CatalogCache:
+    """TTL cache of the catalog with explicit and LISTEN/NOTIFY-driven invalidation"""
+
+    def __init__(self, ttl: float = 300.0, listen: bool = True):
+        self.ttl = ttl
+        self.listen = listen
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._async_lock: Optional[asyncio.Lock] = None
+        self._stop = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+        self._stats = {'hits': 0, 'refreshes': 0, 'invalidations': 0, 'notifications': 0}
+
+    def _load(self) -> CatalogSnapshot:
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(PRODUCTS_QUERY)
+            product_rows = cur.fetchall()
+            cur.execute(SUPERMARKETS_QUERY)
+            supermarkets = [row[0] for row in cur.fetchall()]
+            cur.close()
+        return self._build(product_rows, supermarkets)
+
+    async def _load_async(self) -> CatalogSnapshot:
+        async with get_async_db_pool().connection() as conn:
+            product_rows = await conn.fetch(PRODUCTS_QUERY)
+            supermarkets = [row[0] for row in await conn.fetch(SUPERMARKETS_QUERY)]
+        return self._build(product_rows, supermarkets)
+
+    def _build(self, product_rows: Sequence[Sequence[Any]], supermarkets: List[str]) -> CatalogSnapshot:
+        self._version += 1
+        return CatalogSnapshot(
+            version=self._version,
+            loaded_at=time.time(),
+            # Exact money arithmetic; str() also copes with a not-yet-migrated FLOAT column
+            prices={name: Decimal(str(price)) for name, price in product_rows},
+            products=[{"name": name, "price": float(price)} for name, price in product_rows],
+            supermarkets=supermarkets
+        )
+
+    def _is_fresh(self, snapshot: Optional[CatalogSnapshot]) -> bool:
+        return snapshot is not None and time.time() - snapshot.loaded_at < self.ttl
+
+    def get(self) -> CatalogSnapshot:
+        """Return the current snapshot, reloading it once if it is missing or expired"""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            self._stats['hits'] += 1
+            return snapshot
+
+        with self._lock:
+            # Another thread may have refreshed while we were waiting for the lock
+            snapshot = self._snapshot
+            if not self._is_fresh(snapshot):
+                generation = self._generation
+                snapshot = self._load()
+                self._stats['refreshes'] += 1
+                # Don't cache a snapshot that an invalidation raced with
+                if generation == self._generation:
+                    self._snapshot = snapshot
+        return snapshot
+
+    async def aget(self) -> CatalogSnapshot:
+        """Async variant of get() that reloads through the asyncpg pool"""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            self._stats['hits'] += 1
+            return snapshot
+
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            snapshot = self._snapshot
+            if not self._is_fresh(snapshot):
+                generation = self._generation
+                snapshot = await self._load_async()
+                self._stats['refreshes'] += 1
+                if generation == self._generation:
+                    self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self) -> None:
+        """Drop the current snapshot so the next read reloads it"""
+        self._generation += 1
+        self._snapshot = None
+        self._stats['invalidations'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            **self._stats,
+            'version': snapshot.version if snapshot else None,
+            'age_s': round(time.time() - snapshot.loaded_at, 3) if snapshot else None,
+            'ttl_s': self.ttl,
+            'listening': self._listener is not None and self._listener.is_alive()
+        }
+
+    # ----- LISTEN/NOTIFY invalidation -----
+    def start(self) -> None:
+        """Start the background listener that invalidates on catalog NOTIFYs"""
+        if not self.listen or self._listener is not None:
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen_loop, name="catalog-listener", daemon=True)
+        self._listener.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+    def _listen_loop(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**get_db_config())
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {CATALOG_CHANNEL};")
+                cur.close()
+                # Changes made while we were not listening would otherwise be missed
+                self.invalidate()
+                backoff = 1.0
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        self._stats['notifications'] += len(conn.notifies)
+                        conn.notifies.clear()
+                        self.invalidate()
+            except psycopg2.Error as e:
+                print(f"⚠️ Catalog listener error, reconnecting in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    conn.close()
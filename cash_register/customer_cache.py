@@ -0,0 +1,112 @@
+"""
+In-process LRU cache of customer real_id → uuid mappings.
+
+A customer's uuid never changes once assigned, so the cash register resolves
+repeat shoppers from memory and only goes to the database for customers it has
+not seen recently. Misses are resolved with a single
+``INSERT ... ON CONFLICT ... RETURNING`` upsert, so two tills registering the same
+new customer at once both get the one uuid that was stored. The cache is bounded
+to ``max_entries`` (least recently used entries are evicted) and can be filled
+from the customers table at startup with the most frequent shoppers first.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+from shared.db_config import get_async_db_pool, pooled_connection
+
+# Most frequent shoppers first, per the dashboard rollup (db/init.sql, section 7)
+PREWARM_QUERY = """
+    SELECT c.real_id, c.uuid
+    FROM customer_purchase_rollup r
+    JOIN customers c ON c.uuid = r.user_id
+    ORDER BY r.purchase_count DESC
+    LIMIT %s;
+"""
+PREWARM_QUERY_ASYNC = PREWARM_QUERY.replace("%s", "$1")
+
+
+def get_customer_cache_config() -> Dict[str, Any]:
+    """Get customer cache settings from environment variables"""
+    return {
+        'max_entries': int(os.getenv("CUSTOMER_CACHE_MAX_ENTRIES", "100000")),
+        'prewarm': os.getenv("CUSTOMER_CACHE_PREWARM", "false").lower() in ("1", "true", "yes")
+    }
+
+
+class CustomerCache:
+    """Thread-safe bounded LRU map of real_id to customer uuid with hit/miss counters"""
+
+    def __init__(self, max_entries: int = 100000, prewarm: bool = False):
+        self.max_entries = max_entries
+        self.prewarm = prewarm
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'prewarmed': 0}
+
+    def get(self, real_id: str) -> Optional[str]:
+        """Cached uuid for a normalized real_id, or None; counts a hit or a miss"""
+        with self._lock:
+            user_uuid = self._entries.get(real_id)
+            if user_uuid is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(real_id)
+            self._stats['hits'] += 1
+            return user_uuid
+
+    def put(self, real_id: str, user_uuid: Any) -> None:
+        self.put_many(((real_id, user_uuid),))
+
+    def put_many(self, items: Iterable[Tuple[str, Any]]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for real_id, user_uuid in items:
+                self._entries[real_id] = str(user_uuid)
+                self._entries.move_to_end(real_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def discard(self, real_id: str) -> None:
+        with self._lock:
+            self._entries.pop(real_id, None)
+
+    def _fill(self, rows: Sequence[Sequence[Any]]) -> None:
+        # Least frequent first, so the most frequent shoppers are the last to be evicted
+        self.put_many((real_id, user_uuid) for real_id, user_uuid in reversed(rows))
+        self._stats['prewarmed'] += len(rows)
+        print(f"👥 Customer cache pre-warmed with {len(rows):,} customers")
+
+    def warm(self) -> None:
+        """Load the most frequent shoppers (up to max_entries) if pre-warming is enabled"""
+        if not self.prewarm or self.max_entries <= 0:
+            return
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(PREWARM_QUERY, (self.max_entries,))
+            rows = cur.fetchall()
+            cur.close()
+        self._fill(rows)
+
+    async def warm_async(self) -> None:
+        """Async variant of warm() that loads through the asyncpg pool"""
+        if not self.prewarm or self.max_entries <= 0:
+            return
+        async with get_async_db_pool().connection() as conn:
+            rows = await conn.fetch(PREWARM_QUERY_ASYNC, self.max_entries)
+        self._fill(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        return {
+            **stats,
+            'size': size,
+            'max_entries': self.max_entries,
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else None
+        }
@@ -0,0 +1,47 @@
+import csv
+import io
+from typing import IO, Iterable, List, Sequence
+
+
+def parse_header(header_line: str, expected_columns: Sequence[str]) -> List[str]:
+    """Parse a CSV header line and check it holds exactly the expected columns (any order)"""
+    columns = [c.strip() for c in next(csv.reader([header_line.lstrip('\ufeff')]))]
+    if sorted(columns) != sorted(expected_columns):
+        raise ValueError(f"Unexpected CSV columns {columns}, expected {list(expected_columns)}")
+    return columns
+
+
+def copy_csv(cur, table: str, columns: Sequence[str], data: IO) -> None:
+    """Stream header-less CSV rows from a file-like object into a table with COPY"""
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", data)
+
+
+def copy_csv_file(cur, table: str, csv_path: str, expected_columns: Sequence[str]) -> None:
+    """COPY a whole CSV file (with header) into a table, mapping columns by header name"""
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        columns = parse_header(f.readline(), expected_columns)
+        copy_csv(cur, table, columns, f)
+
+
+def lines_to_file(lines: List[bytes]) -> IO[bytes]:
+    return io.BytesIO(b''.join(lines))
+
+
+class IterStream:
+    """Minimal read-only file object over an iterator of byte strings, for streaming COPY input"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
@@ -4,16 +4,27 @@ Unified data initialization script that loads all data in the correct order.
 This replaces the separate load_supermarkets, load_products, and load_purchases services.
 """
 
+import argparse
 import sys
 from typing import NoReturn
 
 from db.load_supermarkets import load_supermarkets
 from db.load_products import load_products
-from db.load_purchases import load_purchases
+from db.load_purchases import load_purchases, DEFAULT_CHUNK_ROWS
+from db.parallel_load_purchases import load_purchases_parallel, DEFAULT_RANGE_BYTES
 
 
 def main() -> None:
     """Load all data in the correct dependency order."""
+    parser = argparse.ArgumentParser(description="Load supermarkets, products and purchases from CSV")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="Purchases copied and committed per chunk (bounds memory and resume granularity)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes for the purchases import (1 = serial chunked load)")
+    parser.add_argument("--range-mb", type=int, default=DEFAULT_RANGE_BYTES // (1024 * 1024),
+                        help="Size of the byte ranges the purchases file is split into for parallel loading")
+    args = parser.parse_args()
+    
     try:
         print("🚀 Starting data initialization...")
         print()
@@ -32,7 +43,10 @@ def main() -> None:
         
         # Step 3: Load purchases (depends on supermarkets and products)
         print("💳 Loading purchases...")
-        load_purchases("/app/purchases.csv")
+        if args.workers > 1:
+            load_purchases_parallel("/app/purchases.csv", args.workers, range_bytes=args.range_mb * 1024 * 1024)
+        else:
+            load_purchases("/app/purchases.csv", chunk_rows=args.chunk_rows)
         print("✅ Purchases loaded successfully!")
         print()
         
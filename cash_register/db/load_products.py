@@ -1,7 +1,7 @@
-import csv
 import psycopg2
 
 from shared.db_config import validate_env_vars, get_db_config
+from db.copy_utils import copy_csv_file
 
 # Validate environment variables on startup
 validate_env_vars()
@@ -12,16 +12,28 @@ def load_products(csv_path: str) -> None:
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
 
-    with open(csv_path, newline='', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            name: str = row["product_name"].strip()
-            price: float = float(row["unit_price"])
-            cur.execute("""
-                INSERT INTO products (name, price)
-                VALUES (%s, %s)
-                ON CONFLICT (name) DO NOTHING;
-            """, (name, price))
+    # Stream the file into a staging table, then insert the new products in one statement
+    cur.execute("""
+        CREATE TEMP TABLE products_staging (
+            line_no BIGSERIAL,
+            product_name TEXT,
+            unit_price TEXT
+        ) ON COMMIT DROP;
+    """)
+    copy_csv_file(cur, "products_staging", csv_path, ["product_name", "unit_price"])
+
+    # First occurrence of a name wins and ids follow file order, as with row-by-row inserts
+    cur.execute("""
+        INSERT INTO products (name, price)
+        SELECT name, price FROM (
+            SELECT DISTINCT ON (btrim(product_name))
+                btrim(product_name) AS name, unit_price::numeric AS price, line_no
+            FROM products_staging
+            ORDER BY btrim(product_name), line_no
+        ) first_seen
+        ORDER BY line_no
+        ON CONFLICT (name) DO NOTHING;
+    """)
 
     conn.commit()
     cur.close()
@@ -29,4 +41,4 @@ def load_products(csv_path: str) -> None:
 
 if __name__ == "__main__":
     load_products("products_list.csv")
-    print("✅ Products loaded.")
\ No newline at end of file
+    print("✅ Products loaded.")
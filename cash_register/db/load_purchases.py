@@ -1,55 +1,213 @@
-import csv
+import os
+import time
+from itertools import islice
+from typing import Optional, Tuple
+
 import psycopg2
-from typing import Set, List
 
 from shared.db_config import validate_env_vars, get_db_config
+from db.copy_utils import parse_header, copy_csv, lines_to_file
 
 # Validate environment variables on startup
 validate_env_vars()
 
 DB_CONFIG = get_db_config()
 
-def load_purchases(csv_path: str) -> None:
+PURCHASE_CSV_COLUMNS = ["supermarket_id", "timestamp", "user_id", "items_list", "total_amount"]
+DEFAULT_CHUNK_ROWS = 100_000
+
+# Raw CSV rows for the current chunk; emptied by every commit
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS purchases_staging (
+        line_no BIGSERIAL,
+        supermarket_id TEXT,
+        timestamp TEXT,
+        user_id TEXT,
+        items_list TEXT,
+        total_amount TEXT
+    ) ON COMMIT DELETE ROWS;
+"""
+
+# Customers not seen before get real_id customerNNNNNN, numbered in order of first
+# appearance in the file, continuing from the last number already assigned
+LAST_CUSTOMER_NUMBER_SQL = """
+    SELECT COALESCE(MAX(substring(real_id FROM 9)::bigint), 0)
+    FROM customers
+    WHERE real_id ~ '^customer[0-9]+$';
+"""
+
+# Templates are shared with db.parallel_load_purchases, which stages rows keyed by byte position
+INSERT_CUSTOMERS_SQL_TEMPLATE = """
+    INSERT INTO customers (real_id, uuid)
+    SELECT 'customer' || lpad(n::text, greatest(6, length(n::text)), '0'), user_id
+    FROM (
+        SELECT user_id, %(customer_counter)s + row_number() OVER (ORDER BY first_line) AS n
+        FROM (
+            SELECT btrim(user_id)::uuid AS user_id, min({order_column}) AS first_line
+            FROM {staging}
+            GROUP BY 1
+        ) first_seen
+        WHERE NOT EXISTS (SELECT 1 FROM customers c WHERE c.uuid = first_seen.user_id)
+    ) numbered
+    ON CONFLICT (uuid) DO NOTHING;
+"""
+
+# Monthly partitions for the staged rows, so they do not land in purchases_default
+CREATE_PARTITIONS_SQL_TEMPLATE = """
+    SELECT create_purchase_partitions(MIN(btrim(timestamp)::timestamp), MAX(btrim(timestamp)::timestamp))
+    FROM {staging};
+"""
+
+INSERT_PURCHASES_SQL_TEMPLATE = """
+    INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount)
+    SELECT
+        btrim(supermarket_id),
+        btrim(timestamp)::timestamp,
+        btrim(user_id)::uuid,
+        ARRAY(
+            SELECT btrim(item)
+            FROM unnest(string_to_array(btrim(items_list), ',')) WITH ORDINALITY AS i(item, ord)
+            ORDER BY ord
+        ),
+        total_amount::numeric
+    FROM {staging}
+    {where}
+    ORDER BY {order_column};
+"""
+
+INSERT_CUSTOMERS_SQL = INSERT_CUSTOMERS_SQL_TEMPLATE.format(staging="purchases_staging", order_column="line_no")
+CREATE_PARTITIONS_SQL = CREATE_PARTITIONS_SQL_TEMPLATE.format(staging="purchases_staging")
+INSERT_PURCHASES_SQL = INSERT_PURCHASES_SQL_TEMPLATE.format(staging="purchases_staging", where="", order_column="line_no")
+
+SAVE_PROGRESS_SQL = """
+    INSERT INTO data_load_progress (source, file_size, byte_offset, rows_loaded, customer_counter, completed, updated_at)
+    VALUES (%(source)s, %(file_size)s, %(byte_offset)s, %(rows_loaded)s, %(customer_counter)s, %(completed)s, now())
+    ON CONFLICT (source) DO UPDATE SET
+        byte_offset = EXCLUDED.byte_offset,
+        rows_loaded = EXCLUDED.rows_loaded,
+        customer_counter = EXCLUDED.customer_counter,
+        completed = EXCLUDED.completed,
+        updated_at = EXCLUDED.updated_at;
+"""
+
+
+def progress_source(csv_path: str, parallel: bool = False) -> str:
+    """data_load_progress key of a purchases file; the two loaders track it separately"""
+    prefix = "parallel-purchases" if parallel else "purchases"
+    return f"{prefix}:{os.path.abspath(csv_path)}"
+
+
+def get_progress(cur, source: str) -> Optional[Tuple[int, int, int, int, bool]]:
+    """(file_size, byte_offset, rows_loaded, customer_counter, completed) of a previous load"""
+    cur.execute("""
+        SELECT file_size, byte_offset, rows_loaded, customer_counter, completed
+        FROM data_load_progress WHERE source = %s;
+    """, (source,))
+    return cur.fetchone()
+
+
+def load_purchases(csv_path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> None:
+    """Stream a purchases CSV into the database in COPY-based chunks.
+
+    Each chunk is copied into a staging table, its new customers and purchases are
+    inserted set-based, and the file offset reached is recorded in
+    data_load_progress - all in one transaction. Memory is bounded by chunk_rows,
+    and a load that dies partway through resumes from the last committed chunk.
+    """
+    source = progress_source(csv_path)
+    file_size = os.path.getsize(csv_path)
+
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
-    
-    # Keep track of UUIDs we've seen to create unique customer records
-    seen_uuids: Set[str] = set()
-    customer_counter: int = 1
-    
-    with open(csv_path, newline='', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            supermarket_id: str = row["supermarket_id"].strip()
-            timestamp: str = row["timestamp"].strip()
-            user_uuid: str = row["user_id"].strip()
-            items_list: str = row["items_list"].strip()
-            total_amount: float = float(row["total_amount"])
-            
-            # Convert comma-separated items to PostgreSQL array format
-            items_array: List[str] = [item.strip() for item in items_list.split(',')]
-            
-            # Insert customer record if we haven't seen this UUID before
-            if user_uuid not in seen_uuids:
-                real_id: str = f"customer{customer_counter:06d}"
-                cur.execute("""
-                    INSERT INTO customers (real_id, uuid)
-                    VALUES (%s, %s)
-                    ON CONFLICT (uuid) DO NOTHING;
-                """, (real_id, user_uuid))
-                seen_uuids.add(user_uuid)
-                customer_counter += 1
-            
-            # Insert the purchase
-            cur.execute("""
-                INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount)
-                VALUES (%s, %s, %s, %s, %s);
-            """, (supermarket_id, timestamp, user_uuid, items_array, total_amount))
-    
+    cur.execute(CREATE_STAGING_SQL)
+
+    parallel = get_progress(cur, progress_source(csv_path, parallel=True))
+    if parallel and parallel[4]:
+        print(f"⏭️ {csv_path} already loaded ({parallel[2]:,} purchases), skipping")
+        conn.close()
+        return
+    if parallel:
+        raise ValueError(
+            f"{csv_path} is partially loaded by the parallel loader; resume it with --workers, "
+            f"or delete its data_load_progress rows to load it again"
+        )
+
+    byte_offset, rows_loaded = 0, 0
+    progress = get_progress(cur, source)
+    if progress:
+        recorded_size, byte_offset, rows_loaded, customer_counter, completed = progress
+        if recorded_size != file_size:
+            raise ValueError(
+                f"{csv_path} changed size since a previous load ({recorded_size} -> {file_size} bytes); "
+                f"delete its data_load_progress row to load it again"
+            )
+        if completed:
+            print(f"⏭️ {csv_path} already loaded ({rows_loaded:,} purchases), skipping")
+            conn.close()
+            return
+        print(f"↩️ Resuming {csv_path} at byte {byte_offset:,} ({rows_loaded:,} purchases already loaded)")
+    else:
+        cur.execute(LAST_CUSTOMER_NUMBER_SQL)
+        customer_counter = cur.fetchone()[0]
+
+    started = time.monotonic()
+    loaded_this_run = 0
+    customers_this_run = 0
+
+    with open(csv_path, 'rb') as f:
+        columns = parse_header(f.readline().decode('utf-8-sig'), PURCHASE_CSV_COLUMNS)
+        if byte_offset:
+            f.seek(byte_offset)
+
+        while True:
+            chunk = list(islice(f, chunk_rows))
+            if not chunk:
+                break
+            # A run of blank lines can fill a whole chunk without being the end of the file
+            lines = [line for line in chunk if line.strip()]
+            if not lines:
+                continue
+
+            copy_csv(cur, "purchases_staging", columns, lines_to_file(lines))
+            cur.execute(INSERT_CUSTOMERS_SQL, {"customer_counter": customer_counter})
+            customer_counter += cur.rowcount
+            customers_this_run += cur.rowcount
+            cur.execute(CREATE_PARTITIONS_SQL)
+            cur.execute(INSERT_PURCHASES_SQL)
+            rows_loaded += cur.rowcount
+            loaded_this_run += cur.rowcount
+
+            byte_offset = f.tell()
+            cur.execute(SAVE_PROGRESS_SQL, {
+                "source": source,
+                "file_size": file_size,
+                "byte_offset": byte_offset,
+                "rows_loaded": rows_loaded,
+                "customer_counter": customer_counter,
+                "completed": False
+            })
+            conn.commit()
+
+            elapsed = time.monotonic() - started
+            print(f"   📦 {rows_loaded:,} purchases, {customers_this_run:,} new customers "
+                  f"({byte_offset / file_size:.0%}) - {loaded_this_run / elapsed:,.0f} rows/s")
+
+    cur.execute(SAVE_PROGRESS_SQL, {
+        "source": source,
+        "file_size": file_size,
+        "byte_offset": file_size,
+        "rows_loaded": rows_loaded,
+        "customer_counter": customer_counter,
+        "completed": True
+    })
     conn.commit()
     cur.close()
     conn.close()
 
+    elapsed = time.monotonic() - started
+    print(f"   ⏱️ {loaded_this_run:,} purchases in {elapsed:.1f}s "
+          f"({loaded_this_run / elapsed if elapsed else 0:,.0f} rows/s)")
+
 if __name__ == "__main__":
     load_purchases("/app/purchases.csv")
     print("✅ Purchases loaded.")
@@ -1,7 +1,7 @@
-import csv
 import psycopg2
 
 from shared.db_config import validate_env_vars, get_db_config
+from db.copy_utils import copy_csv_file
 
 # Validate environment variables on startup
 validate_env_vars()
@@ -12,17 +12,14 @@ def load_supermarkets(csv_path: str) -> None:
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
     
-    with open(csv_path, newline='', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            supermarket_id: str = row["id"].strip()
-            
-            # Insert supermarket record
-            cur.execute("""
-                INSERT INTO supermarkets (id)
-                VALUES (%s)
-                ON CONFLICT (id) DO NOTHING;
-            """, (supermarket_id,))
+    # Stream the file into a staging table, then insert the new IDs in one statement
+    cur.execute("CREATE TEMP TABLE supermarkets_staging (id TEXT) ON COMMIT DROP;")
+    copy_csv_file(cur, "supermarkets_staging", csv_path, ["id"])
+    cur.execute("""
+        INSERT INTO supermarkets (id)
+        SELECT DISTINCT btrim(id) FROM supermarkets_staging
+        ON CONFLICT (id) DO NOTHING;
+    """)
     
     conn.commit()
     cur.close()
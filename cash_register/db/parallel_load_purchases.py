@@ -0,0 +1,238 @@
+"""
+Parallel purchases import for large files.
+
+The CSV is split into newline-aligned byte ranges that a process pool loads
+concurrently, each worker on its own connection:
+
+1. stage   - every range is COPYed into an unlogged staging table, each row keyed
+             by its byte position in the file (a global, file-ordered key)
+2. customers - one set-based statement numbers new customers by first byte
+             position, so real_ids are deterministic and identical to a serial load
+3. insert  - every range's purchases are inserted from staging
+
+Each range (and the customer step) commits together with its data_load_progress
+row, so a run that dies partway through resumes with the unfinished work only.
+Progress is kept under its own "parallel-purchases:<path>" key, apart from the
+serial loader's, along with the range size the file was split with: range rows
+are keyed by start byte, so a run with a different --range-mb refuses to resume.
+Purchase ids follow completion order of the ranges rather than file order.
+"""
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+
+from shared.db_config import validate_env_vars, get_db_config
+from db.copy_utils import parse_header, copy_csv, IterStream
+from db.load_purchases import (
+    PURCHASE_CSV_COLUMNS,
+    LAST_CUSTOMER_NUMBER_SQL,
+    INSERT_CUSTOMERS_SQL_TEMPLATE,
+    CREATE_PARTITIONS_SQL_TEMPLATE,
+    INSERT_PURCHASES_SQL_TEMPLATE,
+    SAVE_PROGRESS_SQL,
+    get_progress,
+    progress_source,
+)
+
+# Validate environment variables on startup
+validate_env_vars()
+
+DB_CONFIG = get_db_config()
+
+DEFAULT_RANGE_BYTES = 32 * 1024 * 1024
+
+# One connection per worker process, opened by the pool initializer
+_worker_conn: Optional[psycopg2.extensions.connection] = None
+
+
+def _init_worker() -> None:
+    global _worker_conn
+    _worker_conn = psycopg2.connect(**DB_CONFIG)
+
+
+def split_ranges(csv_path: str, range_bytes: int) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """Header columns and newline-aligned [start, end) byte ranges covering the data rows"""
+    file_size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as f:
+        columns = parse_header(f.readline().decode('utf-8-sig'), PURCHASE_CSV_COLUMNS)
+        boundaries = [f.tell()]
+        while boundaries[-1] + range_bytes < file_size:
+            f.seek(boundaries[-1] + range_bytes)
+            f.readline()  # move to the start of the next line
+            if f.tell() >= file_size:
+                break
+            boundaries.append(f.tell())
+    boundaries.append(file_size)
+    return columns, [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def _positioned_lines(csv_path: str, start: int, end: int) -> Iterator[bytes]:
+    """Yield the range's rows as CSV lines prefixed with their byte position"""
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield b'%d,%s' % (pos, line if line.endswith(b'\n') else line + b'\n')
+            pos += len(line)
+
+
+def _save_progress(cur, source: str, file_size: int, byte_offset: int, rows_loaded: int,
+                   customer_counter: int = 0, completed: bool = True) -> None:
+    cur.execute(SAVE_PROGRESS_SQL, {
+        "source": source,
+        "file_size": file_size,
+        "byte_offset": byte_offset,
+        "rows_loaded": rows_loaded,
+        "customer_counter": customer_counter,
+        "completed": completed
+    })
+
+
+def _stage_range(task: Dict[str, Any]) -> int:
+    cur = _worker_conn.cursor()
+    copy_csv(cur, task["staging"], ["byte_pos"] + task["columns"],
+             IterStream(_positioned_lines(task["csv_path"], task["start"], task["end"])))
+    rows = cur.rowcount
+    _save_progress(cur, f"{task['source']}:stage:{task['start']}", task["file_size"], task["end"], rows)
+    _worker_conn.commit()
+    cur.close()
+    return rows
+
+
+def _insert_range(task: Dict[str, Any]) -> int:
+    cur = _worker_conn.cursor()
+    cur.execute(INSERT_PURCHASES_SQL_TEMPLATE.format(
+        staging=task["staging"],
+        where="WHERE byte_pos >= %(start)s AND byte_pos < %(end)s",
+        order_column="byte_pos"
+    ), {"start": task["start"], "end": task["end"]})
+    rows = cur.rowcount
+    _save_progress(cur, f"{task['source']}:insert:{task['start']}", task["file_size"], task["end"], rows)
+    _worker_conn.commit()
+    cur.close()
+    return rows
+
+
+def load_purchases_parallel(csv_path: str, workers: int, range_bytes: int = DEFAULT_RANGE_BYTES) -> None:
+    """Load a purchases CSV with a pool of worker processes (see module docstring)"""
+    source = progress_source(csv_path, parallel=True)
+    file_size = os.path.getsize(csv_path)
+    staging = f"purchases_import_{hashlib.md5(source.encode()).hexdigest()[:12]}"
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+
+    serial = get_progress(cur, progress_source(csv_path))
+    if serial and serial[4]:
+        print(f"⏭️ {csv_path} already loaded ({serial[2]:,} purchases), skipping")
+        conn.close()
+        return
+    if serial:
+        raise ValueError(
+            f"{csv_path} is partially loaded by the serial loader; resume it without --workers, "
+            f"or delete its data_load_progress row to load it again"
+        )
+
+    progress = get_progress(cur, source)
+    if progress:
+        recorded_size, _, rows_loaded, customer_counter, completed = progress
+        if recorded_size != file_size:
+            raise ValueError(
+                f"{csv_path} changed size since a previous load ({recorded_size} -> {file_size} bytes); "
+                f"delete its data_load_progress rows to load it again"
+            )
+        if completed:
+            print(f"⏭️ {csv_path} already loaded ({rows_loaded:,} purchases), skipping")
+            conn.close()
+            return
+        # The range size is kept in byte_offset of the ":ranges" row
+        ranges_progress = get_progress(cur, f"{source}:ranges")
+        if ranges_progress is None or ranges_progress[1] != range_bytes:
+            recorded = f"{ranges_progress[1] // (1024 * 1024)} MB" if ranges_progress else "an unknown range size"
+            raise ValueError(
+                f"{csv_path} was partially loaded with {recorded} ranges; resume it with the same --range-mb, "
+                f"or delete its data_load_progress rows to load it again"
+            )
+        print(f"↩️ Resuming parallel load of {csv_path}")
+    else:
+        cur.execute(LAST_CUSTOMER_NUMBER_SQL)
+        customer_counter = cur.fetchone()[0]
+        cur.execute(f"DROP TABLE IF EXISTS {staging};")
+        cur.execute(f"""
+            CREATE UNLOGGED TABLE {staging} (
+                byte_pos BIGINT NOT NULL,
+                supermarket_id TEXT,
+                timestamp TEXT,
+                user_id TEXT,
+                items_list TEXT,
+                total_amount TEXT
+            );
+        """)
+        _save_progress(cur, source, file_size, 0, 0, customer_counter, completed=False)
+        _save_progress(cur, f"{source}:ranges", file_size, range_bytes, 0, completed=False)
+        conn.commit()
+
+    cur.execute("""
+        SELECT source FROM data_load_progress
+        WHERE starts_with(source, %s) AND completed;
+    """, (f"{source}:",))
+    done = {row[0] for row in cur.fetchall()}
+    conn.commit()
+
+    columns, ranges = split_ranges(csv_path, range_bytes)
+    tasks = [{
+        "source": source, "staging": staging, "columns": columns, "csv_path": csv_path,
+        "file_size": file_size, "start": start, "end": end
+    } for start, end in ranges]
+    print(f"   🧩 {len(ranges)} ranges of ~{range_bytes // (1024 * 1024)} MB, {workers} workers")
+
+    started = time.monotonic()
+    # spawn, not fork: children must not inherit this process's open connection
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker) as pool:
+        pending = [t for t in tasks if f"{source}:stage:{t['start']}" not in done]
+        staged = sum(pool.map(_stage_range, pending))
+        print(f"   📥 Staged {staged:,} rows in {time.monotonic() - started:.1f}s")
+
+        if f"{source}:customers" not in done:
+            phase_started = time.monotonic()
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {staging}_byte_pos_idx ON {staging} (byte_pos);")
+            cur.execute(INSERT_CUSTOMERS_SQL_TEMPLATE.format(staging=staging, order_column="byte_pos"),
+                        {"customer_counter": customer_counter})
+            new_customers = cur.rowcount
+            customer_counter += new_customers
+            # Created once here rather than by every worker racing for the same months
+            cur.execute(CREATE_PARTITIONS_SQL_TEMPLATE.format(staging=staging))
+            _save_progress(cur, f"{source}:customers", file_size, file_size, new_customers)
+            _save_progress(cur, source, file_size, 0, 0, customer_counter, completed=False)
+            conn.commit()
+            print(f"   👥 Created {new_customers:,} customers in {time.monotonic() - phase_started:.1f}s")
+
+        phase_started = time.monotonic()
+        pending = [t for t in tasks if f"{source}:insert:{t['start']}" not in done]
+        inserted = sum(pool.map(_insert_range, pending))
+        print(f"   💾 Inserted {inserted:,} purchases in {time.monotonic() - phase_started:.1f}s")
+
+    cur.execute("""
+        SELECT COALESCE(SUM(rows_loaded), 0) FROM data_load_progress
+        WHERE starts_with(source, %s);
+    """, (f"{source}:insert:",))
+    rows_loaded = cur.fetchone()[0]
+    cur.execute("DELETE FROM data_load_progress WHERE starts_with(source, %s);", (f"{source}:",))
+    _save_progress(cur, source, file_size, file_size, rows_loaded, customer_counter, completed=True)
+    cur.execute(f"DROP TABLE IF EXISTS {staging};")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    elapsed = time.monotonic() - started
+    print(f"   ⏱️ {inserted:,} purchases in {elapsed:.1f}s ({inserted / elapsed if elapsed else 0:,.0f} rows/s)")
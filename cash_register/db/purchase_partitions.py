@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Partition maintenance and archival for the monthly-partitioned purchases table.
+
+Every run creates the partitions for the current and the next --months-ahead
+months, and splits any months that landed in purchases_default into their own
+partitions (db/init.sql, section 11). With --retention-months N, each month
+that ended more than N months ago is then archived, oldest first:
+
+1. the partition is detached from purchases in a short transaction of its own.
+   The DETACH waits at most DETACH_LOCK_TIMEOUT for purchases, and is retried
+   later when checkouts or dashboard scans hold it;
+2. the month is subtracted from the dashboard rollups and customer sketches
+   (subtract_detached_purchases() in db/init.sql), and the table is commented
+   as removed from them in the same transaction, so this happens exactly once;
+3. the detached table, which no insert can reach any more, is exported ordered by
+   id to <archive-dir>/purchases_YYYY_MM.parquet (zstd) or .csv.gz. The file is
+   written under a temporary name and renamed once it is complete and synced;
+4. the table is dropped, or with --keep-detached kept and commented as archived.
+
+A run that fails after the detach leaves the month as a standalone table, and the
+next run resumes it from its comment. The rollups therefore keep matching the
+attached purchases, as rebuild_purchase_rollups() and the exact queries see them.
+"""
+
+import argparse
+import gzip
+import os
+import re
+import sys
+import time
+from datetime import date
+from typing import Any, Dict, List, Tuple
+
+import psycopg2
+import psycopg2.errors
+
+from shared.db_config import validate_env_vars, get_db_config
+
+# Validate environment variables on startup
+validate_env_vars()
+
+DB_CONFIG = get_db_config()
+
+PARTITION_NAME = re.compile(r"^purchases_(\d{4})_(\d{2})$")
+ARCHIVE_COLUMNS = "id, supermarket_id, timestamp, user_id, item_list, total_amount"
+ARCHIVE_FORMATS = {"parquet": ".parquet", "csv": ".csv.gz"}
+PARQUET_BATCH_ROWS = 100_000
+
+# Checkouts queue behind a waiting DETACH, so it gives up quickly and tries again
+DETACH_LOCK_TIMEOUT = "1s"
+DETACH_ATTEMPTS = 20
+DETACH_RETRY_DELAY = 3.0
+ARCHIVED_COMMENT = "archived to "
+SUBTRACTED_COMMENT = "removed from rollups"
+
+PARTITIONS_QUERY = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'purchases'::regclass
+    ORDER BY c.relname;
+"""
+
+# Monthly tables detached by an earlier run but not archived yet
+DETACHED_QUERY = """
+    SELECT c.relname, coalesce(obj_description(c.oid, 'pg_class'), '') = %s
+    FROM pg_class c
+    WHERE c.relkind = 'r'
+      AND NOT c.relispartition
+      AND pg_table_is_visible(c.oid)
+      AND c.relname ~ '^purchases_[0-9]{4}_[0-9]{2}$'
+      AND coalesce(obj_description(c.oid, 'pg_class'), '') NOT LIKE 'archived to %%'
+    ORDER BY c.relname;
+"""
+
+
+def get_partition_config() -> Dict[str, Any]:
+    """Get partition maintenance settings from environment variables"""
+    archive_format = os.getenv("PURCHASES_ARCHIVE_FORMAT", "parquet")
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Invalid PURCHASES_ARCHIVE_FORMAT={archive_format}; use one of {', '.join(ARCHIVE_FORMATS)}")
+
+    return {
+        'months_ahead': int(os.getenv("PURCHASES_PARTITION_MONTHS_AHEAD", "3")),
+        'retention_months': int(os.getenv("PURCHASES_RETENTION_MONTHS", "0")),
+        'archive_dir': os.getenv("PURCHASES_ARCHIVE_DIR", "/app/archive"),
+        'archive_format': archive_format
+    }
+
+
+def ensure_partitions(conn, months_ahead: int) -> int:
+    """Create upcoming monthly partitions and split months out of purchases_default"""
+    cur = conn.cursor()
+    cur.execute("SELECT ensure_purchase_partitions(%s);", (months_ahead,))
+    created: int = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return created
+
+
+def archivable_partitions(conn, retention_months: int, today: date) -> List[str]:
+    """Monthly partitions that ended more than retention_months months before today's month"""
+    cutoff = today.year * 12 + today.month - 1 - retention_months
+    cur = conn.cursor()
+    cur.execute(PARTITIONS_QUERY)
+    names = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    cur.close()
+
+    archivable = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match and int(match.group(1)) * 12 + int(match.group(2)) - 1 < cutoff:
+            archivable.append(name)
+    return archivable
+
+
+def export_csv(conn, table: str, path: str) -> int:
+    """Write a partition to a gzip-compressed CSV file with a header row"""
+    cur = conn.cursor()
+    with gzip.open(path, 'wb') as f:
+        cur.copy_expert(
+            f"COPY (SELECT {ARCHIVE_COLUMNS} FROM {table} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)", f
+        )
+    rows: int = cur.rowcount
+    cur.close()
+    return rows
+
+
+def export_parquet(conn, table: str, path: str) -> int:
+    """Write a partition to a zstd-compressed Parquet file, one row group per batch"""
+    # Optional dependency: only Parquet archives need pyarrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("supermarket_id", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("user_id", pa.string()),
+        ("item_list", pa.list_(pa.string())),
+        ("total_amount", pa.decimal128(12, 2))
+    ])
+
+    rows = 0
+    cur = conn.cursor(name=f"{table}_archive")
+    cur.itersize = PARQUET_BATCH_ROWS
+    cur.execute(f"SELECT {ARCHIVE_COLUMNS} FROM {table} ORDER BY id;")
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        while True:
+            batch = cur.fetchmany(PARQUET_BATCH_ROWS)
+            if not batch:
+                break
+            columns = list(zip(*batch))
+            columns[3] = [str(user_id) for user_id in columns[3]]
+            writer.write_batch(pa.record_batch([pa.array(col, type=field.type)
+                                                for col, field in zip(columns, schema)], schema=schema))
+            rows += len(batch)
+    cur.close()
+    return rows
+
+
+def detached_partitions(conn) -> List[Tuple[str, bool]]:
+    """Months detached from purchases whose export has not completed, and whether
+    they were already subtracted from the rollups"""
+    cur = conn.cursor()
+    cur.execute(DETACHED_QUERY, (SUBTRACTED_COMMENT,))
+    tables = [(row[0], row[1]) for row in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    return tables
+
+
+def detach_partition(conn, table: str) -> None:
+    """Detach a partition from purchases, backing off while the table is busy"""
+    # DETACH ... CONCURRENTLY is not allowed while purchases has a default partition, so this
+    # takes ACCESS EXCLUSIVE on purchases. It is requested first, before any lock on the
+    # partition, in the order inserts take them, and holds nothing else while it waits
+    cur = conn.cursor()
+    try:
+        for attempt in range(1, DETACH_ATTEMPTS + 1):
+            try:
+                cur.execute(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}';")
+                cur.execute(f"ALTER TABLE purchases DETACH PARTITION {table};")
+                conn.commit()
+                return
+            except psycopg2.errors.LockNotAvailable:
+                conn.rollback()
+                if attempt == DETACH_ATTEMPTS:
+                    raise
+                time.sleep(DETACH_RETRY_DELAY)
+    finally:
+        cur.close()
+
+
+def subtract_from_rollups(conn, table: str) -> None:
+    """Take a detached month out of the dashboard rollups and mark it done"""
+    match = PARTITION_NAME.match(table)
+    month = date(int(match.group(1)), int(match.group(2)), 1)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT subtract_detached_purchases(%s::regclass, %s);", (table, month))
+        cur.execute(f"COMMENT ON TABLE {table} IS %s;", (SUBTRACTED_COMMENT,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def archive_path(archive_dir: str, table: str, archive_format: str) -> str:
+    """A new archive file for the month; a month archived again (late rows) gets a numbered one"""
+    suffix = ARCHIVE_FORMATS[archive_format]
+    path = os.path.join(archive_dir, table + suffix)
+    copy = 1
+    while os.path.exists(path):
+        copy += 1
+        path = os.path.join(archive_dir, f"{table}.{copy}{suffix}")
+    return path
+
+
+def archive_detached(conn, table: str, archive_dir: str, archive_format: str,
+                     keep_detached: bool = False) -> Tuple[str, int]:
+    """Export a detached partition, then drop it (or mark it archived)"""
+    path = archive_path(archive_dir, table, archive_format)
+    temp_path = path + ".tmp"
+
+    cur = conn.cursor()
+    try:
+        if archive_format == "parquet":
+            rows = export_parquet(conn, table, temp_path)
+        else:
+            rows = export_csv(conn, table, temp_path)
+
+        with open(temp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+        if keep_detached:
+            cur.execute(f"COMMENT ON TABLE {table} IS %s;", (ARCHIVED_COMMENT + path,))
+        else:
+            cur.execute(f"DROP TABLE {table};")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        cur.close()
+    return path, rows
+
+
+def run_maintenance(months_ahead: int, retention_months: int, archive_dir: str,
+                    archive_format: str, keep_detached: bool = False) -> None:
+    """One maintenance pass: create upcoming partitions, then archive expired ones"""
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        created = ensure_partitions(conn, months_ahead)
+        print(f"🗓️ Purchase partitions ready {months_ahead} months ahead ({created} created)")
+
+        if retention_months <= 0:
+            return
+
+        os.makedirs(archive_dir, exist_ok=True)
+        # Months an earlier run detached but did not finish come first
+        pending = [(table, False, subtracted) for table, subtracted in detached_partitions(conn)]
+        pending += [(table, True, False) for table in archivable_partitions(conn, retention_months, date.today())]
+        for table, attached, subtracted in pending:
+            started = time.monotonic()
+            if attached:
+                detach_partition(conn, table)
+            if not subtracted:
+                subtract_from_rollups(conn, table)
+            path, rows = archive_detached(conn, table, archive_dir, archive_format, keep_detached)
+            action = "detached" if keep_detached else "dropped"
+            print(f"   📦 Archived {table}: {rows:,} purchases to {path} in "
+                  f"{time.monotonic() - started:.1f}s ({action})")
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    config = get_partition_config()
+    parser = argparse.ArgumentParser(description="Create upcoming purchase partitions and archive old ones")
+    parser.add_argument("--months-ahead", type=int, default=config['months_ahead'],
+                        help="Future months to keep partitions for")
+    parser.add_argument("--retention-months", type=int, default=config['retention_months'],
+                        help="Archive months that ended more than this many months ago (0 = never archive)")
+    parser.add_argument("--archive-dir", default=config['archive_dir'], help="Directory for archive files")
+    parser.add_argument("--format", choices=sorted(ARCHIVE_FORMATS), default=config['archive_format'],
+                        help="Archive file format")
+    parser.add_argument("--keep-detached", action="store_true",
+                        help="Keep archived partitions as standalone tables instead of dropping them")
+    parser.add_argument("--every", type=float, default=0,
+                        help="Repeat every this many seconds (0 = run once)")
+    args = parser.parse_args()
+
+    while True:
+        try:
+            run_maintenance(args.months_ahead, args.retention_months, args.archive_dir,
+                            args.format, args.keep_detached)
+        except Exception as e:
+            print(f"❌ Purchase partition maintenance failed: {e}", file=sys.stderr)
+            if not args.every:
+                sys.exit(1)
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
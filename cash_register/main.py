@@ -1,15 +1,29 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel, Field, validator
-from typing import List, Dict, Any
+from pydantic import BaseModel, Field, ValidationError, validator
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Callable, Optional, Tuple
+import os
 import uuid
-import psycopg2
 import re
 from datetime import datetime, timezone
-from shared.db_config import validate_env_vars, get_db_config
+from decimal import Decimal
+import psycopg2.errors
+import psycopg2.extras
+from shared.db_config import (
+    validate_env_vars, init_db_pool, close_db_pool, get_db_pool, pooled_connection,
+    init_async_db_pool, close_async_db_pool, get_async_db_pool
+)
+from shared.json_response import FastJSONResponse, dumps
+from shared.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, render_metrics
+from catalog_cache import CatalogCache, CatalogSnapshot, get_catalog_cache_config
+from customer_cache import CustomerCache, get_customer_cache_config
+from page_cache import IMMUTABLE, PageCache, RenderedPage, get_page_cache_config
+from purchase_journal import JournalFullError, JournalWriteError, PurchaseJournal, get_purchase_journal_config
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+app.add_middleware(MetricsMiddleware)
 
 # Initialize templates
 templates = Jinja2Templates(directory="templates")
@@ -17,9 +31,93 @@ templates = Jinja2Templates(directory="templates")
 # Validate environment variables on startup
 validate_env_vars()
 
-DB_CONFIG = get_db_config()
+
+# "sync": psycopg2 pool, handlers run in FastAPI's threadpool
+# "async": asyncpg pool, handlers run on the event loop
+DB_MODE = os.getenv("CASH_REGISTER_DB_MODE", "sync").lower()
+if DB_MODE not in ("sync", "async"):
+    raise ValueError(f"Invalid CASH_REGISTER_DB_MODE: {DB_MODE} (expected 'sync' or 'async')")
+if DB_MODE == "async":
+    # Optional dependency: only services running in async mode need asyncpg
+    import asyncpg
+
+catalog = CatalogCache(**get_catalog_cache_config())
+customers = CustomerCache(**get_customer_cache_config())
+pages = PageCache(**get_page_cache_config())
+purchase_journal = PurchaseJournal(**get_purchase_journal_config())
+
+
+@app.on_event("startup")
+async def startup() -> None:
+    if DB_MODE == "async":
+        await init_async_db_pool("cash_register")
+        await customers.warm_async()
+    else:
+        init_db_pool("cash_register")
+        await run_in_threadpool(customers.warm)
+    catalog.start()
+    # Replays whatever the last run journaled but did not commit
+    await run_in_threadpool(purchase_journal.open)
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await run_in_threadpool(purchase_journal.close)
+    catalog.stop()
+    if DB_MODE == "async":
+        await close_async_db_pool()
+    else:
+        close_db_pool()
+
+
+async def get_catalog_snapshot() -> CatalogSnapshot:
+    """Current catalog snapshot, reloaded without blocking the event loop if stale"""
+    if DB_MODE == "async":
+        return await catalog.aget()
+    return await run_in_threadpool(catalog.get)
+
 
 # ----- Input model -----
+# PurchaseRequest is the only validation stage: everything downstream receives a
+# stripped real_id and a stripped, de-duplicated basket and does not re-check them.
+REAL_ID_PATTERN = re.compile(r'[a-zA-Z0-9]+')
+# Letters, numbers, spaces, hyphens and basic punctuation
+ITEM_NAME_PATTERN = re.compile(r'[a-zA-Z0-9\s\-\.\,\'\"]+')
+MAX_ITEM_NAME_LENGTH = 100
+
+
+def clean_real_id(v: str) -> str:
+    v = v.strip()
+    if not v:
+        raise ValueError('real_id cannot be empty')
+    if not REAL_ID_PATTERN.fullmatch(v):
+        raise ValueError('real_id must contain only alphanumeric characters')
+    return v
+
+
+def clean_item_names(v: List[str]) -> List[str]:
+    """Strip and check every item name in one pass, rejecting case-insensitive duplicates"""
+    if not v:
+        raise ValueError('item_names cannot be empty')
+    
+    items = [item.strip() for item in v]
+    seen_items = set()
+    for item in items:
+        if not item:
+            raise ValueError('Item names cannot be empty')
+        if len(item) > MAX_ITEM_NAME_LENGTH:
+            raise ValueError(f'Item names cannot exceed {MAX_ITEM_NAME_LENGTH} characters')
+        if not ITEM_NAME_PATTERN.fullmatch(item):
+            raise ValueError('Item names contain invalid characters')
+        
+        item_lower = item.lower()
+        if item_lower in seen_items:
+            raise ValueError(f'Duplicate item not allowed: {item}')
+        seen_items.add(item_lower)
+    
+    return items
+
+
 class PurchaseRequest(BaseModel):
     real_id: str = Field(
         ..., 
@@ -43,240 +141,541 @@ class PurchaseRequest(BaseModel):
     
     @validator('real_id')
     def validate_real_id(cls, v: str) -> str:
-        # Remove any whitespace
-        v = v.strip()
-        
-        # Check if empty after stripping
-        if not v:
-            raise ValueError('real_id cannot be empty')
-        
-        # Allow only alphanumeric characters (letters and numbers)
-        if not re.match(r'^[a-zA-Z0-9]+$', v):
-            raise ValueError('real_id must contain only alphanumeric characters')
-        
-        return v
+        return clean_real_id(v)
     
     @validator('item_names')
     def validate_item_names(cls, v: List[str]) -> List[str]:
-        if not v:
-            raise ValueError('item_names cannot be empty')
-        
-        validated_items = []
-        seen_items = set()
-        
-        for item in v:
-            # Strip whitespace
-            item = item.strip()
-            
-            # Check if empty after stripping
-            if not item:
-                raise ValueError('Item names cannot be empty')
-            
-            # Length check for each item
-            if len(item) > 100:
-                raise ValueError('Item names cannot exceed 100 characters')
-            
-            # Allow only letters, numbers, spaces, hyphens, and basic punctuation
-            if not re.match(r'^[a-zA-Z0-9\s\-\.\,\'\"]+$', item):
-                raise ValueError('Item names contain invalid characters')
-            
-            # Check for duplicates (case-insensitive)
-            item_lower = item.lower()
-            if item_lower in seen_items:
-                raise ValueError(f'Duplicate item not allowed: {item}')
-            
-            seen_items.add(item_lower)
-            validated_items.append(item)
-        
-        return validated_items
+        return clean_item_names(v)
 
 
-# ----- Utility DB funcs -----
-def connect() -> psycopg2.extensions.connection:
-    return psycopg2.connect(**DB_CONFIG)
+class BatchPurchase(PurchaseRequest):
+    timestamp: Optional[datetime] = Field(
+        None,
+        description="Original checkout time of a replayed purchase (defaults to the time it is received)"
+    )
+
 
+class PurchaseBatchRequest(BaseModel):
+    # Entries are validated one by one so a malformed basket only rejects itself
+    purchases: List[Dict[str, Any]] = Field(
+        ...,
+        min_items=1,
+        max_items=10000,
+        description="Purchases queued by an offline till, each in BatchPurchase format"
+    )
+
+
+# ----- Utility DB funcs -----
 def get_max_items_count() -> int:
     """Get the maximum number of unique items a customer can purchase (total products in catalog)"""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM products;")
-    count = cur.fetchone()[0]
-    cur.close()
-    conn.close()
-    return count
+    return catalog.get().product_count
+
+# A no-op update on conflict makes RETURNING yield the stored uuid whether the
+# customer is new, existing or being registered concurrently by another till
+CUSTOMER_UPSERT_SQL = """
+    INSERT INTO customers (real_id, uuid) VALUES (%s, %s)
+    ON CONFLICT (real_id) DO UPDATE SET real_id = EXCLUDED.real_id
+    RETURNING uuid;
+"""
+CUSTOMER_UPSERT_SQL_ASYNC = """
+    INSERT INTO customers (real_id, uuid) VALUES ($1, $2::uuid)
+    ON CONFLICT (real_id) DO UPDATE SET real_id = EXCLUDED.real_id
+    RETURNING uuid;
+"""
 
 def get_or_create_user_uuid(real_id: str) -> str:
-    # Additional server-side validation
-    real_id = real_id.strip()
-    if not real_id:
-        raise HTTPException(status_code=400, detail="real_id cannot be empty")
-    
-    if len(real_id) > 20:
-        raise HTTPException(status_code=400, detail="real_id too long")
+    """uuid of a customer (real_id as validated by PurchaseRequest), registering new customers"""
+    user_uuid = customers.get(real_id)
+    if user_uuid is not None:
+        return user_uuid
     
-    if not re.match(r'^[a-zA-Z0-9]+$', real_id):
-        raise HTTPException(status_code=400, detail="real_id contains invalid characters")
-    
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT uuid FROM customers WHERE real_id = %s;", (real_id,))
-    row = cur.fetchone()
-
-    if row:
-        user_uuid: str = row[0]
-    else:
-        user_uuid: str = str(uuid.uuid4())
-        cur.execute("INSERT INTO customers (real_id, uuid) VALUES (%s, %s);", (real_id, user_uuid))
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(CUSTOMER_UPSERT_SQL, (real_id, str(uuid.uuid4())))
+        user_uuid = str(cur.fetchone()[0])
         conn.commit()
+        cur.close()
+    customers.put(real_id, user_uuid)
+    return user_uuid
 
-    cur.close()
-    conn.close()
+async def get_or_create_user_uuid_async(real_id: str) -> str:
+    user_uuid = customers.get(real_id)
+    if user_uuid is not None:
+        return user_uuid
+    
+    async with get_async_db_pool().connection() as conn:
+        user_uuid = str(await conn.fetchval(CUSTOMER_UPSERT_SQL_ASYNC, real_id, str(uuid.uuid4())))
+    customers.put(real_id, user_uuid)
     return user_uuid
 
-def validate_supermarket(supermarket_id: str) -> None:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM supermarkets WHERE id = %s;", (supermarket_id,))
-    if not cur.fetchone():
+def validate_supermarket(supermarket_id: str, snapshot: Optional[CatalogSnapshot] = None) -> None:
+    snapshot = snapshot or catalog.get()
+    if supermarket_id not in snapshot.supermarket_ids:
         raise HTTPException(status_code=400, detail="Invalid supermarket ID")
-    cur.close()
-    conn.close()
 
-def validate_and_price_items(item_names: List[str]) -> float:
-    if not item_names:
-        raise HTTPException(status_code=400, detail="Item list cannot be empty")
-    
-    max_items = get_max_items_count()
+def validate_and_price_items(item_names: List[str], snapshot: Optional[CatalogSnapshot] = None) -> Decimal:
+    """Price a basket already normalized by PurchaseRequest against the catalog"""
+    snapshot = snapshot or catalog.get()
+    max_items = snapshot.product_count
     if len(item_names) > max_items:
         raise HTTPException(status_code=400, detail=f"Too many items (maximum {max_items} unique products available in catalog)")
     
-    # Check for duplicates (case-insensitive)
-    seen_items = set()
-    normalized_items = []
+    prices = snapshot.prices
+    try:
+        return sum([prices[name] for name in item_names], Decimal("0"))
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid product: {e.args[0]}")
+
+def insert_purchase(store_id: str, user_uuid: str, item_names: List[str], total: Decimal) -> None:
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount)
+            VALUES (%s, %s, %s, %s, %s);
+        """, (
+            store_id,
+            datetime.now(timezone.utc),
+            user_uuid,
+            item_names,
+            total
+        ))
+        conn.commit()
+        cur.close()
+
+
+# ----- Fused purchase pipeline -----
+# The store and basket are validated and priced from the in-memory catalog. A
+# customer in the customer cache only needs the purchase insert; otherwise the
+# customer upsert and purchase insert run as a single statement. Either way it is
+# one round trip and one implicit transaction.
+PURCHASE_INSERT_SQL = """
+    INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount)
+    VALUES (%(store_id)s, %(timestamp)s, %(user_uuid)s, %(items)s, %(total)s);
+"""
+
+PURCHASE_PIPELINE_SQL = """
+    WITH customer AS (
+        INSERT INTO customers (real_id, uuid) VALUES (%(real_id)s, %(new_uuid)s::uuid)
+        ON CONFLICT (real_id) DO UPDATE SET real_id = EXCLUDED.real_id
+        RETURNING uuid
+    )
+    INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount)
+    SELECT %(store_id)s, %(timestamp)s, customer.uuid, %(items)s, %(total)s
+    FROM customer
+    RETURNING user_id;
+"""
+
+def purchase_reference_error(real_id: str, constraint: Optional[str]) -> HTTPException:
+    """Client error for a purchase whose store or customer no longer exists"""
+    if constraint and "user_id" in constraint:
+        # Only a cached customer can be missing, i.e. the customer row was deleted
+        customers.discard(real_id)
+        return HTTPException(status_code=409, detail="Customer record changed, please retry")
+    # The cached store list is stale: the supermarket was removed
+    catalog.invalidate()
+    return HTTPException(status_code=400, detail="Invalid supermarket ID")
+
+def record_purchase(store_id: str, real_id: str, item_names: List[str]) -> Tuple[str, Decimal]:
+    """Validate, price and record a purchase in one round trip; returns (user_uuid, total)"""
+    validate_supermarket(store_id)
+    total = validate_and_price_items(item_names)
+    params = {
+        "store_id": store_id,
+        "real_id": real_id,
+        "items": item_names,
+        "total": total,
+        "timestamp": datetime.now(timezone.utc),
+        "user_uuid": customers.get(real_id)
+    }
     
-    for name in item_names:
-        # Additional server-side validation
-        name = name.strip()
-        if not name:
-            raise HTTPException(status_code=400, detail="Item name cannot be empty")
-        
-        if len(name) > 100:
-            raise HTTPException(status_code=400, detail="Item name too long")
+    with pooled_connection() as conn:
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            if params["user_uuid"] is not None:
+                cur.execute(PURCHASE_INSERT_SQL, params)
+            else:
+                cur.execute(PURCHASE_PIPELINE_SQL, {**params, "new_uuid": str(uuid.uuid4())})
+                params["user_uuid"] = str(cur.fetchone()[0])
+                customers.put(real_id, params["user_uuid"])
+            cur.close()
+        except psycopg2.errors.ForeignKeyViolation as e:
+            raise purchase_reference_error(real_id, e.diag.constraint_name)
+        finally:
+            conn.autocommit = False
+    
+    return params["user_uuid"], total
+
+
+PURCHASE_INSERT_SQL_ASYNC = """
+    INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount)
+    VALUES ($1, $2::timestamptz, $3::uuid, $4::text[], $5);
+"""
+
+PURCHASE_PIPELINE_SQL_ASYNC = """
+    WITH customer AS (
+        INSERT INTO customers (real_id, uuid) VALUES ($1, $2::uuid)
+        ON CONFLICT (real_id) DO UPDATE SET real_id = EXCLUDED.real_id
+        RETURNING uuid
+    )
+    INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount)
+    SELECT $3, $4::timestamptz, customer.uuid, $5::text[], $6
+    FROM customer
+    RETURNING user_id;
+"""
+
+async def record_purchase_async(store_id: str, real_id: str, item_names: List[str]) -> Tuple[str, Decimal]:
+    """asyncpg counterpart of record_purchase() with identical validation and errors"""
+    snapshot = await catalog.aget()
+    validate_supermarket(store_id, snapshot)
+    total = validate_and_price_items(item_names, snapshot)
+    timestamp = datetime.now(timezone.utc)
+    user_uuid = customers.get(real_id)
+    
+    async with get_async_db_pool().connection() as conn:
+        try:
+            if user_uuid is not None:
+                await conn.execute(PURCHASE_INSERT_SQL_ASYNC, store_id, timestamp, user_uuid, item_names, total)
+            else:
+                user_uuid = str(await conn.fetchval(
+                    PURCHASE_PIPELINE_SQL_ASYNC,
+                    real_id, str(uuid.uuid4()), store_id, timestamp, item_names, total
+                ))
+                customers.put(real_id, user_uuid)
+        except asyncpg.exceptions.ForeignKeyViolationError as e:
+            raise purchase_reference_error(real_id, e.constraint_name)
+    
+    return user_uuid, total
+
+
+# ----- Write-behind journal -----
+# With PURCHASE_JOURNAL_ENABLED, a purchase is acknowledged once it is in the local
+# journal; purchase_journal.py group-commits it shortly after. The customer is
+# resolved first (from the customer cache, or registered by the upsert), since the
+# journaled purchase must reference a stored uuid.
+def append_to_journal(store_id: str, user_uuid: str, item_names: List[str], total: Decimal) -> None:
+    try:
+        purchase_journal.append(store_id, datetime.now(timezone.utc).replace(tzinfo=None),
+                                user_uuid, item_names, total)
+    except JournalFullError as e:
+        raise HTTPException(status_code=503, detail=f"Purchase journal is full, please retry: {e}")
+    except JournalWriteError as e:
+        raise HTTPException(status_code=503, detail=f"Purchase was not recorded, please retry: {e}")
+
+
+def journal_purchase(store_id: str, real_id: str, item_names: List[str]) -> Tuple[str, Decimal]:
+    """Validate and price a purchase, then journal it; returns (user_uuid, total)"""
+    validate_supermarket(store_id)
+    total = validate_and_price_items(item_names)
+    user_uuid = get_or_create_user_uuid(real_id)
+    append_to_journal(store_id, user_uuid, item_names, total)
+    return user_uuid, total
+
+
+async def journal_purchase_async(store_id: str, real_id: str, item_names: List[str]) -> Tuple[str, Decimal]:
+    """asyncpg counterpart of journal_purchase(); the fsync runs in the threadpool"""
+    snapshot = await catalog.aget()
+    validate_supermarket(store_id, snapshot)
+    total = validate_and_price_items(item_names, snapshot)
+    user_uuid = await get_or_create_user_uuid_async(real_id)
+    await run_in_threadpool(append_to_journal, store_id, user_uuid, item_names, total)
+    return user_uuid, total
+
+
+# ----- Batch ingestion -----
+# Customers for the whole batch are resolved with one set-based upsert: new rows
+# come back from RETURNING, existing ones from the join (which sees the table as
+# it was before the statement).
+CUSTOMER_BATCH_UPSERT_SQL = """
+    WITH input AS (
+        SELECT * FROM unnest(%(real_ids)s::varchar[], %(new_uuids)s::uuid[]) AS t(real_id, uuid)
+    ),
+    created AS (
+        INSERT INTO customers (real_id, uuid)
+        SELECT real_id, uuid FROM input
+        ON CONFLICT (real_id) DO NOTHING
+        RETURNING real_id, uuid
+    )
+    SELECT real_id, uuid FROM created
+    UNION ALL
+    SELECT c.real_id, c.uuid FROM customers c JOIN input USING (real_id);
+"""
+
+CUSTOMER_BATCH_UPSERT_SQL_ASYNC = """
+    WITH input AS (
+        SELECT * FROM unnest($1::varchar[], $2::uuid[]) AS t(real_id, uuid)
+    ),
+    created AS (
+        INSERT INTO customers (real_id, uuid)
+        SELECT real_id, uuid FROM input
+        ON CONFLICT (real_id) DO NOTHING
+        RETURNING real_id, uuid
+    )
+    SELECT real_id, uuid FROM created
+    UNION ALL
+    SELECT c.real_id, c.uuid FROM customers c JOIN input USING (real_id);
+"""
+
+PURCHASE_COLUMNS = ["supermarket_id", "timestamp", "user_id", "item_list", "total_amount"]
+
+
+def validation_error_detail(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+def prepare_purchase_batch(entries: List[Dict[str, Any]],
+                           snapshot: CatalogSnapshot) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Validate and price every entry against one catalog snapshot.
+
+    Returns (results, accepted): one result per entry in input order, with
+    rejected entries already marked as errors, and the accepted entries
+    ready to be written.
+    """
+    received_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    results: List[Dict[str, Any]] = []
+    accepted: List[Dict[str, Any]] = []
+    
+    for index, entry in enumerate(entries):
+        try:
+            purchase = BatchPurchase(**entry)
+            validate_supermarket(purchase.supermarket_id, snapshot)
+            total = validate_and_price_items(purchase.item_names, snapshot)
+        except ValidationError as e:
+            results.append({"index": index, "status": "error", "detail": validation_error_detail(e)})
+            continue
+        except HTTPException as e:
+            results.append({"index": index, "status": "error", "detail": e.detail})
+            continue
         
-        # Check for duplicates
-        name_lower = name.lower()
-        if name_lower in seen_items:
-            raise HTTPException(status_code=400, detail=f"Duplicate item not allowed: {name}")
+        timestamp = purchase.timestamp or received_at
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
         
-        seen_items.add(name_lower)
-        normalized_items.append(name)
+        result = {"index": index, "status": "success", "uuid": None, "total": float(total)}
+        results.append(result)
+        accepted.append({
+            "result": result,
+            "real_id": purchase.real_id,
+            "supermarket_id": purchase.supermarket_id,
+            "timestamp": timestamp,
+            "item_names": purchase.item_names,
+            "total": total
+        })
     
-    conn = connect()
-    cur = conn.cursor()
-    total: float = 0.0
+    return results, accepted
+
+
+def summarize_batch(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    accepted = sum(1 for r in results if r["status"] == "success")
+    return {
+        "status": "success" if accepted == len(results) else ("partial" if accepted else "failed"),
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "results": results
+    }
+
+
+def ingest_purchase_batch(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Validate a batch in memory, then upsert its customers and insert its purchases in one transaction"""
+    results, accepted = prepare_purchase_batch(entries, catalog.get())
+    if not accepted:
+        return summarize_batch(results)
     
-    for name in normalized_items:
-        cur.execute("SELECT price FROM products WHERE name = %s;", (name,))
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=400, detail=f"Invalid product: {name}")
-        total += row[0]
+    # Sorted so concurrent batches lock customer rows in the same order
+    real_ids = sorted({p["real_id"] for p in accepted})
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(CUSTOMER_BATCH_UPSERT_SQL, {
+                "real_ids": real_ids,
+                "new_uuids": [str(uuid.uuid4()) for _ in real_ids]
+            })
+            uuids = {real_id: str(user_uuid) for real_id, user_uuid in cur.fetchall()}
+            
+            missing = [real_id for real_id in real_ids if real_id not in uuids]
+            if missing:
+                # Created by a concurrent checkout after our statement started
+                cur.execute("SELECT real_id, uuid FROM customers WHERE real_id = ANY(%s);", (missing,))
+                uuids.update((real_id, str(user_uuid)) for real_id, user_uuid in cur.fetchall())
+            
+            psycopg2.extras.execute_values(
+                cur,
+                f"INSERT INTO purchases ({', '.join(PURCHASE_COLUMNS)}) VALUES %s;",
+                [(p["supermarket_id"], p["timestamp"], uuids[p["real_id"]], p["item_names"], p["total"])
+                 for p in accepted],
+                page_size=len(accepted)
+            )
+            conn.commit()
+        except psycopg2.errors.ForeignKeyViolation:
+            catalog.invalidate()
+            raise HTTPException(status_code=400, detail="Invalid supermarket ID")
+        finally:
+            cur.close()
     
-    cur.close()
-    conn.close()
-    return total
-
-def insert_purchase(store_id: str, user_uuid: str, item_names: List[str], total: float) -> None:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount)
-        VALUES (%s, %s, %s, %s, %s);
-    """, (
-        store_id,
-        datetime.now(timezone.utc),
-        user_uuid,
-        item_names,
-        total
-    ))
-    conn.commit()
-    cur.close()
-    conn.close()
+    customers.put_many(uuids.items())
+    for p in accepted:
+        p["result"]["uuid"] = uuids[p["real_id"]]
+    return summarize_batch(results)
 
 
-# ----- API endpoint -----
-@app.post("/purchase")
-def register_purchase(purchase: PurchaseRequest) -> Dict[str, Any]:
-    # 1. Validate supermarket
-    validate_supermarket(purchase.supermarket_id)
-
-    # 2. Validate items and calculate total
-    total: float = validate_and_price_items(purchase.item_names)
+async def ingest_purchase_batch_async(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """asyncpg counterpart of ingest_purchase_batch(); purchases are written with a binary COPY"""
+    results, accepted = prepare_purchase_batch(entries, await catalog.aget())
+    if not accepted:
+        return summarize_batch(results)
+    
+    real_ids = sorted({p["real_id"] for p in accepted})
+    async with get_async_db_pool().connection() as conn:
+        try:
+            async with conn.transaction():
+                rows = await conn.fetch(CUSTOMER_BATCH_UPSERT_SQL_ASYNC, real_ids, [uuid.uuid4() for _ in real_ids])
+                uuids = {row["real_id"]: row["uuid"] for row in rows}
+                
+                missing = [real_id for real_id in real_ids if real_id not in uuids]
+                if missing:
+                    rows = await conn.fetch("SELECT real_id, uuid FROM customers WHERE real_id = ANY($1::varchar[]);", missing)
+                    uuids.update((row["real_id"], row["uuid"]) for row in rows)
+                
+                await conn.copy_records_to_table(
+                    "purchases",
+                    columns=PURCHASE_COLUMNS,
+                    records=[(p["supermarket_id"], p["timestamp"], uuids[p["real_id"]], p["item_names"], p["total"])
+                             for p in accepted]
+                )
+        except asyncpg.exceptions.ForeignKeyViolationError:
+            catalog.invalidate()
+            raise HTTPException(status_code=400, detail="Invalid supermarket ID")
+    
+    customers.put_many(uuids.items())
+    for p in accepted:
+        p["result"]["uuid"] = str(uuids[p["real_id"]])
+    return summarize_batch(results)
 
-    # 3. Get or create UUID for user
-    user_uuid: str = get_or_create_user_uuid(purchase.real_id)
 
-    # 4. Record purchase
-    insert_purchase(purchase.supermarket_id, user_uuid, purchase.item_names, total)
+# ----- API endpoint -----
+@app.post("/purchase")
+async def register_purchase(purchase: PurchaseRequest) -> Dict[str, Any]:
+    if DB_MODE == "async":
+        record = journal_purchase_async if purchase_journal.enabled else record_purchase_async
+        user_uuid, total = await record(purchase.supermarket_id, purchase.real_id, purchase.item_names)
+    else:
+        record = journal_purchase if purchase_journal.enabled else record_purchase
+        user_uuid, total = await run_in_threadpool(
+            record, purchase.supermarket_id, purchase.real_id, purchase.item_names
+        )
 
     return {
         "status": "success",
         "uuid": user_uuid,
-        "total": total,
+        "total": float(total),
         "message": "Purchase recorded"
     }
 
 
+@app.post("/purchases/batch")
+async def register_purchase_batch(batch: PurchaseBatchRequest) -> Dict[str, Any]:
+    """Ingest purchases replayed by an offline till, reporting the outcome of each one"""
+    if DB_MODE == "async":
+        return await ingest_purchase_batch_async(batch.purchases)
+    return await run_in_threadpool(ingest_purchase_batch, batch.purchases)
+
+
+def check_database() -> Dict[str, Any]:
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+    return get_db_pool().stats()
+
+
+async def check_database_async() -> Dict[str, Any]:
+    pool = get_async_db_pool()
+    async with pool.connection() as conn:
+        await conn.fetchval("SELECT 1")
+    return pool.stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics() -> Response:
+    """Prometheus metrics: request latency and SQL work per route, pool wait and slow queries"""
+    pool_stats = get_async_db_pool().stats() if DB_MODE == "async" else get_db_pool().stats()
+    return Response(content=render_metrics(pool_stats), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/health")
+async def health_check() -> Dict[str, Any]:
+    """Health check endpoint including connection pool statistics"""
+    try:
+        if DB_MODE == "async":
+            pool_stats = await check_database_async()
+        else:
+            pool_stats = await run_in_threadpool(check_database)
+        return {
+            "status": "healthy",
+            "database": "connected",
+            "mode": DB_MODE,
+            "pool": pool_stats,
+            "catalog_cache": catalog.stats(),
+            "customer_cache": customers.stats(),
+            "page_cache": pages.stats(),
+            "purchase_journal": purchase_journal.stats() if purchase_journal.enabled else None
+        }
+    except Exception as e:
+        return {"status": "unhealthy", "error": str(e)}
+
+
 # ----- UI Routes -----
-def get_all_products():
-    """Get all products from database for UI"""
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
-    cur.execute("SELECT name, price FROM products ORDER BY name")
-    products = [{"name": row[0], "price": float(row[1])} for row in cur.fetchall()]
-    
-    cur.close()
-    conn.close()
-    return products
+# Pages are rendered once per catalog snapshot version (page_cache.py). The cash
+# register page links to the catalog JSON by its ETag, so browsers fetch the
+# product list once per catalog change instead of with every page load.
+async def cached_page(key: Tuple[Any, ...], snapshot: CatalogSnapshot, render: Callable[[], bytes],
+                      media_type: str = "text/html; charset=utf-8") -> RenderedPage:
+    page = pages.get(key, snapshot.version)
+    if page is None:
+        page = await run_in_threadpool(pages.render, key, snapshot.version, render, media_type)
+    return page
 
 
-def get_all_supermarkets():
-    """Get all supermarket IDs for UI"""
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
-    cur.execute("SELECT id FROM supermarkets ORDER BY id")
-    supermarkets = [row[0] for row in cur.fetchall()]
-    
-    cur.close()
-    conn.close()
-    return supermarkets
+def render_template(name: str, **context: Any) -> bytes:
+    return templates.get_template(name).render(**context).encode("utf-8")
+
+
+async def catalog_page(snapshot: CatalogSnapshot) -> RenderedPage:
+    return await cached_page(
+        ("catalog",), snapshot,
+        lambda: dumps({"products": snapshot.products, "supermarkets": snapshot.supermarkets}),
+        "application/json"
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
-def select_supermarket(request: Request):
+async def select_supermarket(request: Request) -> Response:
     """Serve the supermarket selection page"""
-    supermarkets = get_all_supermarkets()
-    
-    return templates.TemplateResponse("select_supermarket.html", {
-        "request": request,
-        "supermarkets": supermarkets
-    })
+    snapshot = await get_catalog_snapshot()
+    page = await cached_page(
+        ("select_supermarket",), snapshot,
+        lambda: render_template("select_supermarket.html", supermarkets=snapshot.supermarkets)
+    )
+    return pages.respond(request, page)
 
 @app.get("/cash-register", response_class=HTMLResponse)
-def cash_register_ui(request: Request, supermarket_id: str):
+async def cash_register_ui(request: Request, supermarket_id: str) -> Response:
     """Serve the cash register UI for a specific supermarket"""
-    products = get_all_products()
-    supermarkets = get_all_supermarkets()
+    snapshot = await get_catalog_snapshot()
     
     # Validate that the supermarket_id exists
-    if supermarket_id not in supermarkets:
+    if supermarket_id not in snapshot.supermarket_ids:
         raise HTTPException(status_code=400, detail="Invalid supermarket ID")
     
-    return templates.TemplateResponse("cash_register.html", {
-        "request": request,
-        "products": products,
-        "supermarkets": supermarkets,
-        "supermarket_id": supermarket_id
-    })
\ No newline at end of file
+    catalog_url = f"/catalog?v={(await catalog_page(snapshot)).tag}"
+    page = await cached_page(
+        ("cash_register", supermarket_id), snapshot,
+        lambda: render_template("cash_register.html", supermarket_id=supermarket_id, catalog_url=catalog_url)
+    )
+    return pages.respond(request, page)
+
+@app.get("/catalog")
+async def catalog_json(request: Request, v: Optional[str] = None) -> Response:
+    """Products and supermarkets as JSON; cacheable forever under the versioned URL the UI uses"""
+    page = await catalog_page(await get_catalog_snapshot())
+    return pages.respond(request, page, IMMUTABLE if v == page.tag else "no-cache")
@@ -0,0 +1,165 @@
+"""
+Rendered, precompressed UI pages for the cash register.
+
+Tills reload the store-selection and cash register pages constantly, while the
+catalog behind them rarely changes. Each page (and the catalog JSON the cash
+register page fetches) is rendered once per catalog snapshot version and kept with
+its gzip and, when the optional brotli package is installed, brotli encodings.
+Responses carry a content-derived ETag and Last-Modified, so a reload of an
+unchanged page is answered with 304 Not Modified.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    # Optional dependency: without brotli, pages are offered gzip-compressed only
+    import brotli
+except ImportError:
+    brotli = None
+
+# Pages are revalidated on every load; a versioned catalog URL never changes
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def get_page_cache_config() -> Dict[str, Any]:
+    """Get UI page cache settings from environment variables"""
+    return {
+        'enabled': os.getenv("PAGE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"),
+        'compress_min_bytes': int(os.getenv("PAGE_COMPRESS_MIN_BYTES", "1024"))
+    }
+
+
+@dataclass(frozen=True)
+class RenderedPage:
+    """A rendered body, its compressed encodings and its validators"""
+    version: int
+    body: bytes
+    encodings: Dict[str, bytes]
+    media_type: str
+    tag: str
+    last_modified: float
+
+    @property
+    def etag(self) -> str:
+        # Weak: the gzip and brotli encodings are the same page
+        return f'W/"{self.tag}"'
+
+
+class PageCache:
+    """Rendered pages keyed by route and parameters, re-rendered when the catalog version changes"""
+
+    def __init__(self, enabled: bool = True, compress_min_bytes: int = 1024):
+        self.enabled = enabled
+        self.compress_min_bytes = compress_min_bytes
+        self._pages: Dict[Hashable, RenderedPage] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'renders': 0, 'not_modified': 0, 'br': 0, 'gzip': 0, 'identity': 0}
+
+    def get(self, key: Hashable, version: int) -> Optional[RenderedPage]:
+        """The cached page for key if it was rendered from this catalog version"""
+        page = self._pages.get(key)
+        if page is None or page.version != version or not self.enabled:
+            return None
+        self._stats['hits'] += 1
+        return page
+
+    def render(self, key: Hashable, version: int, render: Callable[[], bytes],
+               media_type: str = "text/html; charset=utf-8") -> RenderedPage:
+        """Render and compress a page and cache it (slow: call from the threadpool)"""
+        body = render()
+        tag = hashlib.sha1(body).hexdigest()[:20]
+        previous = self._pages.get(key)
+        if previous is not None and previous.tag == tag:
+            # A catalog reload that left the page unchanged keeps its Last-Modified
+            last_modified = previous.last_modified
+        else:
+            last_modified = float(int(time.time()))
+
+        encodings = {}
+        if self.enabled and len(body) >= self.compress_min_bytes:
+            encodings["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                encodings["br"] = brotli.compress(body, mode=brotli.MODE_TEXT, quality=11)
+
+        page = RenderedPage(version=version, body=body, encodings=encodings, media_type=media_type,
+                            tag=tag, last_modified=last_modified)
+        with self._lock:
+            self._pages[key] = page
+            self._stats['renders'] += 1
+        return page
+
+    # ----- HTTP -----
+    @staticmethod
+    def _not_modified(request: Request, page: RenderedPage) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # Weak comparison, and If-None-Match takes precedence over If-Modified-Since
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or f'"{page.tag}"' in tags
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return page.last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _negotiate(accept_encoding: str, page: RenderedPage) -> Optional[str]:
+        """The best precompressed encoding the client accepts (brotli before gzip), if any"""
+        accepted: Dict[str, float] = {}
+        for part in accept_encoding.split(","):
+            name, _, params = part.partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+
+        for encoding in ("br", "gzip"):
+            if encoding in page.encodings and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+        return None
+
+    def respond(self, request: Request, page: RenderedPage, cache_control: str = REVALIDATE) -> Response:
+        """Serve a page compressed as the client prefers, or 304 when its copy is current"""
+        headers = {
+            "ETag": page.etag,
+            "Last-Modified": formatdate(page.last_modified, usegmt=True),
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding"
+        }
+        if self._not_modified(request, page):
+            self._stats['not_modified'] += 1
+            return Response(status_code=304, headers=headers)
+
+        encoding = self._negotiate(request.headers.get("accept-encoding", ""), page)
+        self._stats[encoding or 'identity'] += 1
+        if encoding is None:
+            return Response(content=page.body, media_type=page.media_type, headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(content=page.encodings[encoding], media_type=page.media_type, headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pages = len(self._pages)
+        return {
+            **self._stats,
+            'pages': pages,
+            'enabled': self.enabled,
+            'brotli': brotli is not None
+        }
@@ -0,0 +1,407 @@
+"""
+Write-behind journal for checkouts (PURCHASE_JOURNAL_ENABLED=true).
+
+A validated, priced purchase is appended to a local append-only file and
+fsynced before the till gets its answer; appends that arrive together share
+one fsync. A background flusher then group-commits journaled purchases to
+Postgres, at most ``batch_size`` per transaction and no later than
+``max_delay`` seconds after they were journaled.
+
+Every entry carries a sequence number, and each flush transaction also stores
+the last sequence number it wrote in purchase_journal_progress (db/init.sql,
+section 12), re-checked under a row lock. On startup the journal is replayed
+from exactly that point, so every acknowledged purchase is written once even if
+the process dies mid-flush. A torn final line (a crash during an append that was
+never acknowledged) is cut off. Once everything has been flushed, the file is
+truncated when it exceeds ``rotate_bytes``.
+
+Entries reach the flusher only after their fsync succeeded. A failed write is cut
+off again before the till gets its error. A failed fsync cuts off everything written
+since the last good one, and the journal refuses further purchases until restart,
+since the kernel may have dropped those pages.
+
+One journal file belongs to one process; it is locked while open.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import psycopg2
+import psycopg2.extras
+
+from shared.db_config import get_db_config
+
+INSERT_PURCHASES_SQL = """
+    INSERT INTO purchases (supermarket_id, timestamp, user_id, item_list, total_amount) VALUES %s;
+"""
+LOCK_PROGRESS_SQL = "SELECT last_seq FROM purchase_journal_progress WHERE journal_id = %s FOR UPDATE;"
+INIT_PROGRESS_SQL = """
+    INSERT INTO purchase_journal_progress (journal_id, last_seq) VALUES (%s, 0)
+    ON CONFLICT (journal_id) DO NOTHING;
+"""
+SAVE_PROGRESS_SQL = "UPDATE purchase_journal_progress SET last_seq = %s, updated_at = now() WHERE journal_id = %s;"
+
+
+def get_purchase_journal_config() -> Dict[str, Any]:
+    """Get write-behind journal settings from environment variables"""
+    path = os.getenv("PURCHASE_JOURNAL_PATH", "/app/journal/purchases.journal")
+    return {
+        'enabled': os.getenv("PURCHASE_JOURNAL_ENABLED", "false").lower() in ("1", "true", "yes"),
+        'path': path,
+        # Must stay the same across restarts: it keys the replay position
+        'journal_id': os.getenv("PURCHASE_JOURNAL_ID") or os.path.abspath(path),
+        'batch_size': int(os.getenv("PURCHASE_JOURNAL_BATCH_SIZE", "500")),
+        'max_delay': float(os.getenv("PURCHASE_JOURNAL_MAX_DELAY_MS", "50")) / 1000,
+        'max_pending': int(os.getenv("PURCHASE_JOURNAL_MAX_PENDING", "100000")),
+        'rotate_bytes': int(os.getenv("PURCHASE_JOURNAL_ROTATE_MB", "64")) * 1024 * 1024
+    }
+
+
+class JournalFullError(Exception):
+    """Raised when more purchases are waiting to be flushed than the journal accepts"""
+
+
+class JournalWriteError(Exception):
+    """Raised when a purchase could not be made durable; it is not in the journal"""
+
+
+class _Entry(NamedTuple):
+    seq: int
+    journaled_at: float
+    row: Tuple[str, datetime, str, List[str], Decimal]
+
+
+class PurchaseJournal:
+    """Durable append-only purchase journal with a group-committing background flusher"""
+
+    def __init__(self, path: str, journal_id: str, batch_size: int = 500, max_delay: float = 0.05,
+                 max_pending: int = 100_000, rotate_bytes: int = 64 * 1024 * 1024, enabled: bool = False):
+        self.enabled = enabled
+        self.path = path
+        self.journal_id = journal_id
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.rotate_bytes = rotate_bytes
+        self._fd: Optional[int] = None
+        self._pending: Deque[_Entry] = deque()
+        # Written but not fsynced yet, with the file offset each entry starts at
+        self._unsynced: Deque[Tuple[int, _Entry]] = deque()
+        self._seq = 0
+        self._synced_seq = 0
+        self._flushed_seq = 0
+        # Guards the file offset, the sequence numbers and the pending queue
+        self._cond = threading.Condition()
+        # Held by whichever append is fsyncing on behalf of the others
+        self._sync_lock = threading.Lock()
+        self._stopping = False
+        self._flusher: Optional[threading.Thread] = None
+        self._conn: Optional[psycopg2.extensions.connection] = None
+        self._last_error: Optional[str] = None
+        self._failed: Optional[str] = None
+        self._stats = {'appended': 0, 'fsyncs': 0, 'replayed': 0, 'flushed': 0, 'batches': 0,
+                       'rejected': 0, 'flush_errors': 0, 'rotations': 0}
+
+    # ----- Startup and replay -----
+    def open(self) -> None:
+        """Lock the journal file, queue the entries Postgres has not committed yet and start flushing"""
+        if not self.enabled or self._fd is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise RuntimeError(f"Purchase journal {self.path} is already open in another process")
+        self._fd = fd
+
+        last_seq = self._committed_seq()
+        entries = self._read_entries()
+        replay = [entry for entry in entries if entry.seq > last_seq]
+        self._seq = max([last_seq] + [entry.seq for entry in entries])
+        self._synced_seq = self._flushed_seq = self._seq
+        if replay:
+            self._flushed_seq = replay[0].seq - 1
+            self._pending.extend(replay)
+            self._stats['replayed'] = len(replay)
+            print(f"📒 Replaying {len(replay):,} journaled purchases after #{last_seq} from {self.path}")
+
+        self._stopping = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="purchase-journal", daemon=True)
+        self._flusher.start()
+
+    def _committed_seq(self) -> int:
+        conn = self._connection()
+        cur = conn.cursor()
+        cur.execute(INIT_PROGRESS_SQL, (self.journal_id,))
+        cur.execute(LOCK_PROGRESS_SQL, (self.journal_id,))
+        last_seq: int = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+        return last_seq
+
+    def _read_entries(self) -> List[_Entry]:
+        entries: List[_Entry] = []
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    record = json.loads(line)
+                except ValueError:
+                    if f.read(1):
+                        raise RuntimeError(f"Purchase journal {self.path} is corrupt at byte {offset}")
+                    # Torn append from a crash; it was never fsynced, so never acknowledged
+                    print(f"⚠️ Discarding a partial entry at the end of {self.path}")
+                    os.ftruncate(self._fd, offset)
+                    os.fsync(self._fd)
+                    break
+                offset += len(line)
+                entries.append(_Entry(record["seq"], 0.0, (
+                    record["supermarket_id"],
+                    datetime.fromisoformat(record["timestamp"]),
+                    record["user_id"],
+                    record["items"],
+                    Decimal(record["total"])
+                )))
+        return entries
+
+    # ----- Appending -----
+    def append(self, supermarket_id: str, timestamp: datetime, user_id: str, item_names: List[str],
+               total: Decimal) -> int:
+        """Durably journal one purchase; returns once it is on disk"""
+        with self._cond:
+            if self._failed is not None:
+                raise JournalWriteError(f"the journal is refusing purchases after a failed fsync: {self._failed}")
+            waiting = len(self._pending) + len(self._unsynced)
+            if waiting >= self.max_pending:
+                raise JournalFullError(f"{waiting:,} purchases are waiting to be written to the database")
+            seq = self._seq + 1
+            line = json.dumps({
+                "seq": seq,
+                "supermarket_id": supermarket_id,
+                "timestamp": timestamp.isoformat(),
+                "user_id": user_id,
+                "items": item_names,
+                "total": str(total)
+            }, separators=(",", ":")).encode() + b"\n"
+            # O_APPEND: one write per entry, never interleaved with another append
+            offset = os.fstat(self._fd).st_size
+            try:
+                written = os.write(self._fd, line)
+                while written < len(line):
+                    written += os.write(self._fd, line[written:])
+            except OSError as e:
+                # A partial line would make every later entry unreadable on replay
+                self._cut_off(offset, e)
+                raise JournalWriteError(f"could not write to {self.path}: {e}") from e
+            self._seq = seq
+            self._unsynced.append((offset, _Entry(seq, time.monotonic(), (supermarket_id, timestamp, user_id,
+                                                                          item_names, total))))
+            self._stats['appended'] += 1
+        self._sync(seq)
+        return seq
+
+    def _sync(self, seq: int) -> None:
+        # Group fsync: the first waiter syncs everything written so far for all of them,
+        # and only then are those entries handed to the flusher
+        with self._sync_lock:
+            with self._cond:
+                if self._synced_seq >= seq:
+                    return
+                if self._failed is not None:
+                    raise JournalWriteError(f"could not fsync {self.path}: {self._failed}")
+                target = self._seq
+            try:
+                os.fsync(self._fd)
+            except OSError as e:
+                with self._cond:
+                    self._fail(e)
+                raise JournalWriteError(f"could not fsync {self.path}: {e}") from e
+            with self._cond:
+                while self._unsynced and self._unsynced[0][1].seq <= target:
+                    self._pending.append(self._unsynced.popleft()[1])
+                self._synced_seq = target
+                self._stats['fsyncs'] += 1
+                self._cond.notify_all()
+
+    def _cut_off(self, offset: int, error: OSError) -> None:
+        # Called with the condition held: drop the bytes of an append that failed
+        try:
+            os.ftruncate(self._fd, offset)
+        except OSError as e:
+            self._fail(error)
+            print(f"❌ Could not remove a failed append from {self.path}: {e}")
+
+    def _fail(self, error: OSError) -> None:
+        # Called with the condition held. After a failed fsync the kernel may have dropped the
+        # unsynced pages and a later fsync may still succeed, so nothing written since the last
+        # good fsync is trusted: those appends fail, and so does every later one
+        self._failed = self._last_error = str(error).strip()
+        if self._unsynced:
+            try:
+                os.ftruncate(self._fd, self._unsynced[0][0])
+                os.fsync(self._fd)
+            except OSError as e:
+                print(f"❌ Could not cut {len(self._unsynced)} failed appends off {self.path}, "
+                      f"they will be replayed on restart: {e}")
+            self._unsynced.clear()
+        self._seq = self._synced_seq
+        print(f"❌ Purchase journal {self.path} is refusing purchases until restart: {self._failed}")
+
+    # ----- Flushing -----
+    def _ready(self) -> int:
+        # Only fsynced entries are queued
+        return len(self._pending)
+
+    def _flush_loop(self) -> None:
+        backoff = 1.0
+        while True:
+            with self._cond:
+                while True:
+                    ready = self._ready()
+                    if ready >= self.batch_size or (ready and self._stopping):
+                        break
+                    if ready:
+                        wait = self._pending[0].journaled_at + self.max_delay - time.monotonic()
+                        if wait <= 0:
+                            break
+                    elif self._stopping:
+                        return
+                    else:
+                        wait = 1.0
+                    self._cond.wait(wait)
+                batch = [self._pending[i] for i in range(min(ready, self.batch_size))]
+
+            try:
+                self._flush(batch)
+                self._rotate()
+                backoff = 1.0
+            except Exception as e:
+                # Database errors, but also a failed write to .rejected or a failed rotation:
+                # the flusher must outlive them, or acknowledged purchases wait for a restart
+                self._stats['flush_errors'] += 1
+                self._last_error = str(e).strip()
+                print(f"⚠️ Purchase journal flush failed, retrying in {backoff:.0f}s: {self._last_error}")
+                self._close_connection()
+                with self._cond:
+                    if self._stopping:
+                        return
+                    self._cond.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def _flush(self, batch: List[_Entry]) -> None:
+        """Write a batch and advance the committed sequence number in one transaction"""
+        conn = self._connection()
+        cur = conn.cursor()
+        try:
+            # The committed position decides what is new, so a retry after a commit whose
+            # outcome was unknown never writes a purchase twice
+            cur.execute(LOCK_PROGRESS_SQL, (self.journal_id,))
+            last_seq = cur.fetchone()[0]
+            rows = [entry.row for entry in batch if entry.seq > last_seq]
+            inserted = 0
+            if rows:
+                cur.execute("SAVEPOINT journal_batch;")
+                try:
+                    psycopg2.extras.execute_values(cur, INSERT_PURCHASES_SQL, rows, page_size=len(rows))
+                    inserted = len(rows)
+                except psycopg2.IntegrityError:
+                    cur.execute("ROLLBACK TO SAVEPOINT journal_batch;")
+                    inserted = self._insert_one_by_one(cur, rows)
+            cur.execute(SAVE_PROGRESS_SQL, (max(batch[-1].seq, last_seq), self.journal_id))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+        with self._cond:
+            for _ in batch:
+                self._pending.popleft()
+            self._flushed_seq = batch[-1].seq
+            self._stats['flushed'] += inserted
+            self._stats['batches'] += 1
+            self._last_error = None
+
+    def _insert_one_by_one(self, cur: Any, rows: List[Tuple[Any, ...]]) -> int:
+        # A store or customer deleted after the purchase was acknowledged; keep the rest of the batch
+        inserted = 0
+        for row in rows:
+            cur.execute("SAVEPOINT journal_row;")
+            try:
+                psycopg2.extras.execute_values(cur, INSERT_PURCHASES_SQL, [row])
+                inserted += 1
+            except psycopg2.IntegrityError as e:
+                cur.execute("ROLLBACK TO SAVEPOINT journal_row;")
+                self._reject(row, str(e).strip())
+        return inserted
+
+    def _reject(self, row: Tuple[Any, ...], reason: str) -> None:
+        supermarket_id, timestamp, user_id, items, total = row
+        with open(self.path + ".rejected", "a") as f:
+            f.write(json.dumps({"supermarket_id": supermarket_id, "timestamp": timestamp.isoformat(),
+                                "user_id": user_id, "items": items, "total": str(total),
+                                "error": reason}) + "\n")
+        self._stats['rejected'] += 1
+        print(f"❌ Journaled purchase rejected by the database (kept in {self.path}.rejected): {reason}")
+
+    def _rotate(self) -> None:
+        # Truncate the file once everything journaled is in the database
+        with self._cond:
+            if self._pending or self._unsynced or self._seq != self._flushed_seq:
+                return
+            if os.fstat(self._fd).st_size >= self.rotate_bytes:
+                os.ftruncate(self._fd, 0)
+                os.fsync(self._fd)
+                self._stats['rotations'] += 1
+
+    def _connection(self) -> psycopg2.extensions.connection:
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**get_db_config())
+        return self._conn
+
+    def _close_connection(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ----- Shutdown and statistics -----
+    def close(self, timeout: float = 30.0) -> None:
+        """Flush everything journaled so far (waiting up to ``timeout`` seconds), then release the file"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join(timeout=timeout)
+            self._flusher = None
+        self._close_connection()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending)
+            oldest = self._pending[0].journaled_at if self._pending else None
+            return {
+                **self._stats,
+                'pending': pending,
+                'oldest_pending_s': round(time.monotonic() - oldest, 3) if oldest is not None else None,
+                'last_seq': self._seq,
+                'flushed_seq': self._flushed_seq,
+                'avg_batch': round(self._stats['flushed'] / self._stats['batches'], 1) if self._stats['batches'] else 0.0,
+                'batch_size': self.batch_size,
+                'max_delay_ms': round(self.max_delay * 1000, 3),
+                'last_error': self._last_error,
+                'failed': self._failed is not None
+            }
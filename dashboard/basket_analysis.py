@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Incremental market-basket analysis ("frequently bought together").
+
+Each run reads the purchases added since the previous run, in id order and in
+chunks. Every basket is reduced to its distinct product ids (products.id), and
+co-occurrence counts are computed with NumPy/SciPy:
+
+- items and pairs come from the sparse basket x product incidence matrix B:
+  column sums give per-item basket counts, and the upper triangle of B.T @ B
+  gives per-pair counts
+- triples are enumerated per basket size with index combinations generated in
+  chunks, at most --max-keys triples at a time. Baskets with more than
+  --max-triple-items distinct products are left out of the triple counts (a
+  1000-item basket alone holds 166 million triples); they still count for items
+  and pairs
+
+The chunk's counts are added to the basket_*_counts tables in the same
+transaction that advances basket_analysis_state.last_purchase_id, so a run
+that dies partway through is resumed without counting any basket twice.
+Finally the association rules (support, confidence, lift) for every pair and
+triple above --min-support are rebuilt into basket_rules.
+
+Counts are additive, so the job assumes purchases are append-only; after
+deleting or editing purchases run it with --rebuild.
+
+Usage (inside the dashboard container):
+    python -m basket_analysis [--chunk-rows 200000] [--min-support 0.001] [--max-triple-items 100] [--rebuild]
+"""
+import argparse
+import io
+import sys
+import time
+from itertools import chain, combinations, islice
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import psycopg2
+from scipy import sparse
+
+from purchase_horizon import wait_for_in_flight_purchases
+from shared.db_config import validate_env_vars, get_db_connection
+
+DEFAULT_CHUNK_ROWS = 200_000
+DEFAULT_MIN_SUPPORT = 0.001
+DEFAULT_MAX_KEYS = 10_000_000
+DEFAULT_MAX_TRIPLE_ITEMS = 100
+# Triples are encoded as (a * n + b) * n + c, which fits int64 up to 2**21 products
+MAX_TRIPLE_PRODUCTS = 2 ** 21
+
+STATE_SQL = "SELECT last_purchase_id, basket_count, unknown_items FROM basket_analysis_state WHERE id = 1 FOR UPDATE;"
+PRODUCT_IDS_SQL = "SELECT name, id FROM products;"
+NEXT_CHUNK_SQL = """
+SELECT id, item_list FROM purchases
+WHERE id > %(after)s AND id <= %(horizon)s
+ORDER BY id
+LIMIT %(limit)s;
+"""
+
+ADD_COUNTS_SQL = {
+    'basket_item_counts': """
+        INSERT INTO basket_item_counts AS t (product_id, basket_count)
+        SELECT product_id, basket_count FROM basket_item_counts_delta
+        ON CONFLICT (product_id) DO UPDATE SET basket_count = t.basket_count + EXCLUDED.basket_count;
+    """,
+    'basket_pair_counts': """
+        INSERT INTO basket_pair_counts AS t (item_a, item_b, basket_count)
+        SELECT item_a, item_b, basket_count FROM basket_pair_counts_delta
+        ON CONFLICT (item_a, item_b) DO UPDATE SET basket_count = t.basket_count + EXCLUDED.basket_count;
+    """,
+    'basket_triple_counts': """
+        INSERT INTO basket_triple_counts AS t (item_a, item_b, item_c, basket_count)
+        SELECT item_a, item_b, item_c, basket_count FROM basket_triple_counts_delta
+        ON CONFLICT (item_a, item_b, item_c) DO UPDATE SET basket_count = t.basket_count + EXCLUDED.basket_count;
+    """
+}
+
+# For a pair {a, b}: a => b and b => a. For a triple {a, b, c}: {a, b} => c,
+# {a, c} => b and {b, c} => a; the antecedent pair's count is its basket count.
+REBUILD_RULES_SQL = """
+TRUNCATE basket_rules;
+
+INSERT INTO basket_rules (antecedent, consequent, itemset_size, basket_count, support, confidence, lift)
+SELECT
+    ARRAY[pa.name],
+    pc.name,
+    2,
+    p.basket_count,
+    p.basket_count::float8 / %(baskets)s,
+    p.basket_count::float8 / ia.basket_count,
+    p.basket_count::float8 * %(baskets)s / (ia.basket_count::float8 * ic.basket_count)
+FROM basket_pair_counts p
+CROSS JOIN LATERAL (VALUES (p.item_a, p.item_b), (p.item_b, p.item_a)) AS r(ante, cons)
+JOIN basket_item_counts ia ON ia.product_id = r.ante
+JOIN basket_item_counts ic ON ic.product_id = r.cons
+JOIN products pa ON pa.id = r.ante
+JOIN products pc ON pc.id = r.cons
+WHERE p.basket_count >= %(min_count)s;
+
+INSERT INTO basket_rules (antecedent, consequent, itemset_size, basket_count, support, confidence, lift)
+SELECT
+    ARRAY[px.name, py.name],
+    pc.name,
+    3,
+    t.basket_count,
+    t.basket_count::float8 / %(baskets)s,
+    t.basket_count::float8 / pp.basket_count,
+    t.basket_count::float8 * %(baskets)s / (pp.basket_count::float8 * ic.basket_count)
+FROM basket_triple_counts t
+CROSS JOIN LATERAL (VALUES
+    (t.item_a, t.item_b, t.item_c),
+    (t.item_a, t.item_c, t.item_b),
+    (t.item_b, t.item_c, t.item_a)
+) AS r(x, y, cons)
+JOIN basket_pair_counts pp ON pp.item_a = r.x AND pp.item_b = r.y
+JOIN basket_item_counts ic ON ic.product_id = r.cons
+JOIN products px ON px.id = r.x
+JOIN products py ON py.id = r.y
+JOIN products pc ON pc.id = r.cons
+WHERE t.basket_count >= %(min_count)s;
+
+UPDATE basket_analysis_state SET min_support = %(min_support)s, rules_updated_at = now() WHERE id = 1;
+"""
+
+
+# ----- Counting -----
+def incidence_matrix(baskets: Sequence[Sequence[str]], product_ids: Dict[str, int],
+                     n_products: int) -> Tuple[sparse.csr_matrix, int]:
+    """Binary basket x product matrix (duplicate items collapse) and the number of unknown items"""
+    rows: List[int] = []
+    cols: List[int] = []
+    unknown = 0
+    for row, items in enumerate(baskets):
+        for item in items:
+            product_id = product_ids.get(item)
+            if product_id is None:
+                unknown += 1
+                continue
+            rows.append(row)
+            cols.append(product_id)
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+        shape=(len(baskets), n_products)
+    )
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    matrix.data[:] = 1
+    return matrix, unknown
+
+
+def count_items_and_pairs(matrix: sparse.csr_matrix) -> Tuple[np.ndarray, sparse.coo_matrix]:
+    """Per-product basket counts and per-pair (i < j) basket counts"""
+    item_counts = np.asarray(matrix.sum(axis=0)).ravel()
+    pair_counts = sparse.triu(matrix.T @ matrix, k=1).tocoo()
+    return item_counts, pair_counts
+
+
+def index_triples(k: int, max_keys: int) -> Iterator[np.ndarray]:
+    """The (i < j < l) index triples of range(k), at most max_keys rows per array"""
+    triples = combinations(range(k), 3)
+    while True:
+        chunk = np.fromiter(chain.from_iterable(islice(triples, max_keys)), dtype=np.int64)
+        if not chunk.size:
+            return
+        yield chunk.reshape(-1, 3)
+
+
+def count_triples(matrix: sparse.csr_matrix, max_keys: int = DEFAULT_MAX_KEYS,
+                  max_items: int = DEFAULT_MAX_TRIPLE_ITEMS) -> Tuple[np.ndarray, np.ndarray]:
+    """Encoded (i < j < k) triple keys and their basket counts.
+
+    Baskets are grouped by their number of distinct products k, so each group is
+    a dense (baskets x k) array of sorted ids that chunks of index combinations
+    turn into triples without a Python loop per basket. Baskets with more than
+    max_items products are skipped.
+    """
+    n = matrix.shape[1]
+    if n > MAX_TRIPLE_PRODUCTS:
+        raise ValueError(f"{n:,} product ids are too many to encode triples as int64 (at most {MAX_TRIPLE_PRODUCTS:,})")
+    sizes = np.diff(matrix.indptr)
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+
+    for k in np.unique(sizes[(sizes >= 3) & (sizes <= max_items)]):
+        basket_rows = np.flatnonzero(sizes == k)
+        for combos in index_triples(int(k), max_keys):
+            per_batch = max(1, max_keys // len(combos))
+            for start in range(0, len(basket_rows), per_batch):
+                offsets = matrix.indptr[basket_rows[start:start + per_batch]]
+                ids = matrix.indices[offsets[:, None] + np.arange(k)].astype(np.int64)
+                batch_keys = ((ids[:, combos[:, 0]] * n + ids[:, combos[:, 1]]) * n + ids[:, combos[:, 2]]).ravel()
+                keys, counts = merge_counts(keys, counts, *np.unique(batch_keys, return_counts=True))
+
+    return keys, counts
+
+
+def merge_counts(keys: np.ndarray, counts: np.ndarray, new_keys: np.ndarray,
+                 new_counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum two (unique keys, counts) sets into one"""
+    merged_keys, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+    merged_counts = np.bincount(inverse, weights=np.concatenate([counts, new_counts]))
+    return merged_keys, merged_counts.astype(np.int64)
+
+
+# ----- Persistence -----
+def add_counts(cur: psycopg2.extensions.cursor, table: str, columns: Sequence[np.ndarray]) -> None:
+    """Add a chunk's counts to a basket_*_counts table via a COPYed delta table"""
+    if len(columns[0]) == 0:
+        return
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.column_stack(columns), fmt="%d", delimiter="\t")
+    buffer.seek(0)
+
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table}_delta (LIKE {table}) ON COMMIT DELETE ROWS;")
+    cur.copy_expert(f"COPY {table}_delta FROM STDIN", buffer)
+    cur.execute(ADD_COUNTS_SQL[table])
+
+
+def reset_counts(conn: psycopg2.extensions.connection) -> None:
+    cur = conn.cursor()
+    cur.execute("TRUNCATE basket_item_counts, basket_pair_counts, basket_triple_counts, basket_rules;")
+    cur.execute("""
+        UPDATE basket_analysis_state
+        SET last_purchase_id = 0, basket_count = 0, unknown_items = 0, min_support = NULL, rules_updated_at = NULL
+        WHERE id = 1;
+    """)
+    conn.commit()
+    cur.close()
+
+
+def run_basket_analysis(chunk_rows: int = DEFAULT_CHUNK_ROWS, min_support: float = DEFAULT_MIN_SUPPORT,
+                        max_keys: int = DEFAULT_MAX_KEYS, max_triple_items: int = DEFAULT_MAX_TRIPLE_ITEMS,
+                        rebuild: bool = False) -> None:
+    """Count the purchases added since the last run and rebuild the association rules"""
+    conn = get_db_connection()
+    try:
+        if rebuild:
+            print("🧹 Discarding existing basket counts...")
+            reset_counts(conn)
+
+        cur = conn.cursor()
+        cur.execute(PRODUCT_IDS_SQL)
+        product_ids = dict(cur.fetchall())
+        n_products = max(product_ids.values(), default=0) + 1
+        conn.commit()
+
+        horizon = wait_for_in_flight_purchases(conn)
+        started = time.time()
+        processed = 0
+
+        while True:
+            # The state row lock also keeps two runs from counting the same chunk
+            cur.execute(STATE_SQL)
+            last_purchase_id, basket_count, unknown_items = cur.fetchone()
+            cur.execute(NEXT_CHUNK_SQL, {'after': last_purchase_id, 'horizon': horizon, 'limit': chunk_rows})
+            rows = cur.fetchall()
+            if not rows:
+                conn.commit()
+                break
+
+            matrix, unknown = incidence_matrix([row[1] for row in rows], product_ids, n_products)
+            item_counts, pairs = count_items_and_pairs(matrix)
+            triple_keys, triple_counts = count_triples(matrix, max_keys, max_triple_items)
+            oversized = int(np.count_nonzero(np.diff(matrix.indptr) > max_triple_items))
+
+            items = np.flatnonzero(item_counts)
+            add_counts(cur, 'basket_item_counts', [items, item_counts[items]])
+            add_counts(cur, 'basket_pair_counts', [pairs.row, pairs.col, pairs.data])
+            add_counts(cur, 'basket_triple_counts', [
+                triple_keys // (n_products * n_products),
+                triple_keys // n_products % n_products,
+                triple_keys % n_products,
+                triple_counts
+            ])
+            cur.execute(
+                "UPDATE basket_analysis_state SET last_purchase_id = %s, basket_count = %s, unknown_items = %s WHERE id = 1;",
+                (rows[-1][0], basket_count + len(rows), unknown_items + unknown)
+            )
+            conn.commit()
+
+            processed += len(rows)
+            elapsed = time.time() - started
+            print(f"   🧺 {processed:,} baskets counted (up to purchase {rows[-1][0]:,}), "
+                  f"{len(pairs.data):,} pairs and {len(triple_keys):,} triples in this chunk - "
+                  f"{processed / elapsed:,.0f} baskets/s"
+                  + (f" ({oversized:,} baskets over {max_triple_items} products left out of triples)" if oversized else ""))
+
+        cur.execute("SELECT basket_count FROM basket_analysis_state WHERE id = 1;")
+        baskets = cur.fetchone()[0]
+        if baskets:
+            min_count = max(1, int(np.ceil(min_support * baskets)))
+            cur.execute(REBUILD_RULES_SQL, {
+                'baskets': baskets, 'min_count': min_count, 'min_support': min_support
+            })
+            cur.execute("SELECT COUNT(*) FROM basket_rules;")
+            rules = cur.fetchone()[0]
+            conn.commit()
+            print(f"📐 {rules:,} rules with support >= {min_support:g} ({min_count:,} of {baskets:,} baskets)")
+        cur.close()
+        print(f"✅ Basket analysis up to date: {processed:,} new baskets in {time.time() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Incrementally count co-occurring products and rebuild basket rules")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="Purchases counted and committed per chunk")
+    parser.add_argument("--min-support", type=float, default=DEFAULT_MIN_SUPPORT,
+                        help="Minimum share of baskets an itemset needs to produce rules")
+    parser.add_argument("--max-keys", type=int, default=DEFAULT_MAX_KEYS,
+                        help="Upper bound on triples enumerated at once (bounds memory for large baskets)")
+    parser.add_argument("--max-triple-items", type=int, default=DEFAULT_MAX_TRIPLE_ITEMS,
+                        help="Leave baskets with more distinct products than this out of the triple counts")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Discard all counts and recount the whole purchase history")
+    args = parser.parse_args()
+
+    validate_env_vars()
+    try:
+        run_basket_analysis(args.chunk_rows, args.min_support, args.max_keys, args.max_triple_items, args.rebuild)
+    except Exception as e:
+        print(f"❌ Error during basket analysis: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
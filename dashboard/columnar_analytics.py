@@ -0,0 +1,721 @@
+"""
+Columnar in-memory analytics for the dashboard (optional).
+
+When enabled, the dashboard keeps a column-per-field copy of purchases in NumPy
+arrays, one element per purchase, with every string replaced by an integer code:
+
+- id, timestamp (microseconds since the epoch) and total (cents) as int64
+- supermarket and customer as int32 codes into the store and customer dictionaries
+- basket items as int32 product codes in one flat array, split by per-purchase end offsets
+
+Columns are appended to raw files in DASHBOARD_COLUMNAR_DIR and memory-mapped, so a
+restart maps the snapshot instead of reading purchase history again. New purchases
+are read by id once every transaction that could still commit a lower id has
+finished (purchase_horizon); per-customer and per-product totals are advanced with
+them. Only the background refresher reads the database for this; a request never
+waits for it.
+
+/unique-customers (the chain total and exact counts), /loyal-customers and
+/top-products are then answered with bincount, lexsort and boolean masks. Every
+query returns exactly the rows of the SQL it replaces, or None when the snapshot
+cannot answer exactly and the caller runs the SQL:
+
+- before the snapshot is loaded, or while it is behind the purchases high-water
+  mark (the request wakes the refresher, so the next ones are answered again)
+- for all-time results, which SQL reads from the rollups, when the rollups do not
+  count the same purchases. They describe the attached partitions, as the snapshot
+  does: db.purchase_partitions subtracts a month from them when it is archived and
+  bumps purchase_rewrites, so they differ only until that month's rebuild (or, on
+  databases that archived months before migration 011, until
+  rebuild_purchase_rollups() is run)
+- for timezone-aware times when the database session time zone is not UTC
+
+Purchases that are deleted or edited keep their ids, so the snapshot is rebuilt
+from scratch whenever the purchase_rewrites counter kept by the rollup triggers
+moves. Purchase count, revenue and items up to the snapshot's last id are also
+compared with the database at startup, when partitions are attached or detached,
+when the rollups stop matching and every DASHBOARD_COLUMNAR_VERIFY_INTERVAL
+seconds, and the snapshot is rebuilt if they differ.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from functools import cached_property
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import psycopg2
+
+from purchase_horizon import wait_for_in_flight_purchases
+from shared.db_config import get_db_config, pooled_connection
+
+FORMAT_VERSION = 1
+EPOCH = datetime(1970, 1, 1)
+UTC_ZONES = ("UTC", "Etc/UTC", "GMT", "Etc/GMT", "UCT", "Etc/UCT", "Universal", "Zulu")
+
+# Column files: dtype, the meta entry holding their length, and the shape of one element.
+# Customer uuids are stored as two big-endian halves, so comparing (hi, lo) orders
+# them exactly like PostgreSQL's uuid type
+COLUMNS: Dict[str, Tuple[np.dtype, str, Tuple[int, ...]]] = {
+    'ids': (np.dtype('<i8'), 'rows', ()),
+    'timestamps': (np.dtype('<i8'), 'rows', ()),
+    'cents': (np.dtype('<i8'), 'rows', ()),
+    'stores': (np.dtype('<i4'), 'rows', ()),
+    'customers': (np.dtype('<i4'), 'rows', ()),
+    'item_ends': (np.dtype('<i8'), 'rows', ()),
+    'items': (np.dtype('<i4'), 'items', ()),
+    'customer_keys': (np.dtype('>u8'), 'customers', (2,))
+}
+
+# Polled every refresh: the highest id, the counter bumped by deletes, updates and
+# truncates (db/init.sql, section 7) and the attached partitions, which change when
+# old months are archived
+CHANGES_SQL = """
+SELECT
+    (SELECT COALESCE(MAX(id), 0) FROM purchases),
+    (SELECT value FROM analytics_counters WHERE name = 'purchase_rewrites'),
+    (SELECT array_agg(inhrelid::bigint ORDER BY inhrelid) FROM pg_inherits WHERE inhparent = 'purchases'::regclass);
+"""
+NEXT_CHUNK_SQL = """
+SELECT
+    id,
+    supermarket_id,
+    (EXTRACT(EPOCH FROM timestamp) * 1000000)::bigint,
+    uuid_send(user_id),
+    item_list,
+    (total_amount * 100)::bigint
+FROM purchases
+WHERE id > %(after)s AND id <= %(horizon)s
+ORDER BY id
+LIMIT %(limit)s;
+"""
+# One statement, so the rollups and the purchases past the snapshot are read from
+# the same database snapshot
+ROLLUP_CHECK_SQL = """
+SELECT rollup.purchases, rollup.cents, products.items, counter.customers,
+       later.purchases, later.cents, later.items, later.customers
+FROM (
+    SELECT COALESCE(SUM(purchase_count), 0), (COALESCE(SUM(total_spent), 0) * 100)::bigint
+    FROM customer_purchase_rollup
+) AS rollup(purchases, cents), (
+    SELECT COALESCE(SUM(sales_count), 0) FROM product_sales_rollup
+) AS products(items), (
+    SELECT COALESCE(MAX(value), 0) FROM analytics_counters WHERE name = 'distinct_customers'
+) AS counter(customers), (
+    SELECT COUNT(*), (COALESCE(SUM(total_amount), 0) * 100)::bigint, COALESCE(SUM(cardinality(item_list)), 0),
+           COUNT(DISTINCT user_id) FILTER (WHERE NOT EXISTS (
+               SELECT 1 FROM purchases earlier WHERE earlier.user_id = p.user_id AND earlier.id <= %(last_id)s
+           ))
+    FROM purchases p
+    WHERE id > %(last_id)s
+) AS later(purchases, cents, items, customers);
+"""
+VERIFY_SQL = """
+SELECT COUNT(*), (COALESCE(SUM(total_amount), 0) * 100)::bigint, COALESCE(SUM(cardinality(item_list)), 0)
+FROM purchases
+WHERE id <= %(last_id)s;
+"""
+PRODUCT_ORDER_SQL = "SELECT name FROM unnest(%(names)s::text[]) AS product(name) ORDER BY name;"
+REAL_IDS_SQL = "SELECT uuid_send(uuid), real_id FROM customers WHERE uuid = ANY(%(uuids)s::uuid[]);"
+
+
+def get_columnar_analytics_config() -> Dict[str, Any]:
+    """Get columnar analytics settings from environment variables"""
+    return {
+        'enabled': os.getenv("DASHBOARD_COLUMNAR_ENABLED", "false").lower() in ("1", "true", "yes"),
+        'path': os.getenv("DASHBOARD_COLUMNAR_DIR", "/app/columnar"),
+        'refresh_interval': float(os.getenv("DASHBOARD_COLUMNAR_REFRESH_INTERVAL", "1")),
+        'verify_interval': float(os.getenv("DASHBOARD_COLUMNAR_VERIFY_INTERVAL", "600")),
+        'chunk_rows': int(os.getenv("DASHBOARD_COLUMNAR_CHUNK_ROWS", "100000")),
+        'real_id_cache_size': int(os.getenv("DASHBOARD_COLUMNAR_REAL_ID_CACHE_SIZE", "100000"))
+    }
+
+
+def _encode(values: Sequence[Hashable], codes: Dict[Hashable, int], names: List[Hashable]) -> np.ndarray:
+    """Dictionary-encode values, appending the ones not seen before to names"""
+    encoded = np.fromiter((codes.setdefault(value, len(codes)) for value in values), np.int32, len(values))
+    if len(codes) > len(names):
+        names.extend(list(codes)[len(names):])
+    return encoded
+
+
+def _grow(values: np.ndarray, size: int) -> np.ndarray:
+    """A copy of values zero-padded to size, for totals gaining new codes"""
+    grown = np.zeros(size, dtype=values.dtype)
+    grown[:values.size] = values
+    return grown
+
+
+def _micros(value: date) -> int:
+    """A date or datetime bound on the purchases timestamp scale (microseconds since the epoch)"""
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    elif value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+@dataclass(frozen=True)
+class ColumnarSnapshot:
+    """One immutable version of the columns, their dictionaries and the totals derived from them"""
+    last_id: int
+    rows: int
+    columns: Dict[str, np.ndarray]
+    store_codes: Dict[str, int]
+    product_names: List[str]
+    product_order: np.ndarray
+    customer_hi: np.ndarray
+    customer_lo: np.ndarray
+    customer_purchases: np.ndarray
+    customer_spent: np.ndarray
+    product_sales: np.ndarray
+    matches_rollups: bool
+
+    @property
+    def items(self) -> int:
+        return int(self.columns['items'].size)
+
+    @cached_property
+    def loyal_order(self) -> np.ndarray:
+        """Customer codes with purchases, most purchases first, then most spent, then highest uuid"""
+        buyers = np.flatnonzero(self.customer_purchases)
+        order = np.lexsort((self.customer_lo[buyers], self.customer_hi[buyers],
+                            self.customer_spent[buyers], self.customer_purchases[buyers]))
+        return buyers[order[::-1]]
+
+    @cached_property
+    def loyal_counts(self) -> np.ndarray:
+        """Negated purchase counts in loyal_order, ascending for searchsorted"""
+        return -self.customer_purchases[self.loyal_order]
+
+    def loyal_key(self, code: int) -> Tuple[int, Decimal, int]:
+        """The (purchase_count, total_spent, user_id) sort key SQL compares cursors with"""
+        return (int(self.customer_purchases[code]), Decimal(int(self.customer_spent[code])).scaleb(-2),
+                (int(self.customer_hi[code]) << 64) | int(self.customer_lo[code]))
+
+    def customer_uuid(self, code: int) -> str:
+        return str(uuid.UUID(int=(int(self.customer_hi[code]) << 64) | int(self.customer_lo[code])))
+
+
+class ColumnarAnalytics:
+    """Memory-mapped columnar copy of purchases answering dashboard queries with NumPy"""
+
+    def __init__(self, high_water_mark: Callable[[], int], enabled: bool = False, path: str = "/app/columnar",
+                 refresh_interval: float = 1.0, verify_interval: float = 600.0, chunk_rows: int = 100_000,
+                 real_id_cache_size: int = 100_000):
+        self.enabled = enabled
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.verify_interval = verify_interval
+        self.chunk_rows = chunk_rows
+        self.real_id_cache_size = real_id_cache_size
+        self._high_water_mark = high_water_mark
+        # _working matches the committed files; _snapshot is what queries read, once checked
+        self._working: Optional[ColumnarSnapshot] = None
+        self._snapshot: Optional[ColumnarSnapshot] = None
+        self._meta: Dict[str, Any] = {}
+        self._store_codes: Dict[str, int] = {}
+        self._store_names: List[str] = []
+        self._product_codes: Dict[str, int] = {}
+        self._product_names: List[str] = []
+        self._customer_codes: Dict[bytes, int] = {}
+        self._customer_keys: List[bytes] = []
+        # LRU of the customers on recently served pages, never written to disk: a real_id never changes
+        self._real_id_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._real_id_lock = threading.Lock()
+        self._conn: Optional[psycopg2.extensions.connection] = None
+        self._utc_session = False
+        self._needs_check = True
+        self._verify_due = 0.0
+        self._rewrites: Optional[int] = None
+        self._partitions: Optional[List[int]] = None
+        self._lock_file: Optional[Any] = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        # Set by a request that found the snapshot behind, to refresh without waiting out the interval
+        self._wake = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+        self._stats = {'refreshes': 0, 'rows_read': 0, 'rebuilds': 0, 'refresh_errors': 0,
+                       'answered': 0, 'fallbacks': 0, 'behind': 0, 'real_id_evictions': 0,
+                       'load_ms': 0.0, 'last_refresh_ms': 0.0}
+
+    # ----- Queries -----
+    def unique_customers_total(self) -> Optional[int]:
+        """Customers with at least one purchase, as counted by the rollups"""
+        snap = self._current(all_time=True)
+        if snap is None:
+            return None
+        return int(np.count_nonzero(snap.customer_purchases))
+
+    def unique_customers(self, supermarket_ids: Optional[List[str]], start: Optional[date],
+                         end: Optional[date]) -> Optional[int]:
+        """COUNT(DISTINCT user_id) of the purchases at these stores in [start, end)"""
+        snap = self._current(bounds=(start, end))
+        if snap is None:
+            return None
+        mask = self._purchase_mask(snap, supermarket_ids, start, end)
+        if mask is None:
+            return int(np.count_nonzero(snap.customer_purchases))
+        seen = np.zeros(snap.customer_purchases.size, dtype=bool)
+        seen[snap.columns['customers'][mask]] = True
+        return int(np.count_nonzero(seen))
+
+    def loyal_customers(self, min_purchases: int, limit: int,
+                        after: Optional[Dict[str, Any]]) -> Optional[Tuple[List[Tuple[Any, ...]], Optional[int]]]:
+        """Up to limit (real_id, uuid, purchase_count, total_spent) rows after the cursor, and on
+        the first page the number of customers with min_purchases purchases"""
+        snap = self._current(all_time=True)
+        if snap is None:
+            return None
+        order = snap.loyal_order
+        # Purchase count leads the order, so the qualifying customers are a prefix
+        qualifying = int(np.searchsorted(snap.loyal_counts, -min_purchases, side="right"))
+        total: Optional[int] = qualifying if after is None else None
+        begin = 0
+        if after is not None:
+            cursor = (after['purchase_count'], after['total_spent'], uuid.UUID(after['user_id']).int)
+            # First row whose key sorts below the cursor, like the keyset condition in SQL
+            end = qualifying
+            while begin < end:
+                middle = (begin + end) // 2
+                if snap.loyal_key(order[middle]) < cursor:
+                    end = middle
+                else:
+                    begin = middle + 1
+
+        codes = order[begin:min(begin + limit, qualifying)]
+        uuids = [snap.customer_uuid(code) for code in codes]
+        real_ids = self._real_ids(uuids)
+        if real_ids is None:
+            return None
+        rows = [(real_ids[customer_uuid], customer_uuid, int(snap.customer_purchases[code]),
+                 Decimal(int(snap.customer_spent[code])).scaleb(-2))
+                for code, customer_uuid in zip(codes, uuids)]
+        return rows, total
+
+    def top_products(self, n: int, supermarket_id: Optional[str], start: Optional[datetime],
+                     end: Optional[datetime]) -> Optional[List[Tuple[str, int, int]]]:
+        """(product_name, sales_count, rank) of every product among the n highest distinct counts"""
+        all_time = supermarket_id is None and start is None and end is None
+        snap = self._current(all_time=all_time, bounds=(start, end))
+        if snap is None:
+            return None
+        mask = self._purchase_mask(snap, [supermarket_id] if supermarket_id is not None else None, start, end)
+        if mask is None:
+            sales = snap.product_sales
+        else:
+            basket_sizes = np.diff(snap.columns['item_ends'], prepend=0)
+            sold = snap.columns['items'][np.repeat(mask, basket_sizes)]
+            sales = np.bincount(sold, minlength=len(snap.product_names))
+
+        products = np.flatnonzero(sales)
+        counts = sales[products]
+        distinct = np.unique(counts)
+        # Dense rank: 1 for the highest count, one more for each lower distinct count
+        ranks = distinct.size - np.searchsorted(distinct, counts)
+        keep = ranks <= n
+        products, counts, ranks = products[keep], counts[keep], ranks[keep]
+        order = np.lexsort((snap.product_order[products], -counts))
+        return [(snap.product_names[products[i]], int(counts[i]), int(ranks[i])) for i in order]
+
+    def _current(self, all_time: bool = False,
+                 bounds: Tuple[Optional[date], ...] = ()) -> Optional[ColumnarSnapshot]:
+        """The published snapshot if it can answer exactly at the purchases high-water mark"""
+        snap = self._snapshot
+        # PostgreSQL compares a timezone-aware bound with the timestamp column in the session time zone
+        aware = any(isinstance(bound, datetime) and bound.tzinfo is not None for bound in bounds)
+        if snap is not None and (aware and not self._utc_session):
+            snap = None
+        elif snap is not None and snap.last_id < self._high_water_mark():
+            # Catching up is the refresher's job; this request is answered by SQL
+            self._stats['behind'] += 1
+            self._wake.set()
+            snap = None
+        if snap is None or (all_time and not snap.matches_rollups):
+            self._stats['fallbacks'] += 1
+            return None
+        self._stats['answered'] += 1
+        return snap
+
+    @staticmethod
+    def _purchase_mask(snap: ColumnarSnapshot, supermarket_ids: Optional[List[str]],
+                       start: Optional[date], end: Optional[date]) -> Optional[np.ndarray]:
+        """Boolean mask of the purchases matching the filters, or None without filters"""
+        mask: Optional[np.ndarray] = None
+        if supermarket_ids:
+            codes = [snap.store_codes[store] for store in supermarket_ids if store in snap.store_codes]
+            mask = np.isin(snap.columns['stores'], codes)
+        timestamps = snap.columns['timestamps']
+        if start is not None:
+            mask = (timestamps >= _micros(start)) if mask is None else mask & (timestamps >= _micros(start))
+        if end is not None:
+            mask = (timestamps < _micros(end)) if mask is None else mask & (timestamps < _micros(end))
+        return mask
+
+    def _real_ids(self, uuids: List[str]) -> Optional[Dict[str, str]]:
+        """real_id of each customer uuid, looking up the ones not cached"""
+        found: Dict[str, str] = {}
+        with self._real_id_lock:
+            for customer_uuid in uuids:
+                real_id = self._real_id_cache.get(customer_uuid)
+                if real_id is not None:
+                    self._real_id_cache.move_to_end(customer_uuid)
+                    found[customer_uuid] = real_id
+        missing = [customer_uuid for customer_uuid in uuids if customer_uuid not in found]
+        if missing:
+            with pooled_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(REAL_IDS_SQL, {'uuids': missing})
+                for key, real_id in cur.fetchall():
+                    found[str(uuid.UUID(bytes=bytes(key)))] = real_id
+                cur.close()
+            # A replica that has not replayed a new customer yet: SQL answers consistently
+            if any(customer_uuid not in found for customer_uuid in missing):
+                return None
+            self._cache_real_ids((customer_uuid, found[customer_uuid]) for customer_uuid in missing)
+        return found
+
+    def _cache_real_ids(self, items: Iterable[Tuple[str, str]]) -> None:
+        if self.real_id_cache_size <= 0:
+            return
+        with self._real_id_lock:
+            for customer_uuid, real_id in items:
+                self._real_id_cache[customer_uuid] = real_id
+                self._real_id_cache.move_to_end(customer_uuid)
+            while len(self._real_id_cache) > self.real_id_cache_size:
+                self._real_id_cache.popitem(last=False)
+                self._stats['real_id_evictions'] += 1
+
+    # ----- Column files -----
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _map(self, name: str) -> np.ndarray:
+        dtype, length, shape = COLUMNS[name]
+        count = self._meta[length]
+        if count == 0:
+            return np.empty((0,) + shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=(count,) + shape)
+
+    def _append(self, chunk: Dict[str, np.ndarray], meta: Dict[str, Any]) -> None:
+        """Append to the column files, then commit the new lengths by replacing meta.json"""
+        for name, values in chunk.items():
+            dtype, length, shape = COLUMNS[name]
+            committed = self._meta[length] * dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            with open(self._file(name), "ab") as f:
+                # Drop whatever an interrupted append left past the committed length
+                f.truncate(committed)
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        temp = os.path.join(self.path, "meta.json.tmp")
+        with open(temp, "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, os.path.join(self.path, "meta.json"))
+        self._meta = meta
+
+    def _wipe(self) -> None:
+        # Mapped snapshots keep the unlinked files alive until they are released
+        for path in [self._file(name) for name in COLUMNS] + [os.path.join(self.path, "meta.json")]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load(self) -> ColumnarSnapshot:
+        """Map the committed files (or start empty) and rebuild the dictionaries and totals"""
+        started = time.perf_counter()
+        self._meta = {'format': FORMAT_VERSION, 'last_id': 0, 'rows': 0, 'items': 0, 'customers': 0,
+                      'stores': [], 'products': [], 'product_order': []}
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('format') == FORMAT_VERSION:
+                self._meta = meta
+        try:
+            columns = {name: self._map(name) for name in COLUMNS}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Columnar snapshot in {self.path} is unreadable, rebuilding: {e}")
+            self._wipe()
+            return self._load()
+
+        self._store_names = list(self._meta['stores'])
+        self._store_codes = {name: code for code, name in enumerate(self._store_names)}
+        self._product_names = list(self._meta['products'])
+        self._product_codes = {name: code for code, name in enumerate(self._product_names)}
+        keys = columns['customer_keys']
+        raw = keys.tobytes()
+        self._customer_keys = [raw[i:i + 16] for i in range(0, len(raw), 16)]
+        self._customer_codes = {key: code for code, key in enumerate(self._customer_keys)}
+
+        customers = columns['customers']
+        customer_spent = np.zeros(len(self._customer_keys), dtype=np.int64)
+        np.add.at(customer_spent, customers, columns['cents'])
+        snap = ColumnarSnapshot(
+            last_id=self._meta['last_id'],
+            rows=self._meta['rows'],
+            columns=columns,
+            store_codes=dict(self._store_codes),
+            product_names=list(self._product_names),
+            product_order=np.asarray(self._meta['product_order'], dtype=np.int64),
+            customer_hi=keys[:, 0].astype(np.uint64),
+            customer_lo=keys[:, 1].astype(np.uint64),
+            customer_purchases=np.bincount(customers, minlength=len(self._customer_keys)).astype(np.int64),
+            customer_spent=customer_spent,
+            product_sales=np.bincount(columns['items'], minlength=len(self._product_names)).astype(np.int64),
+            matches_rollups=False
+        )
+        # Checked against the database before it is published
+        self._needs_check = True
+        self._verify_due = 0.0
+        self._rewrites = self._meta.get('rewrites')
+        self._partitions = None
+        self._stats['load_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return snap
+
+    # ----- Refresh -----
+    def _connection(self) -> psycopg2.extensions.connection:
+        # The primary, like the live updates listener: a replica may be behind the high-water mark
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**get_db_config())
+            cur = self._conn.cursor()
+            cur.execute("SELECT current_setting('TimeZone');")
+            self._utc_session = cur.fetchone()[0] in UTC_ZONES
+            cur.close()
+            self._conn.commit()
+        return self._conn
+
+    def refresh(self) -> None:
+        """Read the purchases added since the last refresh and publish the new snapshot"""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        started = time.perf_counter()
+        conn = self._connection()
+        cur = conn.cursor()
+        cur.execute(CHANGES_SQL)
+        latest, rewrites, partitions = cur.fetchone()
+        conn.commit()
+        if self._rewrites is not None and rewrites != self._rewrites:
+            # Deleted or edited purchases keep their ids, so nothing short of a re-read finds them
+            self._rebuild("purchases were deleted or edited")
+        self._rewrites = rewrites
+        snap = self._working
+        # Archived or re-attached months change the partitions but not MAX(id)
+        verify = partitions != self._partitions or time.monotonic() >= self._verify_due
+        if latest <= snap.last_id and not verify and not self._needs_check:
+            cur.close()
+            return
+
+        added = 0
+        if latest > snap.last_id:
+            horizon = wait_for_in_flight_purchases(conn)
+            while True:
+                cur.execute(NEXT_CHUNK_SQL, {'after': snap.last_id, 'horizon': horizon, 'limit': self.chunk_rows})
+                rows = cur.fetchall()
+                conn.commit()
+                if not rows:
+                    break
+                snap = self._working = self._extend(snap, rows, conn)
+                added += len(rows)
+        cur.close()
+
+        matches = self._matches_rollups(conn, snap)
+        published = self._snapshot
+        if verify or (published is not None and published.matches_rollups and not matches):
+            self._partitions = partitions
+            self._verify_due = time.monotonic() + self.verify_interval
+            if not self._verify(conn, snap):
+                self._rebuild(f"purchases up to id {snap.last_id} no longer match")
+                return self._refresh()
+
+        self._working = self._snapshot = replace(snap, matches_rollups=matches)
+        self._stats['refreshes'] += 1
+        self._stats['rows_read'] += added
+        self._stats['last_refresh_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    def _rebuild(self, reason: str) -> None:
+        """Discard the snapshot; the refresh then reads every purchase again"""
+        print(f"🧹 Rebuilding the columnar snapshot: {reason}")
+        self._stats['rebuilds'] += 1
+        self._snapshot = None
+        self._wipe()
+        self._working = self._load()
+
+    def _extend(self, snap: ColumnarSnapshot, rows: List[Tuple[Any, ...]],
+                conn: psycopg2.extensions.connection) -> ColumnarSnapshot:
+        """Encode a chunk of purchases, append it to the files and derive the next snapshot"""
+        ids, store_ids, micros, keys, item_lists, cents = zip(*rows)
+        known_customers = len(self._customer_keys)
+        known_products = len(self._product_names)
+        items = [item for basket in item_lists for item in basket]
+        chunk = {
+            'ids': np.array(ids, dtype=np.int64),
+            'timestamps': np.array(micros, dtype=np.int64),
+            'cents': np.array(cents, dtype=np.int64),
+            'stores': _encode(store_ids, self._store_codes, self._store_names),
+            'customers': _encode([bytes(key) for key in keys], self._customer_codes, self._customer_keys),
+            'item_ends': snap.items + np.cumsum(np.fromiter(map(len, item_lists), np.int64, len(ids))),
+            'items': _encode(items, self._product_codes, self._product_names)
+        }
+        chunk['customer_keys'] = np.frombuffer(b"".join(self._customer_keys[known_customers:]),
+                                               dtype='>u8').reshape(-1, 2)
+
+        product_order = self._meta['product_order']
+        if len(self._product_names) > known_products:
+            # ORDER BY product_name follows the database collation, not Python's string order
+            cur = conn.cursor()
+            cur.execute(PRODUCT_ORDER_SQL, {'names': self._product_names})
+            position = {row[0]: i for i, row in enumerate(cur.fetchall())}
+            cur.close()
+            conn.commit()
+            product_order = [position[name] for name in self._product_names]
+
+        self._append(chunk, {
+            **self._meta,
+            'last_id': int(ids[-1]),
+            'rows': snap.rows + len(ids),
+            'items': snap.items + len(items),
+            'customers': len(self._customer_keys),
+            'stores': list(self._store_names),
+            'products': list(self._product_names),
+            'product_order': product_order,
+            'rewrites': self._rewrites
+        })
+
+        customer_count = len(self._customer_keys)
+        customer_purchases = _grow(snap.customer_purchases, customer_count)
+        customer_purchases += np.bincount(chunk['customers'], minlength=customer_count)
+        customer_spent = _grow(snap.customer_spent, customer_count)
+        np.add.at(customer_spent, chunk['customers'], chunk['cents'])
+        product_sales = _grow(snap.product_sales, len(self._product_names))
+        product_sales += np.bincount(chunk['items'], minlength=len(self._product_names))
+        new_keys = chunk['customer_keys']
+        return ColumnarSnapshot(
+            last_id=self._meta['last_id'],
+            rows=self._meta['rows'],
+            columns={name: self._map(name) for name in COLUMNS},
+            store_codes=dict(self._store_codes),
+            product_names=list(self._product_names),
+            product_order=np.asarray(product_order, dtype=np.int64),
+            customer_hi=np.concatenate([snap.customer_hi, new_keys[:, 0].astype(np.uint64)]),
+            customer_lo=np.concatenate([snap.customer_lo, new_keys[:, 1].astype(np.uint64)]),
+            customer_purchases=customer_purchases,
+            customer_spent=customer_spent,
+            product_sales=product_sales,
+            matches_rollups=snap.matches_rollups
+        )
+
+    def _matches_rollups(self, conn: psycopg2.extensions.connection, snap: ColumnarSnapshot) -> bool:
+        """Whether the rollups count exactly the snapshot's purchases plus the ones added after it"""
+        cur = conn.cursor()
+        cur.execute(ROLLUP_CHECK_SQL, {'last_id': snap.last_id})
+        (rollup_purchases, rollup_cents, rollup_items, rollup_customers,
+         later_purchases, later_cents, later_items, later_customers) = cur.fetchone()
+        cur.close()
+        conn.commit()
+        self._needs_check = False
+        return (rollup_purchases - later_purchases == snap.rows
+                and rollup_cents - later_cents == int(snap.customer_spent.sum())
+                and rollup_items - later_items == snap.items
+                and rollup_customers - later_customers == int(np.count_nonzero(snap.customer_purchases)))
+
+    @staticmethod
+    def _verify(conn: psycopg2.extensions.connection, snap: ColumnarSnapshot) -> bool:
+        """Whether the purchases up to the snapshot's last id are still exactly the snapshot's"""
+        cur = conn.cursor()
+        cur.execute(VERIFY_SQL, {'last_id': snap.last_id})
+        purchases, cents, items = cur.fetchone()
+        cur.close()
+        conn.commit()
+        return purchases == snap.rows and cents == int(snap.customer_spent.sum()) and items == snap.items
+
+    def _refresh_failed(self, error: Exception) -> None:
+        """Reconnect and restart from the committed files; the published snapshot stays valid"""
+        self._stats['refresh_errors'] += 1
+        print(f"⚠️ Columnar analytics refresh failed: {error}")
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._working = self._load()
+
+    # ----- Background refresh -----
+    def start(self) -> None:
+        """Map the committed snapshot and keep it current from a background thread"""
+        if not self.enabled or self._refresher is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        # Two processes appending to the same files would corrupt them
+        self._lock_file = open(os.path.join(self.path, ".lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print(f"⚠️ {self.path} is used by another dashboard process; columnar analytics disabled")
+            self._lock_file.close()
+            self._lock_file = None
+            self.enabled = False
+            return
+        self._stop.clear()
+        self._wake.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="columnar-analytics", daemon=True)
+        self._refresher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._refresher is not None:
+            self._refresher.join(timeout=10)
+            self._refresher = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _refresh_loop(self) -> None:
+        with self._refresh_lock:
+            self._working = self._load()
+        if self._working.rows:
+            print(f"📂 Mapped columnar snapshot of {self._working.rows:,} purchases "
+                  f"in {self._stats['load_ms']:.0f} ms")
+        backoff = self.refresh_interval
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.refresh()
+                backoff = self.refresh_interval
+                wait = self._wake.wait
+            except Exception as e:
+                with self._refresh_lock:
+                    self._refresh_failed(e)
+                backoff = min(max(backoff, 1.0) * 2, 30.0)
+                # Requests finding the snapshot behind do not cut a backoff short
+                wait = self._stop.wait
+            wait(backoff)
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._snapshot
+        result: Dict[str, Any] = {**self._stats, 'enabled': self.enabled, 'ready': snap is not None}
+        if snap is not None:
+            result.update({
+                'purchases': snap.rows,
+                'items': snap.items,
+                'customers': int(snap.customer_purchases.size),
+                'products': len(snap.product_names),
+                'last_id': snap.last_id,
+                'matches_rollups': snap.matches_rollups,
+                'real_id_cache': len(self._real_id_cache),
+                'mapped_bytes': sum(int(column.nbytes) for column in snap.columns.values())
+            })
+        return result
+
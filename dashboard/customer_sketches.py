@@ -0,0 +1,42 @@
+"""
+HyperLogLog estimates from the per-store, per-day customer sketches.
+
+The purchases insert trigger in db/init.sql (section 10) keeps one sketch of
+4096 one-byte registers per supermarket per UTC day. Any combination of stores
+and days is answered by merging their sketches (the per-register maximum) and
+applying the HyperLogLog estimator with the small-range correction.
+
+Error bound: the relative standard error is 1.04 / sqrt(4096) = 1.625%, so an
+estimate is within +/-3.25% of the true distinct count about 95% of the time
+and within +/-4.9% about 99.7% of the time. Below roughly 10,000 customers the
+linear-counting correction applies and the error is usually much smaller.
+"""
+import math
+from typing import Iterable
+
+import numpy as np
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def merge_sketches(sketches: Iterable[bytes]) -> np.ndarray:
+    """Union of sketches: the per-register maximum"""
+    merged = np.zeros(REGISTERS, dtype=np.uint8)
+    for sketch in sketches:
+        np.maximum(merged, np.frombuffer(sketch, dtype=np.uint8), out=merged)
+    return merged
+
+
+def estimate_distinct(registers: np.ndarray) -> int:
+    """HyperLogLog cardinality estimate of merged registers"""
+    zeros = int(np.count_nonzero(registers == 0))
+    if zeros == REGISTERS:
+        return 0
+    raw = _ALPHA * REGISTERS * REGISTERS / float(np.sum(np.ldexp(1.0, -registers.astype(np.int32))))
+    # Linear counting is more accurate while many registers are still empty
+    if raw <= 2.5 * REGISTERS and zeros:
+        return round(REGISTERS * math.log(REGISTERS / zeros))
+    return round(raw)
@@ -0,0 +1,196 @@
+"""
+Server-sent events for the live dashboard.
+
+A background thread LISTENs for the ``purchases_changed`` NOTIFY sent by the
+purchases trigger in db/init.sql. After a change it recomputes each dashboard
+metric once (through the result cache) and pushes only the metrics whose
+content changed to every connected browser. Bursts of purchases are debounced
+to at most one refresh per ``min_interval`` seconds, and a slow client only
+ever holds the latest version of each metric. LISTEN needs the primary; when
+dashboard reads go to a replica, a refresh first waits for the replica to
+replay the notified purchases.
+"""
+import asyncio
+import os
+import select
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+from result_cache import ResultCache
+from shared.db_config import get_db_config, reads_from_replica, wait_for_replica_replay
+
+PURCHASES_CHANNEL = "purchases_changed"
+
+
+def get_live_updates_config() -> Dict[str, Any]:
+    """Get live dashboard settings from environment variables"""
+    return {
+        'listen': os.getenv("DASHBOARD_LIVE_LISTEN", "true").lower() in ("1", "true", "yes"),
+        'min_interval': float(os.getenv("DASHBOARD_LIVE_MIN_INTERVAL", "1")),
+        'keepalive': float(os.getenv("DASHBOARD_LIVE_KEEPALIVE", "15"))
+    }
+
+
+class _Subscriber:
+    """One connected browser; holds the newest undelivered frame per metric"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.pending: Dict[str, bytes] = {}
+        self.wake = asyncio.Event()
+
+    def push(self, name: str, frame: bytes) -> None:
+        # Runs on the subscriber's event loop; a newer frame replaces an undelivered one
+        self.pending[name] = frame
+        self.wake.set()
+
+
+class LiveUpdates:
+    """Computes dashboard metrics once per purchase change and fans them out over SSE"""
+
+    def __init__(self, cache: ResultCache, metrics: List[Tuple[str, float, Callable[[], Any]]],
+                 listen: bool = True, min_interval: float = 1.0, keepalive: float = 15.0):
+        self.cache = cache
+        self.metrics = metrics
+        self.listen = listen
+        self.min_interval = min_interval
+        self.keepalive = keepalive
+        self._latest: Dict[str, Tuple[str, bytes]] = {}
+        self._subscribers: List[_Subscriber] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+        self._stats = {'notifications': 0, 'refreshes': 0, 'events_sent': 0, 'refresh_errors': 0}
+
+    # ----- Metric computation -----
+    def refresh(self) -> None:
+        """Recompute every metric and broadcast the ones whose content changed"""
+        self._stats['refreshes'] += 1
+        for name, ttl, compute in self.metrics:
+            try:
+                result = self.cache.get_or_compute(ResultCache.key(name), ttl, compute)
+            except Exception as e:
+                self._stats['refresh_errors'] += 1
+                print(f"⚠️ Live dashboard could not refresh {name}: {e}")
+                continue
+
+            with self._lock:
+                previous = self._latest.get(name)
+                if previous is not None and previous[0] == result.etag:
+                    continue
+                frame = self._frame(name, result.high_water_mark, result.body)
+                self._latest[name] = (result.etag, frame)
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, name, frame)
+                self._stats['events_sent'] += 1
+
+    @staticmethod
+    def _frame(name: str, hwm: int, body: bytes) -> bytes:
+        # Compact JSON never contains raw newlines, so the body fits in one data line
+        return b"event: " + name.encode() + b"\nid: " + str(hwm).encode() + b"\ndata: " + body + b"\n\n"
+
+    # ----- Subscribers -----
+    async def stream(self) -> AsyncIterator[bytes]:
+        """Yield SSE frames for one client: the current metrics, then every change"""
+        subscriber = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            for name, (_, frame) in self._latest.items():
+                subscriber.pending[name] = frame
+            self._subscribers.append(subscriber)
+        if subscriber.pending:
+            subscriber.wake.set()
+
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.wake.wait(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield b": keepalive\n\n"
+                    continue
+                subscriber.wake.clear()
+                frames, subscriber.pending = list(subscriber.pending.values()), {}
+                yield b"".join(frames)
+        finally:
+            with self._lock:
+                self._subscribers.remove(subscriber)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            clients = len(self._subscribers)
+        return {
+            **self._stats,
+            'clients': clients,
+            'listening': self._listener is not None and self._listener.is_alive()
+        }
+
+    # ----- LISTEN/NOTIFY -----
+    def start(self) -> None:
+        """Start the background listener that refreshes metrics on purchase NOTIFYs"""
+        if not self.listen or self._listener is not None:
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen_loop, name="live-dashboard", daemon=True)
+        self._listener.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+    def _listen_loop(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**get_db_config())
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {PURCHASES_CHANNEL};")
+                cur.close()
+                # Purchases made while we were not listening would otherwise be missed
+                self.refresh()
+                last_refresh = time.monotonic()
+                changed = False
+                replay_lsn: Optional[str] = None
+                backoff = 1.0
+
+                while not self._stop.is_set():
+                    wait = self.min_interval - (time.monotonic() - last_refresh) if changed else 1.0
+                    if select.select([conn], [], [], max(wait, 0)) != ([], [], []):
+                        conn.poll()
+                        if conn.notifies:
+                            self._stats['notifications'] += len(conn.notifies)
+                            hwm = max(int(n.payload) for n in conn.notifies)
+                            conn.notifies.clear()
+                            # The payload already tells the cache its entries are stale
+                            self.cache.advance_high_water_mark(hwm)
+                            changed = True
+                            if reads_from_replica():
+                                cur = conn.cursor()
+                                cur.execute("SELECT pg_current_wal_lsn()::text;")
+                                replay_lsn = cur.fetchone()[0]
+                                cur.close()
+
+                    if changed and time.monotonic() - last_refresh >= self.min_interval:
+                        if replay_lsn is not None:
+                            # Otherwise the replica's pre-purchase results would be cached as current
+                            wait_for_replica_replay(replay_lsn)
+                            replay_lsn = None
+                        self.refresh()
+                        last_refresh = time.monotonic()
+                        changed = False
+            except psycopg2.Error as e:
+                print(f"⚠️ Live dashboard listener error, reconnecting in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    conn.close()
@@ -1,11 +1,27 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 import psycopg2
-from typing import Dict, Any, List
-from shared.db_config import validate_env_vars, get_db_config, get_db_connection
+import base64
+import csv
+import io
+import json
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Any, List, Iterator, Optional, Tuple
+from shared.db_config import validate_env_vars, init_db_pool, close_db_pool, get_db_pool
+from shared.json_response import FastJSONResponse, dumps
+from shared.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, render_metrics
+from result_cache import ResultCache, endpoint_ttl, get_result_cache_config
+from live_updates import LiveUpdates, get_live_updates_config
+from customer_sketches import STANDARD_ERROR, estimate_distinct, merge_sketches
+from columnar_analytics import ColumnarAnalytics, get_columnar_analytics_config
 
-app = FastAPI(title="Supermarket Analytics Dashboard", version="1.0.0")
+app = FastAPI(title="Supermarket Analytics Dashboard", version="1.0.0", default_response_class=FastJSONResponse)
+# /stream responses last as long as the browser tab, so they are not timed
+app.add_middleware(MetricsMiddleware, exclude=("/metrics", "/stream"))
 
 # Initialize templates
 templates = Jinja2Templates(directory="templates")
@@ -13,14 +29,57 @@ templates = Jinja2Templates(directory="templates")
 # Validate environment variables on startup
 validate_env_vars()
 
-DB_CONFIG = get_db_config()
 
-def get_dashboard_db_connection() -> psycopg2.extensions.connection:
-    """Get database connection with dashboard-specific error handling"""
+@app.on_event("startup")
+def startup() -> None:
+    # Read-only service: served by the read replica when POSTGRES_READ_DSN is set
+    init_db_pool("dashboard", prefer_replica=True)
+    columnar.start()
+    live_updates.start()
+
+
+@app.on_event("shutdown")
+def shutdown() -> None:
+    live_updates.stop()
+    columnar.stop()
+    close_db_pool()
+
+
+@contextmanager
+def dashboard_db_connection() -> Iterator[psycopg2.extensions.connection]:
+    """Borrow a pooled database connection with dashboard-specific error handling"""
+    pool = get_db_pool()
     try:
-        return get_db_connection()
+        conn = pool.getconn()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def purchases_high_water_mark() -> int:
+    """Highest purchase id; any new purchase moves it and invalidates cached results"""
+    with dashboard_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM purchases;")
+        hwm: int = cur.fetchone()[0]
+        cur.close()
+    return hwm
+
+
+# ----- Result cache -----
+result_cache = ResultCache(purchases_high_water_mark, **get_result_cache_config())
+UNIQUE_CUSTOMERS_TTL = endpoint_ttl("unique-customers", 10)
+LOYAL_CUSTOMERS_TTL = endpoint_ttl("loyal-customers", 30)
+TOP_PRODUCTS_TTL = endpoint_ttl("top-products", 30)
+SALES_TIMESERIES_TTL = endpoint_ttl("sales-timeseries", 60)
+BASKET_RULES_TTL = endpoint_ttl("basket-rules", 300)
+
+# ----- Columnar analytics -----
+# Optional NumPy copy of purchases; its queries return None when SQL must answer instead
+columnar = ColumnarAnalytics(result_cache.current_high_water_mark, **get_columnar_analytics_config())
 
 @app.get("/", response_class=HTMLResponse)
 def dashboard_ui(request: Request):
@@ -34,31 +93,86 @@ def read_root() -> Dict[str, str]:
     """Dashboard API info endpoint"""
     return {"message": "Supermarket Analytics Dashboard API", "version": "1.0.0"}
 
+@app.get("/metrics")
+def prometheus_metrics() -> Response:
+    """Prometheus metrics: request latency and SQL work per route, pool wait and slow queries"""
+    return Response(content=render_metrics(get_db_pool().stats()), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/health")
-def health_check() -> Dict[str, str]:
-    """Health check endpoint"""
+def health_check() -> Dict[str, Any]:
+    """Health check endpoint including connection pool statistics"""
     try:
-        conn = get_dashboard_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        cur.close()
-        conn.close()
-        return {"status": "healthy", "database": "connected"}
+        with dashboard_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+        return {
+            "status": "healthy",
+            "database": "connected",
+            "pool": get_db_pool().stats(),
+            "result_cache": result_cache.stats(),
+            "live_updates": live_updates.stats(),
+            "columnar": columnar.stats()
+        }
     except Exception as e:
         return {"status": "unhealthy", "error": str(e)}
 
+# ----- Unique customers -----
+# Store/day filters merge the HyperLogLog sketches kept by the purchases insert
+# trigger (db/init.sql, section 10); exact=true counts purchases instead, for audits
+CUSTOMER_SKETCHES_QUERY = "SELECT registers FROM customer_day_sketches WHERE {conditions}"
+EXACT_UNIQUE_CUSTOMERS_QUERY = "SELECT COUNT(DISTINCT user_id) FROM purchases WHERE {conditions}"
+
+
+def unique_customers_conditions(supermarket_ids: Optional[List[str]], start: Optional[date],
+                                end: Optional[date], exact: bool) -> Tuple[str, Dict[str, Any]]:
+    """WHERE clause for the sketches (by day) or, in exact mode, the purchases (by timestamp)"""
+    conditions: List[str] = ["TRUE"]
+    params: Dict[str, Any] = {}
+    period_column = "timestamp" if exact else "day"
+    if supermarket_ids:
+        conditions.append("supermarket_id = ANY(%(supermarket_ids)s)")
+        params['supermarket_ids'] = supermarket_ids
+    if start is not None:
+        conditions.append(f"{period_column} >= %(start)s")
+        params['start'] = start
+    if end is not None:
+        conditions.append(f"{period_column} < %(end)s")
+        params['end'] = end
+    return " AND ".join(conditions), params
+
+
 @app.get("/unique-customers")
-def get_unique_customers() -> Dict[str, Any]:
-    """Get total count of unique customers in the chain"""
+def get_unique_customers(
+    request: Request,
+    start: Optional[date] = Query(None, description="First day included (UTC)"),
+    end: Optional[date] = Query(None, description="End of the range, exclusive (UTC)"),
+    supermarket_id: Optional[List[str]] = Query(None, description="Only these supermarkets (repeatable)"),
+    exact: bool = Query(False, description="Count purchases exactly instead of merging sketches")
+) -> Response:
+    """Get the count of unique customers in the chain, optionally for some stores and days"""
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be earlier than end")
+
+    if supermarket_id or start is not None or end is not None or exact:
+        compute = lambda: compute_unique_customers_in_range(supermarket_id, start, end, exact)
+    else:
+        compute = compute_unique_customers
+    return result_cache.respond(request, "unique-customers", UNIQUE_CUSTOMERS_TTL, compute)
+
+def compute_unique_customers() -> Dict[str, Any]:
+    """Count customers with at least one purchase"""
     try:
-        conn = get_dashboard_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute("SELECT COUNT(DISTINCT user_id) FROM purchases;")
-        count: int = cur.fetchone()[0]
-        
-        cur.close()
-        conn.close()
+        count: Optional[int] = columnar.unique_customers_total()
+        if count is None:
+            with dashboard_db_connection() as conn:
+                cur = conn.cursor()
+                # Maintained by the purchases rollup triggers (db/init.sql, section 7)
+                cur.execute("SELECT value FROM analytics_counters WHERE name = 'distinct_customers';")
+                row = cur.fetchone()
+                count = row[0] if row else 0
+                cur.close()
         
         return {
             "unique_customers": count,
@@ -67,28 +181,130 @@ def get_unique_customers() -> Dict[str, Any]:
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def compute_unique_customers_in_range(supermarket_ids: Optional[List[str]], start: Optional[date],
+                                      end: Optional[date], exact: bool) -> Dict[str, Any]:
+    """Distinct customers for a store/day selection, estimated from sketches or counted exactly"""
+    try:
+        # Sketch estimates stay in SQL; an exact count is the same on either path
+        count: Optional[int] = columnar.unique_customers(supermarket_ids, start, end) if exact else None
+        sketches: Optional[int] = None
+        if count is None:
+            conditions, params = unique_customers_conditions(supermarket_ids, start, end, exact)
+            with dashboard_db_connection() as conn:
+                cur = conn.cursor()
+                if exact:
+                    cur.execute(EXACT_UNIQUE_CUSTOMERS_QUERY.format(conditions=conditions), params)
+                    count = cur.fetchone()[0]
+                else:
+                    cur.execute(CUSTOMER_SKETCHES_QUERY.format(conditions=conditions), params)
+                    sketches = cur.rowcount
+                    count = estimate_distinct(merge_sketches(row[0] for row in cur))
+                cur.close()
+        
+        scope = f" at {', '.join(supermarket_ids)}" if supermarket_ids else " in the chain"
+        period = f" from {start.isoformat() if start else 'the beginning'} to {end.isoformat() if end else 'today'}"
+        result: Dict[str, Any] = {
+            "unique_customers": count,
+            "description": f"Unique customers who made purchases{scope}{period}",
+            "method": "exact" if exact else "hyperloglog"
+        }
+        if not exact:
+            result["sketches_merged"] = sketches
+            result["standard_error"] = round(STANDARD_ERROR, 5)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ----- Loyal customers -----
+LOYAL_DEFAULT_MIN_PURCHASES = 3
+LOYAL_DEFAULT_PAGE_SIZE = 100
+LOYAL_MAX_PAGE_SIZE = 1000
+LOYAL_EXPORT_BATCH_ROWS = 10000
+
+# Order and keyset match customer_purchase_rollup_keyset_idx, so every page is an
+# index range scan starting right after the previous page's last row
+LOYAL_CUSTOMERS_QUERY = """
+SELECT 
+    c.real_id,
+    c.uuid,
+    r.purchase_count,
+    r.total_spent
+FROM customer_purchase_rollup r
+JOIN customers c ON c.uuid = r.user_id
+WHERE r.purchase_count >= %(min_purchases)s
+{after}
+ORDER BY r.purchase_count DESC, r.total_spent DESC, r.user_id DESC
+{limit};
+"""
+LOYAL_CUSTOMERS_AFTER = "AND (r.purchase_count, r.total_spent, r.user_id) < (%(purchase_count)s, %(total_spent)s, %(user_id)s)"
+LOYAL_CUSTOMERS_COUNT_QUERY = "SELECT COUNT(*) FROM customer_purchase_rollup WHERE purchase_count >= %(min_purchases)s;"
+
+
+def encode_loyal_cursor(purchase_count: int, total_spent: Decimal, user_id: Any) -> str:
+    """Opaque page cursor holding the sort key of the last row returned"""
+    raw = json.dumps([purchase_count, str(total_spent), str(user_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_loyal_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        purchase_count, total_spent, user_id = json.loads(raw)
+        return {
+            'purchase_count': int(purchase_count),
+            'total_spent': Decimal(total_spent),
+            'user_id': str(uuid.UUID(user_id))
+        }
+    except (ValueError, TypeError, ArithmeticError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/loyal-customers")
-def get_loyal_customers() -> Dict[str, Any]:
-    """Get list of loyal customers (customers with at least 3 purchases)"""
+def get_loyal_customers(
+    request: Request,
+    min_purchases: int = Query(LOYAL_DEFAULT_MIN_PURCHASES, ge=1, description="Minimum number of purchases"),
+    limit: int = Query(LOYAL_DEFAULT_PAGE_SIZE, ge=1, le=LOYAL_MAX_PAGE_SIZE, description="Customers per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+) -> Response:
+    """Get one page of loyal customers (customers with at least min_purchases purchases)"""
+    after = decode_loyal_cursor(cursor) if cursor else None
+    return result_cache.respond(request, "loyal-customers", LOYAL_CUSTOMERS_TTL,
+                                lambda: compute_loyal_customers(min_purchases, limit, after))
+
+def compute_loyal_customers(min_purchases: int = LOYAL_DEFAULT_MIN_PURCHASES,
+                            limit: int = LOYAL_DEFAULT_PAGE_SIZE,
+                            after: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """List one page of customers with at least min_purchases purchases, most frequent first"""
     try:
-        conn = get_dashboard_db_connection()
-        cur = conn.cursor()
+        params: Dict[str, Any] = {'min_purchases': min_purchases, 'limit': limit + 1, **(after or {})}
+        query = LOYAL_CUSTOMERS_QUERY.format(
+            after=LOYAL_CUSTOMERS_AFTER if after else "",
+            limit="LIMIT %(limit)s"
+        )
+        # One extra row tells us whether another page exists
+        total: Optional[int] = None
+        page = columnar.loyal_customers(min_purchases, limit + 1, after)
+        if page is not None:
+            results, total = page
+        else:
+            with dashboard_db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(query, params)
+                results = cur.fetchall()
+        
+                # The total is only counted for the first page; later pages just continue it
+                if after is None:
+                    cur.execute(LOYAL_CUSTOMERS_COUNT_QUERY, params)
+                    total = cur.fetchone()[0]
         
-        query = """
-        SELECT 
-            c.real_id,
-            c.uuid,
-            COUNT(p.id) as purchase_count,
-            SUM(p.total_amount) as total_spent
-        FROM customers c
-        JOIN purchases p ON c.uuid = p.user_id
-        GROUP BY c.real_id, c.uuid
-        HAVING COUNT(p.id) >= 3
-        ORDER BY purchase_count DESC, total_spent DESC;
-        """
+                cur.close()
         
-        cur.execute(query)
-        results = cur.fetchall()
+        next_cursor: Optional[str] = None
+        if len(results) > limit:
+            results = results[:limit]
+            last = results[-1]
+            next_cursor = encode_loyal_cursor(last[2], last[3], last[1])
         
         loyal_customers: List[Dict[str, Any]] = []
         for row in results:
@@ -99,79 +315,349 @@ def get_loyal_customers() -> Dict[str, Any]:
                 "total_spent": float(row[3])
             })
         
-        cur.close()
-        conn.close()
-        
         return {
             "loyal_customers": loyal_customers,
-            "criteria": "Customers with 3+ purchases",
-            "count": len(loyal_customers)
+            "criteria": f"Customers with {min_purchases}+ purchases",
+            "count": len(loyal_customers),
+            "total": total,
+            "next_cursor": next_cursor
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/loyal-customers/export")
+def export_loyal_customers(
+    min_purchases: int = Query(LOYAL_DEFAULT_MIN_PURCHASES, ge=1, description="Minimum number of purchases"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="ndjson or csv")
+) -> StreamingResponse:
+    """Stream every loyal customer as NDJSON or CSV with flat memory use"""
+    pool = get_db_pool()
+    try:
+        conn = pool.getconn()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"loyal_customers_{min_purchases}.{format}"
+    return StreamingResponse(
+        stream_loyal_customers(conn, min_purchases, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def stream_loyal_customers(conn: psycopg2.extensions.connection, min_purchases: int,
+                           format: str) -> Iterator[bytes]:
+    """Yield export chunks from a server-side cursor, then return the connection to the pool"""
+    try:
+        # A named cursor keeps the result set in the database; only one batch
+        # of rows is held in memory at a time
+        cur = conn.cursor(name="loyal_customers_export")
+        cur.itersize = LOYAL_EXPORT_BATCH_ROWS
+        cur.execute(LOYAL_CUSTOMERS_QUERY.format(after="", limit=""), {'min_purchases': min_purchases})
+
+        if format == "csv":
+            yield b"customer_id,customer_uuid,purchase_count,total_spent\n"
+        while True:
+            rows = cur.fetchmany(LOYAL_EXPORT_BATCH_ROWS)
+            if not rows:
+                break
+            if format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer, lineterminator="\n").writerows(rows)
+                yield buffer.getvalue().encode("utf-8")
+            else:
+                yield b"".join(
+                    dumps({
+                        "customer_id": row[0],
+                        "customer_uuid": str(row[1]),
+                        "purchase_count": row[2],
+                        "total_spent": float(row[3])
+                    }) + b"\n"
+                    for row in rows
+                )
+        cur.close()
+    finally:
+        get_db_pool().putconn(conn)
+
+# Ranks products by units sold and keeps every product whose count is among the
+# N highest distinct counts, so ties never push a product out of the list
+TOP_PRODUCTS_QUERY = """
+WITH product_sales AS (
+    {source}
+), ranked AS (
+    SELECT
+        product_name,
+        sales_count,
+        DENSE_RANK() OVER (ORDER BY sales_count DESC) as sales_rank
+    FROM product_sales
+)
+SELECT product_name, sales_count, sales_rank
+FROM ranked
+WHERE sales_rank <= %(n)s
+ORDER BY sales_count DESC, product_name ASC;
+"""
+
+# All-time counts are maintained by the purchases rollup triggers
+ROLLUP_PRODUCT_SALES = "SELECT product_name, sales_count FROM product_sales_rollup"
+
+# Filtered counts aggregate the matching purchases once; partition pruning and the
+# (supermarket_id, timestamp) and (timestamp) indexes restrict the scan to the requested
+# store and months
+FILTERED_PRODUCT_SALES = """SELECT item as product_name, COUNT(*) as sales_count
+    FROM purchases, unnest(item_list) as item
+    WHERE {conditions}
+    GROUP BY item"""
+
+
+def top_products_query(supermarket_id: Optional[str], start: Optional[datetime],
+                       end: Optional[datetime]) -> Tuple[str, Dict[str, Any]]:
+    """Build the single-pass top products query for the requested filters"""
+    conditions: List[str] = []
+    params: Dict[str, Any] = {}
+    if supermarket_id is not None:
+        conditions.append("supermarket_id = %(supermarket_id)s")
+        params['supermarket_id'] = supermarket_id
+    if start is not None:
+        conditions.append("timestamp >= %(start)s")
+        params['start'] = start
+    if end is not None:
+        conditions.append("timestamp < %(end)s")
+        params['end'] = end
+
+    if conditions:
+        source = FILTERED_PRODUCT_SALES.format(conditions=" AND ".join(conditions))
+    else:
+        source = ROLLUP_PRODUCT_SALES
+    return TOP_PRODUCTS_QUERY.format(source=source), params
+
+
+def describe_top_products(n: int, supermarket_id: Optional[str], start: Optional[datetime],
+                          end: Optional[datetime]) -> str:
+    scope = f" at {supermarket_id}" if supermarket_id else " in the chain"
+    if start and end:
+        period = f"from {start.isoformat()} to {end.isoformat()}"
+    elif start:
+        period = f"since {start.isoformat()}"
+    elif end:
+        period = f"before {end.isoformat()}"
+    else:
+        period = "of all time"
+    return f"Top {n} best-selling products{scope} {period} (including ties in popularity)"
+
+
 @app.get("/top-products")
-def get_top_products() -> Dict[str, Any]:
-    """Get top 3 best-selling products of all time (including ties)"""
+def get_top_products(
+    request: Request,
+    n: int = Query(3, ge=1, le=100, description="Number of distinct sales counts to include"),
+    start: Optional[datetime] = Query(None, description="Only purchases at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only purchases before this time"),
+    supermarket_id: Optional[str] = Query(None, description="Only purchases at this supermarket")
+) -> Response:
+    """Get the top N best-selling products (including ties), optionally for one store and period"""
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be earlier than end")
+
+    return result_cache.respond(request, "top-products", TOP_PRODUCTS_TTL,
+                                lambda: compute_top_products(n, supermarket_id, start, end))
+
+
+def compute_top_products(n: int, supermarket_id: Optional[str], start: Optional[datetime],
+                         end: Optional[datetime]) -> Dict[str, Any]:
+    """Rank products by units sold for the requested store and period"""
     try:
-        conn = get_dashboard_db_connection()
-        cur = conn.cursor()
+        results = columnar.top_products(n, supermarket_id, start, end)
+        if results is None:
+            query, params = top_products_query(supermarket_id, start, end)
+            params['n'] = n
+            with dashboard_db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(query, params)
+                results = cur.fetchall()
+                cur.close()
+        
+        top_products: List[Dict[str, Any]] = []
+        for row in results:
+            top_products.append({
+                "product_name": row[0],
+                "sales_count": row[1],
+                "rank": row[2]
+            })
         
-        # First, get the top 3 unique sales counts
-        count_query = """
-        WITH product_sales AS (
-            SELECT 
-                unnest(item_list) as product_name,
-                COUNT(*) as sales_count
-            FROM purchases 
-            GROUP BY unnest(item_list)
+        return {
+            "top_products": top_products,
+            "description": describe_top_products(n, supermarket_id, start, end),
+            "count": len(top_products)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ----- Sales time series -----
+SALES_INTERVALS = ("hour", "day", "week")
+
+# Reads only the hourly buckets (a year is 8,760 rows per store), re-bucketing
+# them to the requested interval; averages are computed from the summed totals
+SALES_TIMESERIES_QUERY = """
+SELECT
+    {store_column} as supermarket_id,
+    date_trunc(%(interval)s, bucket) as period,
+    SUM(basket_count) as basket_count,
+    SUM(item_count) as item_count,
+    SUM(revenue) as revenue
+FROM sales_hourly_rollup
+WHERE bucket >= date_trunc('hour', %(start)s::timestamp)
+  AND bucket < date_trunc('hour', %(end)s::timestamp)
+  {store_filter}
+GROUP BY 1, 2
+ORDER BY 1, 2;
+"""
+
+
+@app.get("/sales/timeseries")
+def get_sales_timeseries(
+    request: Request,
+    start: datetime = Query(..., description="First hour included (UTC, rounded down to the hour)"),
+    end: datetime = Query(..., description="End of the range, exclusive (UTC, rounded down to the hour)"),
+    interval: str = Query("day", pattern="^(hour|day|week)$", description="Bucket size: hour, day or week"),
+    supermarket_id: Optional[str] = Query(None, description="Only this supermarket"),
+    by_supermarket: bool = Query(False, description="One series per supermarket instead of chain totals")
+) -> Response:
+    """Get revenue, basket count and average basket per hour/day/week over a date range"""
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be earlier than end")
+
+    return result_cache.respond(request, "sales-timeseries", SALES_TIMESERIES_TTL,
+                                lambda: compute_sales_timeseries(start, end, interval, supermarket_id, by_supermarket))
+
+def compute_sales_timeseries(start: datetime, end: datetime, interval: str, supermarket_id: Optional[str],
+                             by_supermarket: bool) -> Dict[str, Any]:
+    """Sum hourly sales buckets into one series for the chain, a store, or each store"""
+    try:
+        per_store = by_supermarket or supermarket_id is not None
+        query = SALES_TIMESERIES_QUERY.format(
+            store_column="supermarket_id" if per_store else "NULL::varchar",
+            store_filter="AND supermarket_id = %(supermarket_id)s" if supermarket_id is not None else ""
         )
-        SELECT DISTINCT sales_count
-        FROM product_sales
-        ORDER BY sales_count DESC
-        LIMIT 3;
-        """
+        params = {'interval': interval, 'start': start, 'end': end, 'supermarket_id': supermarket_id}
+        with dashboard_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            results = cur.fetchall()
+            cur.close()
         
-        cur.execute(count_query)
-        top_counts: List[int] = [row[0] for row in cur.fetchall()]
+        series: List[Dict[str, Any]] = []
+        for row in results:
+            basket_count = int(row[2])
+            series.append({
+                "supermarket_id": row[0],
+                "period_start": row[1].isoformat(),
+                "revenue": float(row[4]),
+                "basket_count": basket_count,
+                "avg_basket_value": round(float(row[4]) / basket_count, 2),
+                "avg_basket_items": round(int(row[3]) / basket_count, 2)
+            })
         
-        # Now get all products that have sales counts in the top 3
-        if top_counts:
-            products_query = """
-            WITH product_sales AS (
-                SELECT 
-                    unnest(item_list) as product_name,
-                    COUNT(*) as sales_count
-                FROM purchases 
-                GROUP BY unnest(item_list)
-            )
-            SELECT 
-                product_name,
-                sales_count
-            FROM product_sales
-            WHERE sales_count = ANY(%s)
-            ORDER BY sales_count DESC, product_name ASC;
-            """
-            
-            cur.execute(products_query, (top_counts,))
+        return {
+            "series": series,
+            "interval": interval,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "supermarket_id": supermarket_id,
+            "count": len(series)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ----- Market-basket rules -----
+# Rules are rebuilt by the basket_analysis job; this only filters and orders them
+BASKET_RULES_QUERY = """
+SELECT antecedent, consequent, itemset_size, basket_count, support, confidence, lift
+FROM basket_rules
+WHERE confidence >= %(min_confidence)s
+  AND lift >= %(min_lift)s
+  {filters}
+ORDER BY lift DESC, confidence DESC, antecedent, consequent
+LIMIT %(limit)s;
+"""
+BASKET_STATE_QUERY = "SELECT basket_count, last_purchase_id, min_support, rules_updated_at FROM basket_analysis_state WHERE id = 1;"
+
+
+@app.get("/basket-rules")
+def get_basket_rules(
+    request: Request,
+    product: Optional[str] = Query(None, description="Only rules that mention this product"),
+    size: Optional[int] = Query(None, ge=2, le=3, description="Only rules from pairs (2) or triples (3)"),
+    min_confidence: float = Query(0.0, ge=0, le=1, description="Minimum P(consequent | antecedent)"),
+    min_lift: float = Query(0.0, ge=0, description="Minimum lift (> 1 means bought together more than by chance)"),
+    limit: int = Query(50, ge=1, le=1000, description="Maximum number of rules")
+) -> Response:
+    """Get frequently-bought-together rules with support, confidence and lift"""
+    return result_cache.respond(request, "basket-rules", BASKET_RULES_TTL,
+                                lambda: compute_basket_rules(product, size, min_confidence, min_lift, limit))
+
+def compute_basket_rules(product: Optional[str], size: Optional[int], min_confidence: float,
+                         min_lift: float, limit: int) -> Dict[str, Any]:
+    """Read the strongest association rules matching the filters"""
+    try:
+        filters: List[str] = []
+        if product is not None:
+            filters.append("AND (%(product)s = ANY(antecedent) OR consequent = %(product)s)")
+        if size is not None:
+            filters.append("AND itemset_size = %(size)s")
+        params = {
+            'product': product, 'size': size, 'min_confidence': min_confidence,
+            'min_lift': min_lift, 'limit': limit
+        }
+        with dashboard_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(BASKET_RULES_QUERY.format(filters="\n  ".join(filters)), params)
             results = cur.fetchall()
-            
-            top_products: List[Dict[str, Any]] = []
-            for row in results:
-                top_products.append({
-                    "product_name": row[0],
-                    "sales_count": row[1]
-                })
-        else:
-            top_products: List[Dict[str, Any]] = []
+            cur.execute(BASKET_STATE_QUERY)
+            basket_count, last_purchase_id, min_support, rules_updated_at = cur.fetchone()
+            cur.close()
         
-        cur.close()
-        conn.close()
+        rules: List[Dict[str, Any]] = []
+        for row in results:
+            rules.append({
+                "antecedent": row[0],
+                "consequent": row[1],
+                "itemset_size": row[2],
+                "basket_count": row[3],
+                "support": round(row[4], 6),
+                "confidence": round(row[5], 6),
+                "lift": round(row[6], 6)
+            })
         
         return {
-            "top_products": top_products,
-            "description": "Top 3 best-selling products of all time (including ties in popularity)",
-            "count": len(top_products)
+            "rules": rules,
+            "count": len(rules),
+            "baskets_analyzed": basket_count,
+            "last_purchase_id": last_purchase_id,
+            "min_support": min_support,
+            "rules_updated_at": rules_updated_at.isoformat() if rules_updated_at else None
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ----- Live updates -----
+live_updates = LiveUpdates(result_cache, [
+    ("unique-customers", UNIQUE_CUSTOMERS_TTL, compute_unique_customers),
+    ("loyal-customers", LOYAL_CUSTOMERS_TTL, compute_loyal_customers),
+    ("top-products", TOP_PRODUCTS_TTL, lambda: compute_top_products(3, None, None, None))
+], **get_live_updates_config())
+
+
+@app.get("/stream")
+def stream_dashboard() -> StreamingResponse:
+    """Server-sent events: current dashboard metrics, then each metric again whenever it changes"""
+    if not live_updates.listen:
+        raise HTTPException(status_code=503, detail="Live updates are disabled")
+    return StreamingResponse(
+        live_updates.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
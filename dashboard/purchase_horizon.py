@@ -0,0 +1,53 @@
+"""
+The purchases id horizon shared by the dashboard's incremental readers.
+
+basket_analysis and columnar_analytics both read new purchases in id order and
+remember the last id they have seen. Ids are drawn from the sequence before the
+inserting transaction commits, so a reader must not move past an id that a
+slower transaction could still commit below.
+"""
+import time
+
+import psycopg2
+
+IN_FLIGHT_TIMEOUT = 60.0
+
+# Every purchase id handed out so far (read on the primary: a replica's copy runs ahead)
+ISSUED_IDS_SQL = "SELECT COALESCE(pg_sequence_last_value(pg_get_serial_sequence('purchases', 'id')::regclass), 0);"
+# Transactions that are inserting into (or otherwise writing) purchases
+PURCHASE_WRITERS_SQL = """
+SELECT COALESCE(array_agg(DISTINCT virtualtransaction), '{}') FROM pg_locks
+WHERE locktype = 'relation' AND relation = 'purchases'::regclass
+  AND mode = 'RowExclusiveLock' AND pid <> pg_backend_pid();
+"""
+RUNNING_SQL = "SELECT count(DISTINCT virtualtransaction) FROM pg_locks WHERE virtualtransaction = ANY(%s);"
+
+
+def wait_for_in_flight_purchases(conn: psycopg2.extensions.connection, timeout: float = IN_FLIGHT_TIMEOUT) -> int:
+    """Highest purchase id below which no insert can still be uncommitted.
+
+    Ids are assigned before commit, so a slow transaction may still commit a
+    lower id than one already visible. An insert draws its id from the sequence
+    while holding ROW EXCLUSIVE on purchases, possibly before it has an xid. So we
+    read the last id issued, then wait until every transaction holding that lock
+    at that moment has ended. Readers are not waited for.
+    """
+    cur = conn.cursor()
+    cur.execute(ISSUED_IDS_SQL)
+    horizon = cur.fetchone()[0]
+    cur.execute(PURCHASE_WRITERS_SQL)
+    writers = cur.fetchone()[0]
+    conn.commit()
+
+    deadline = time.monotonic() + timeout
+    while writers:
+        cur.execute(RUNNING_SQL, (writers,))
+        running = cur.fetchone()[0]
+        conn.commit()
+        if not running:
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{running} transactions writing purchases are still running after {timeout:.0f}s")
+        time.sleep(0.1)
+    cur.close()
+    return horizon
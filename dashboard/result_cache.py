@@ -0,0 +1,173 @@
+"""
+Result cache for the dashboard's aggregate endpoints.
+
+Every open dashboard tab polls the same few endpoints, so their rendered JSON is
+cached per endpoint and query string. An entry is served until its endpoint's TTL
+expires or the purchases high-water mark (max ``purchases.id``) moves past the
+value it was computed at. Concurrent misses for one key wait for a single
+computation, and responses carry an ETag so unchanged results revalidate with 304.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from shared.json_response import dumps
+
+
+def get_result_cache_config() -> Dict[str, Any]:
+    """Get dashboard result cache settings from environment variables"""
+    return {
+        'max_entries': int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "256")),
+        'hwm_interval': float(os.getenv("DASHBOARD_CACHE_HWM_INTERVAL", "1"))
+    }
+
+
+def endpoint_ttl(name: str, default: float) -> float:
+    """TTL for one endpoint, overridable with DASHBOARD_CACHE_TTL_<NAME> (0 disables caching)"""
+    env_var = "DASHBOARD_CACHE_TTL_" + name.upper().replace("-", "_")
+    return float(os.getenv(env_var, str(default)))
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    """A rendered response body and the high-water mark it was computed at"""
+    body: bytes
+    etag: str
+    high_water_mark: int
+    expires_at: float
+
+
+class _Flight:
+    """A computation in progress that concurrent misses for the same key wait on"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[CachedResult] = None
+        self.error: Optional[BaseException] = None
+
+
+class ResultCache:
+    """LRU cache of rendered endpoint results, invalidated by TTL and purchase high-water mark"""
+
+    def __init__(self, high_water_mark: Callable[[], int], max_entries: int = 256,
+                 hwm_interval: float = 1.0):
+        self.max_entries = max_entries
+        self.hwm_interval = hwm_interval
+        self._high_water_mark = high_water_mark
+        self._entries: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._hwm_lock = threading.Lock()
+        self._hwm: Optional[int] = None
+        self._hwm_checked_at = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'not_modified': 0,
+                       'invalidations': 0, 'evictions': 0}
+
+    def current_high_water_mark(self) -> int:
+        """Latest purchases high-water mark, probed at most once per ``hwm_interval`` seconds"""
+        with self._hwm_lock:
+            now = time.monotonic()
+            if self._hwm is None or now - self._hwm_checked_at >= self.hwm_interval:
+                self._hwm = self._high_water_mark()
+                self._hwm_checked_at = now
+            return self._hwm
+
+    def advance_high_water_mark(self, hwm: int) -> None:
+        """Record a high-water mark learned elsewhere (e.g. from a NOTIFY) without probing"""
+        with self._hwm_lock:
+            if self._hwm is None or hwm > self._hwm:
+                self._hwm = hwm
+                self._hwm_checked_at = time.monotonic()
+
+    @staticmethod
+    def key(name: str, query_items: Sequence[Tuple[str, str]] = ()) -> str:
+        """Cache key of an endpoint and its query parameters, independent of parameter order"""
+        return name + "?" + "&".join(sorted(f"{k}={v}" for k, v in query_items))
+
+    def get_or_compute(self, key: str, ttl: float, compute: Callable[[], Any]) -> CachedResult:
+        """Return the cached result for a key, computing it once if it is missing or stale"""
+        hwm = self.current_high_water_mark()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.high_water_mark == hwm and time.monotonic() < entry.expires_at:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry
+                if entry.high_water_mark != hwm:
+                    self._stats['invalidations'] += 1
+                del self._entries[key]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._render(compute(), hwm, ttl)
+            if ttl > 0:
+                with self._lock:
+                    self._entries[key] = flight.result
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self._stats['evictions'] += 1
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    @staticmethod
+    def _render(content: Any, hwm: int, ttl: float) -> CachedResult:
+        # Same encoding as the app's FastJSONResponse, done once per computation
+        body = dumps(content)
+        # Content-derived, so results that survive new purchases still revalidate
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        return CachedResult(body=body, etag=etag, high_water_mark=hwm, expires_at=time.monotonic() + ttl)
+
+    def respond(self, request: Request, name: str, ttl: float, compute: Callable[[], Any]) -> Response:
+        """Serve an endpoint through the cache, answering 304 when the client's ETag still matches"""
+        result = self.get_or_compute(self.key(name, request.query_params.multi_items()), ttl, compute)
+        headers = {"ETag": result.etag, "Cache-Control": "no-cache"}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and result.etag in [tag.strip() for tag in if_none_match.split(",")]:
+            self._stats['not_modified'] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=result.body, media_type="application/json", headers=headers)
+
+    def clear(self) -> None:
+        """Drop every cached result"""
+        with self._lock:
+            self._entries.clear()
+        with self._hwm_lock:
+            self._hwm = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'high_water_mark': self._hwm
+            }
@@ -13,15 +13,575 @@ CREATE TABLE IF NOT EXISTS supermarkets (
 CREATE TABLE IF NOT EXISTS products (
     id SERIAL PRIMARY KEY,
     name TEXT UNIQUE NOT NULL,
-    price FLOAT NOT NULL
+    price NUMERIC(12, 2) NOT NULL
 );
 
--- 4. Purchases table
+-- 4. Purchases table, range-partitioned by month on timestamp (partitions are
+--    managed by the functions in section 11; see db/migrations/008_partition_purchases.sql
+--    for databases created with the unpartitioned table)
 CREATE TABLE IF NOT EXISTS purchases (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     supermarket_id VARCHAR NOT NULL REFERENCES supermarkets(id),
     timestamp TIMESTAMP NOT NULL,
     user_id UUID NOT NULL REFERENCES customers(uuid),
     item_list TEXT[] NOT NULL,
-    total_amount FLOAT NOT NULL
-);
\ No newline at end of file
+    total_amount NUMERIC(12, 2) NOT NULL,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Dashboard indexes (see db/migrations/001_purchases_indexes_numeric.sql for existing databases)
+-- Covering index: per-customer counts/spend and distinct customers are index-only scans
+CREATE INDEX IF NOT EXISTS purchases_user_id_idx ON purchases (user_id) INCLUDE (total_amount);
+CREATE INDEX IF NOT EXISTS purchases_supermarket_id_timestamp_idx ON purchases (supermarket_id, timestamp);
+CREATE INDEX IF NOT EXISTS purchases_timestamp_idx ON purchases (timestamp);
+-- Basket containment queries (item_list @> ARRAY['milk'])
+CREATE INDEX IF NOT EXISTS purchases_item_list_idx ON purchases USING GIN (item_list);
+
+-- 5. Catalog change notifications: the cash register caches products and
+--    supermarkets in memory and LISTENs on this channel to invalidate them
+CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('catalog_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER products_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed();
+
+CREATE OR REPLACE TRIGGER supermarkets_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON supermarkets
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed();
+
+
+-- 6. Bulk load bookkeeping: how far db.init_all_data got through each CSV,
+--    so an interrupted load resumes instead of starting over
+CREATE TABLE IF NOT EXISTS data_load_progress (
+    source TEXT PRIMARY KEY,
+    file_size BIGINT NOT NULL,
+    byte_offset BIGINT NOT NULL,
+    rows_loaded BIGINT NOT NULL,
+    customer_counter BIGINT NOT NULL,
+    completed BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+
+-- 7. Dashboard rollups: maintained incrementally by statement-level triggers on
+--    purchases, so the dashboard reads results without scanning purchase history.
+--    Every writer (checkout, batch ingestion, bulk loaders) goes through them.
+CREATE TABLE IF NOT EXISTS product_sales_rollup (
+    product_name TEXT PRIMARY KEY,
+    sales_count BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS customer_purchase_rollup (
+    user_id UUID PRIMARY KEY,
+    purchase_count BIGINT NOT NULL,
+    total_spent NUMERIC(14, 2) NOT NULL
+);
+
+-- Hourly sales per store (UTC hours); day/week series are summed from these
+CREATE TABLE IF NOT EXISTS sales_hourly_rollup (
+    supermarket_id VARCHAR NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    basket_count BIGINT NOT NULL,
+    item_count BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (supermarket_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_counters (
+    name TEXT PRIMARY KEY,
+    value BIGINT NOT NULL
+);
+
+INSERT INTO analytics_counters (name, value) VALUES ('distinct_customers', 0)
+    ON CONFLICT (name) DO NOTHING;
+-- Bumped by every statement that deletes, updates or truncates purchases (and by
+-- rebuilds), so copies of purchase history can tell that they must be re-read
+INSERT INTO analytics_counters (name, value) VALUES ('purchase_rewrites', 0)
+    ON CONFLICT (name) DO NOTHING;
+
+CREATE INDEX IF NOT EXISTS product_sales_rollup_sales_count_idx
+    ON product_sales_rollup (sales_count DESC);
+-- Chain-wide time ranges; per-store ranges use the primary key
+CREATE INDEX IF NOT EXISTS sales_hourly_rollup_bucket_idx ON sales_hourly_rollup (bucket);
+-- Serves /loyal-customers keyset pagination: a row comparison on all three
+-- columns seeks straight to the next page
+CREATE INDEX IF NOT EXISTS customer_purchase_rollup_keyset_idx
+    ON customer_purchase_rollup (purchase_count DESC, total_spent DESC, user_id DESC);
+
+-- Rows are aggregated per statement and upserted in key order, so a bulk insert
+-- costs one upsert per distinct product/customer and concurrent writers lock
+-- rollup rows in the same order instead of deadlocking.
+CREATE OR REPLACE FUNCTION apply_purchase_rollups() RETURNS trigger AS $$
+DECLARE
+    changed BIGINT;
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE analytics_counters SET value = value + 1 WHERE name = 'purchase_rewrites';
+
+        UPDATE product_sales_rollup ps
+        SET sales_count = ps.sales_count - d.sales_count
+        FROM (
+            SELECT item AS product_name, COUNT(*) AS sales_count
+            FROM old_purchases, unnest(item_list) AS item
+            GROUP BY item
+            ORDER BY item
+        ) d
+        WHERE ps.product_name = d.product_name;
+        DELETE FROM product_sales_rollup WHERE sales_count <= 0;
+
+        UPDATE customer_purchase_rollup cs
+        SET purchase_count = cs.purchase_count - d.purchase_count,
+            total_spent = cs.total_spent - d.total_spent
+        FROM (
+            SELECT user_id, COUNT(*) AS purchase_count, SUM(total_amount) AS total_spent
+            FROM old_purchases
+            GROUP BY user_id
+            ORDER BY user_id
+        ) d
+        WHERE cs.user_id = d.user_id;
+        DELETE FROM customer_purchase_rollup cs
+        USING (SELECT DISTINCT user_id FROM old_purchases) d
+        WHERE cs.user_id = d.user_id AND cs.purchase_count <= 0;
+        GET DIAGNOSTICS changed = ROW_COUNT;
+        IF changed > 0 THEN
+            UPDATE analytics_counters SET value = value - changed WHERE name = 'distinct_customers';
+        END IF;
+
+        UPDATE sales_hourly_rollup sh
+        SET basket_count = sh.basket_count - d.basket_count,
+            item_count = sh.item_count - d.item_count,
+            revenue = sh.revenue - d.revenue
+        FROM (
+            SELECT supermarket_id, date_trunc('hour', timestamp) AS bucket, COUNT(*) AS basket_count,
+                   SUM(cardinality(item_list)) AS item_count, SUM(total_amount) AS revenue
+            FROM old_purchases
+            GROUP BY 1, 2
+        ) d
+        WHERE sh.supermarket_id = d.supermarket_id AND sh.bucket = d.bucket;
+        DELETE FROM sales_hourly_rollup sh
+        USING (SELECT DISTINCT supermarket_id, date_trunc('hour', timestamp) AS bucket FROM old_purchases) d
+        WHERE sh.supermarket_id = d.supermarket_id AND sh.bucket = d.bucket AND sh.basket_count <= 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO product_sales_rollup AS ps (product_name, sales_count)
+        SELECT item, COUNT(*)
+        FROM new_purchases, unnest(item_list) AS item
+        GROUP BY item
+        ORDER BY item
+        ON CONFLICT (product_name) DO UPDATE
+            SET sales_count = ps.sales_count + EXCLUDED.sales_count;
+
+        -- xmax = 0 marks rows that were inserted rather than updated: first purchases
+        WITH upserted AS (
+            INSERT INTO customer_purchase_rollup AS cs (user_id, purchase_count, total_spent)
+            SELECT user_id, COUNT(*), SUM(total_amount)
+            FROM new_purchases
+            GROUP BY user_id
+            ORDER BY user_id
+            ON CONFLICT (user_id) DO UPDATE
+                SET purchase_count = cs.purchase_count + EXCLUDED.purchase_count,
+                    total_spent = cs.total_spent + EXCLUDED.total_spent
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted) INTO changed FROM upserted;
+        IF changed > 0 THEN
+            UPDATE analytics_counters SET value = value + changed WHERE name = 'distinct_customers';
+        END IF;
+
+        INSERT INTO sales_hourly_rollup AS sh (supermarket_id, bucket, basket_count, item_count, revenue)
+        SELECT supermarket_id, date_trunc('hour', timestamp), COUNT(*), SUM(cardinality(item_list)), SUM(total_amount)
+        FROM new_purchases
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (supermarket_id, bucket) DO UPDATE
+            SET basket_count = sh.basket_count + EXCLUDED.basket_count,
+                item_count = sh.item_count + EXCLUDED.item_count,
+                revenue = sh.revenue + EXCLUDED.revenue;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recompute every rollup from purchases (initial backfill, or repair after
+-- changes that bypass triggers). Blocks purchase writes while it runs.
+CREATE OR REPLACE FUNCTION rebuild_purchase_rollups() RETURNS void AS $$
+BEGIN
+    LOCK TABLE purchases IN SHARE MODE;
+    TRUNCATE product_sales_rollup, customer_purchase_rollup, sales_hourly_rollup, customer_day_sketches;
+
+    INSERT INTO product_sales_rollup (product_name, sales_count)
+    SELECT item, COUNT(*) FROM purchases, unnest(item_list) AS item GROUP BY item;
+
+    INSERT INTO customer_purchase_rollup (user_id, purchase_count, total_spent)
+    SELECT user_id, COUNT(*), SUM(total_amount) FROM purchases GROUP BY user_id;
+
+    INSERT INTO analytics_counters (name, value)
+    SELECT 'distinct_customers', COUNT(*) FROM customer_purchase_rollup
+    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value;
+    UPDATE analytics_counters SET value = value + 1 WHERE name = 'purchase_rewrites';
+
+    INSERT INTO sales_hourly_rollup (supermarket_id, bucket, basket_count, item_count, revenue)
+    SELECT supermarket_id, date_trunc('hour', timestamp), COUNT(*), SUM(cardinality(item_list)), SUM(total_amount)
+    FROM purchases
+    GROUP BY 1, 2;
+
+    PERFORM merge_customer_sketch(supermarket_id, day, array_agg(register), array_agg(rank))
+    FROM (
+        SELECT supermarket_id, timestamp::date AS day, customer_sketch_register(user_id) AS register,
+               MAX(customer_sketch_rank(user_id)) AS rank
+        FROM purchases
+        GROUP BY 1, 2, 3
+    ) r
+    GROUP BY supermarket_id, day;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reset_purchase_rollups() RETURNS trigger AS $$
+BEGIN
+    TRUNCATE product_sales_rollup, customer_purchase_rollup, sales_hourly_rollup, customer_day_sketches;
+    UPDATE analytics_counters SET value = 0 WHERE name = 'distinct_customers';
+    UPDATE analytics_counters SET value = value + 1 WHERE name = 'purchase_rewrites';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER purchases_rollup_insert
+    AFTER INSERT ON purchases REFERENCING NEW TABLE AS new_purchases
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_purchase_rollups();
+
+CREATE OR REPLACE TRIGGER purchases_rollup_update
+    AFTER UPDATE ON purchases REFERENCING OLD TABLE AS old_purchases NEW TABLE AS new_purchases
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_purchase_rollups();
+
+CREATE OR REPLACE TRIGGER purchases_rollup_delete
+    AFTER DELETE ON purchases REFERENCING OLD TABLE AS old_purchases
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_purchase_rollups();
+
+CREATE OR REPLACE TRIGGER purchases_rollup_truncate
+    AFTER TRUNCATE ON purchases
+    FOR EACH STATEMENT EXECUTE FUNCTION reset_purchase_rollups();
+
+
+-- 8. Purchase notifications: the dashboard LISTENs on this channel and pushes
+--    fresh metrics to connected browsers. One NOTIFY per statement, carrying
+--    the highest new purchase id, so batches and bulk loads send a single event.
+CREATE OR REPLACE FUNCTION notify_purchases_changed() RETURNS trigger AS $$
+DECLARE
+    high_water_mark BIGINT;
+BEGIN
+    SELECT MAX(id) INTO high_water_mark FROM new_purchases;
+    IF high_water_mark IS NOT NULL THEN
+        PERFORM pg_notify('purchases_changed', high_water_mark::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER purchases_notify_insert
+    AFTER INSERT ON purchases REFERENCING NEW TABLE AS new_purchases
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_purchases_changed();
+
+
+-- 9. Market-basket analysis: co-occurrence counts over distinct products per
+--    basket, keyed by products.id with item_a < item_b < item_c. Maintained
+--    incrementally by the dashboard's basket_analysis job, which also derives
+--    the association rules served by /basket-rules.
+CREATE TABLE IF NOT EXISTS basket_analysis_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    last_purchase_id BIGINT NOT NULL DEFAULT 0,
+    basket_count BIGINT NOT NULL DEFAULT 0,
+    unknown_items BIGINT NOT NULL DEFAULT 0,
+    min_support DOUBLE PRECISION,
+    rules_updated_at TIMESTAMP
+);
+
+INSERT INTO basket_analysis_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS basket_item_counts (
+    product_id INTEGER PRIMARY KEY,
+    basket_count BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS basket_pair_counts (
+    item_a INTEGER NOT NULL,
+    item_b INTEGER NOT NULL,
+    basket_count BIGINT NOT NULL,
+    PRIMARY KEY (item_a, item_b)
+);
+
+CREATE TABLE IF NOT EXISTS basket_triple_counts (
+    item_a INTEGER NOT NULL,
+    item_b INTEGER NOT NULL,
+    item_c INTEGER NOT NULL,
+    basket_count BIGINT NOT NULL,
+    PRIMARY KEY (item_a, item_b, item_c)
+);
+
+-- antecedent => consequent, for every pair and triple above the job's minimum support
+CREATE TABLE IF NOT EXISTS basket_rules (
+    antecedent TEXT[] NOT NULL,
+    consequent TEXT NOT NULL,
+    itemset_size SMALLINT NOT NULL,
+    basket_count BIGINT NOT NULL,
+    support DOUBLE PRECISION NOT NULL,
+    confidence DOUBLE PRECISION NOT NULL,
+    lift DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (antecedent, consequent)
+);
+
+CREATE INDEX IF NOT EXISTS basket_rules_lift_idx ON basket_rules (lift DESC, confidence DESC);
+
+
+-- 10. Distinct-customer sketches: one HyperLogLog sketch per supermarket per
+--     (UTC) day, updated on insert. Sketches merge by taking the per-register
+--     maximum, so distinct customers over any set of stores and days are
+--     estimated without touching purchases. 4096 one-byte registers give a
+--     standard error of 1.04 / sqrt(4096) = 1.6%.
+CREATE TABLE IF NOT EXISTS customer_day_sketches (
+    supermarket_id VARCHAR NOT NULL,
+    day DATE NOT NULL,
+    registers BYTEA NOT NULL,
+    PRIMARY KEY (supermarket_id, day)
+);
+
+-- Uncompressed, so reading one register does not decompress the whole sketch
+ALTER TABLE customer_day_sketches ALTER COLUMN registers SET STORAGE EXTERNAL;
+
+CREATE INDEX IF NOT EXISTS customer_day_sketches_day_idx ON customer_day_sketches (day);
+
+-- 64-bit hash of the customer uuid: the low 12 bits pick the register, and the
+-- rank is 1 + the number of trailing zero bits in the remaining 52
+CREATE OR REPLACE FUNCTION customer_sketch_register(user_id UUID) RETURNS INTEGER AS $$
+    SELECT (hashtextextended(user_id::text, 0) & 4095)::integer
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION customer_sketch_rank(user_id UUID) RETURNS INTEGER AS $$
+    SELECT 53 - length(rtrim((hashtextextended(user_id::text, 0) >> 12)::bit(52)::text, '0'))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Raise a store-day sketch's registers to the given ranks
+CREATE OR REPLACE FUNCTION merge_customer_sketch(p_supermarket_id VARCHAR, p_day DATE,
+                                                 p_registers INTEGER[], p_ranks INTEGER[]) RETURNS void AS $$
+DECLARE
+    sketch BYTEA;
+    merged BYTEA;
+BEGIN
+    -- Returning customers rarely raise a register: check small batches without locking first
+    IF cardinality(p_registers) <= 64 THEN
+        SELECT registers INTO sketch FROM customer_day_sketches
+        WHERE supermarket_id = p_supermarket_id AND day = p_day;
+        IF FOUND AND NOT EXISTS (
+            SELECT 1 FROM unnest(p_registers, p_ranks) AS u(register, rank)
+            WHERE u.rank > get_byte(sketch, u.register)
+        ) THEN
+            RETURN;
+        END IF;
+    END IF;
+
+    INSERT INTO customer_day_sketches (supermarket_id, day, registers)
+    VALUES (p_supermarket_id, p_day, decode(repeat('00', 4096), 'hex'))
+    ON CONFLICT (supermarket_id, day) DO NOTHING;
+
+    SELECT registers INTO sketch FROM customer_day_sketches
+    WHERE supermarket_id = p_supermarket_id AND day = p_day
+    FOR UPDATE;
+
+    merged := sketch;
+    FOR i IN 1..cardinality(p_registers) LOOP
+        IF p_ranks[i] > get_byte(merged, p_registers[i]) THEN
+            merged := set_byte(merged, p_registers[i], p_ranks[i]);
+        END IF;
+    END LOOP;
+
+    IF merged IS DISTINCT FROM sketch THEN
+        UPDATE customer_day_sketches SET registers = merged
+        WHERE supermarket_id = p_supermarket_id AND day = p_day;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_customer_sketches() RETURNS trigger AS $$
+DECLARE
+    g RECORD;
+BEGIN
+    FOR g IN
+        SELECT supermarket_id, day, array_agg(register) AS registers, array_agg(rank) AS ranks
+        FROM (
+            SELECT supermarket_id, timestamp::date AS day, customer_sketch_register(user_id) AS register,
+                   MAX(customer_sketch_rank(user_id)) AS rank
+            FROM new_purchases
+            GROUP BY 1, 2, 3
+        ) r
+        GROUP BY supermarket_id, day
+        ORDER BY supermarket_id, day
+    LOOP
+        PERFORM merge_customer_sketch(g.supermarket_id, g.day, g.registers, g.ranks);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Sketches cannot forget a customer, so deletes and updates are only reflected
+-- after rebuild_purchase_rollups()
+CREATE OR REPLACE TRIGGER purchases_sketch_insert
+    AFTER INSERT ON purchases REFERENCING NEW TABLE AS new_purchases
+    FOR EACH STATEMENT EXECUTE FUNCTION update_customer_sketches();
+
+
+-- 11. Purchase partitions: one partition per calendar month, named
+--     purchases_YYYY_MM, plus purchases_default for rows outside every month
+--     created so far. The loaders create the months they are about to insert,
+--     and `python -m db.purchase_partitions` (cash register image) keeps the
+--     coming months created and archives old ones.
+--     Rows moved out of purchases_default go through the partition itself, so
+--     the statement-level rollup triggers on purchases do not count them twice.
+CREATE OR REPLACE FUNCTION create_purchase_partition(p_month DATE) RETURNS BOOLEAN AS $$
+DECLARE
+    lo TIMESTAMP := date_trunc('month', p_month);
+    hi TIMESTAMP := date_trunc('month', p_month) + interval '1 month';
+    part TEXT := 'purchases_' || to_char(p_month, 'YYYY_MM');
+BEGIN
+    IF to_regclass(quote_ident(part)) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    -- Concurrent loaders may reach the same month; the second one finds it created
+    PERFORM pg_advisory_xact_lock(hashtext('purchases_partitions'));
+    IF to_regclass(quote_ident(part)) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM purchases_default WHERE timestamp >= lo AND timestamp < hi) THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF purchases FOR VALUES FROM (%L) TO (%L)', part, lo, hi);
+    ELSE
+        -- The month's rows already sit in the default partition: move them into a new
+        -- table and attach it, with inserts into the default partition held off meanwhile
+        LOCK TABLE purchases_default IN ACCESS EXCLUSIVE MODE;
+        EXECUTE format('CREATE TABLE %I (LIKE purchases INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part);
+        EXECUTE format('WITH moved AS (DELETE FROM purchases_default WHERE timestamp >= %L AND timestamp < %L RETURNING *)
+                        INSERT INTO %I SELECT * FROM moved', lo, hi, part);
+        EXECUTE format('ALTER TABLE purchases ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', part, lo, hi);
+    END IF;
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create every month from p_from through p_to; returns the number created
+CREATE OR REPLACE FUNCTION create_purchase_partitions(p_from TIMESTAMP, p_to TIMESTAMP) RETURNS INTEGER AS $$
+    SELECT count(*) FILTER (WHERE create_purchase_partition(month::date))::integer
+    FROM generate_series(date_trunc('month', p_from), date_trunc('month', p_to), interval '1 month') AS month
+$$ LANGUAGE sql;
+
+-- Create the current and the next p_months_ahead months, and split any months
+-- that have accumulated in the default partition into their own partitions
+CREATE OR REPLACE FUNCTION ensure_purchase_partitions(p_months_ahead INTEGER DEFAULT 3) RETURNS INTEGER AS $$
+DECLARE
+    created INTEGER;
+    month TIMESTAMP;
+BEGIN
+    created := create_purchase_partitions(now()::timestamp, now()::timestamp + make_interval(months => p_months_ahead));
+    FOREACH month IN ARRAY ARRAY(SELECT DISTINCT date_trunc('month', timestamp) FROM purchases_default ORDER BY 1) LOOP
+        IF create_purchase_partition(month::date) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    -- Skipped for a database still on the unpartitioned table (until migration 008)
+    IF (SELECT relkind FROM pg_class WHERE oid = 'purchases'::regclass) = 'p' THEN
+        CREATE TABLE IF NOT EXISTS purchases_default PARTITION OF purchases DEFAULT;
+        PERFORM ensure_purchase_partitions();
+    END IF;
+END
+$$;
+
+
+-- Take a month detached from purchases out of the dashboard rollups, so they keep
+-- describing exactly the attached purchases (as rebuild_purchase_rollups() and the
+-- exact queries see them). db.purchase_partitions calls it once per archived month,
+-- after the detach. The month is aggregated first, then rollup rows are locked in
+-- key order like the triggers lock them, so concurrent checkouts wait only briefly.
+-- Sketches cannot forget customers: the month's days are dropped and re-merged
+-- from any late purchases for that month still in purchases. Like a rewrite, it
+-- bumps purchase_rewrites so the dashboard's column snapshot is rebuilt.
+CREATE OR REPLACE FUNCTION subtract_detached_purchases(p_table REGCLASS, p_month DATE) RETURNS void AS $$
+DECLARE
+    lo TIMESTAMP := date_trunc('month', p_month);
+    hi TIMESTAMP := date_trunc('month', p_month) + interval '1 month';
+    removed BIGINT;
+BEGIN
+    EXECUTE format('CREATE TEMP TABLE detached_product_sales ON COMMIT DROP AS
+                    SELECT item AS product_name, COUNT(*) AS sales_count
+                    FROM %s, unnest(item_list) AS item GROUP BY item', p_table);
+    EXECUTE format('CREATE TEMP TABLE detached_customers ON COMMIT DROP AS
+                    SELECT user_id, COUNT(*) AS purchase_count, SUM(total_amount) AS total_spent
+                    FROM %s GROUP BY user_id', p_table);
+    EXECUTE format('CREATE TEMP TABLE detached_sales_hourly ON COMMIT DROP AS
+                    SELECT supermarket_id, date_trunc(''hour'', timestamp) AS bucket, COUNT(*) AS basket_count,
+                           SUM(cardinality(item_list)) AS item_count, SUM(total_amount) AS revenue
+                    FROM %s GROUP BY 1, 2', p_table);
+
+    PERFORM 1 FROM product_sales_rollup ps JOIN detached_product_sales d USING (product_name)
+    ORDER BY ps.product_name FOR UPDATE OF ps;
+    UPDATE product_sales_rollup ps SET sales_count = ps.sales_count - d.sales_count
+    FROM detached_product_sales d WHERE ps.product_name = d.product_name;
+    DELETE FROM product_sales_rollup ps USING detached_product_sales d
+    WHERE ps.product_name = d.product_name AND ps.sales_count <= 0;
+
+    PERFORM 1 FROM customer_purchase_rollup cs JOIN detached_customers d USING (user_id)
+    ORDER BY cs.user_id FOR UPDATE OF cs;
+    UPDATE customer_purchase_rollup cs
+    SET purchase_count = cs.purchase_count - d.purchase_count,
+        total_spent = cs.total_spent - d.total_spent
+    FROM detached_customers d WHERE cs.user_id = d.user_id;
+    DELETE FROM customer_purchase_rollup cs USING detached_customers d
+    WHERE cs.user_id = d.user_id AND cs.purchase_count <= 0;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    IF removed > 0 THEN
+        UPDATE analytics_counters SET value = value - removed WHERE name = 'distinct_customers';
+    END IF;
+
+    PERFORM 1 FROM sales_hourly_rollup sh JOIN detached_sales_hourly d USING (supermarket_id, bucket)
+    ORDER BY sh.supermarket_id, sh.bucket FOR UPDATE OF sh;
+    UPDATE sales_hourly_rollup sh
+    SET basket_count = sh.basket_count - d.basket_count,
+        item_count = sh.item_count - d.item_count,
+        revenue = sh.revenue - d.revenue
+    FROM detached_sales_hourly d WHERE sh.supermarket_id = d.supermarket_id AND sh.bucket = d.bucket;
+    DELETE FROM sales_hourly_rollup sh USING detached_sales_hourly d
+    WHERE sh.supermarket_id = d.supermarket_id AND sh.bucket = d.bucket AND sh.basket_count <= 0;
+
+    DELETE FROM customer_day_sketches WHERE day >= lo::date AND day < hi::date;
+    PERFORM merge_customer_sketch(supermarket_id, day, array_agg(register), array_agg(rank))
+    FROM (
+        SELECT supermarket_id, timestamp::date AS day, customer_sketch_register(user_id) AS register,
+               MAX(customer_sketch_rank(user_id)) AS rank
+        FROM purchases
+        WHERE timestamp >= lo AND timestamp < hi
+        GROUP BY 1, 2, 3
+    ) r
+    GROUP BY supermarket_id, day;
+
+    UPDATE analytics_counters SET value = value + 1 WHERE name = 'purchase_rewrites';
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 12. Purchase journal progress: the last journal sequence number each cash
+--     register's write-behind journal has committed. The flusher advances it
+--     in the same transaction as the purchases, so replay resumes exactly there
+CREATE TABLE IF NOT EXISTS purchase_journal_progress (
+    journal_id TEXT PRIMARY KEY,
+    last_seq BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -0,0 +1,36 @@
+-- Migration 001: dashboard indexes and exact money columns
+--
+-- Brings a database created from an earlier db/init.sql up to date; fresh
+-- databases already get this schema. Every statement is idempotent. Run it
+-- with psql outside a transaction block (CREATE INDEX CONCURRENTLY requires
+-- that), for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/001_purchases_indexes_numeric.sql
+--
+-- The ALTER COLUMN ... TYPE statements rewrite products and purchases under an
+-- ACCESS EXCLUSIVE lock, so run them in a quiet window. The indexes are built
+-- CONCURRENTLY and do not block checkouts.
+
+-- 1. FLOAT -> NUMERIC(12, 2) money columns (no-op when already numeric)
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'products' AND column_name = 'price') <> 'numeric' THEN
+        ALTER TABLE products ALTER COLUMN price TYPE NUMERIC(12, 2) USING round(price::numeric, 2);
+    END IF;
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'purchases' AND column_name = 'total_amount') <> 'numeric' THEN
+        ALTER TABLE purchases ALTER COLUMN total_amount TYPE NUMERIC(12, 2) USING round(total_amount::numeric, 2);
+    END IF;
+END
+$$;
+
+-- 2. Indexes used by the dashboard queries
+CREATE INDEX CONCURRENTLY IF NOT EXISTS purchases_user_id_idx ON purchases (user_id) INCLUDE (total_amount);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS purchases_supermarket_id_timestamp_idx ON purchases (supermarket_id, timestamp);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS purchases_timestamp_idx ON purchases (timestamp);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS purchases_item_list_idx ON purchases USING GIN (item_list);
+
+ANALYZE products;
+ANALYZE purchases;
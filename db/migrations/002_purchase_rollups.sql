@@ -0,0 +1,17 @@
+-- Migration 002: incrementally maintained dashboard rollups
+--
+-- Installs the rollup tables and purchase triggers from db/init.sql (section 7)
+-- on an existing database, then backfills them from the purchase history. Run
+-- after 001, for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/002_purchase_rollups.sql
+--
+-- The backfill holds a SHARE lock on purchases, so checkouts wait until it
+-- finishes; purchases inserted before the lock are counted exactly once.
+
+\ir ../init.sql
+
+SELECT rebuild_purchase_rollups();
+ANALYZE product_sales_rollup;
+ANALYZE customer_purchase_rollup;
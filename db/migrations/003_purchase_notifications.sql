@@ -0,0 +1,9 @@
+-- Migration 003: purchase insert notifications for the live dashboard
+--
+-- Installs the purchases_changed NOTIFY trigger from db/init.sql (section 8)
+-- on an existing database. Run after 002, for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/003_purchase_notifications.sql
+
+\ir ../init.sql
@@ -0,0 +1,13 @@
+-- Migration 004: keyset pagination index for /loyal-customers
+--
+-- Replaces the loyalty index from migration 002 with one whose columns all
+-- sort descending, so the (purchase_count, total_spent, user_id) row
+-- comparison used by page cursors is an index condition. Run outside a
+-- transaction block, for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/004_loyal_customers_keyset_index.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS customer_purchase_rollup_keyset_idx
+    ON customer_purchase_rollup (purchase_count DESC, total_spent DESC, user_id DESC);
+DROP INDEX CONCURRENTLY IF EXISTS customer_purchase_rollup_loyalty_idx;
@@ -0,0 +1,15 @@
+-- Migration 005: hourly sales buckets for the time-series endpoints
+--
+-- Installs sales_hourly_rollup and the updated rollup trigger function from
+-- db/init.sql (section 7), then rebuilds the rollups so the new table is
+-- backfilled from the purchase history. Run after 004, for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/005_sales_hourly_rollup.sql
+--
+-- Like 002, the rebuild holds a SHARE lock on purchases while it runs.
+
+\ir ../init.sql
+
+SELECT rebuild_purchase_rollups();
+ANALYZE sales_hourly_rollup;
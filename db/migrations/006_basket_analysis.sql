@@ -0,0 +1,11 @@
+-- Migration 006: market-basket analysis tables
+--
+-- Installs the co-occurrence count and rule tables from db/init.sql
+-- (section 9) on an existing database. They start empty; the first run of
+-- the basket_analysis job counts the whole purchase history. Run after 005,
+-- for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/006_basket_analysis.sql
+
+\ir ../init.sql
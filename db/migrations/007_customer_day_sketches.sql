@@ -0,0 +1,15 @@
+-- Migration 007: HyperLogLog distinct-customer sketches
+--
+-- Installs customer_day_sketches and its insert trigger from db/init.sql
+-- (section 10), then rebuilds the rollups so every store-day sketch is
+-- backfilled from the purchase history. Run after 006, for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/007_customer_day_sketches.sql
+--
+-- Like 002, the rebuild holds a SHARE lock on purchases while it runs.
+
+\ir ../init.sql
+
+SELECT rebuild_purchase_rollups();
+ANALYZE customer_day_sketches;
@@ -0,0 +1,47 @@
+-- Migration 008: monthly range partitioning of purchases
+--
+-- Converts a purchases table created by an earlier db/init.sql into the
+-- partitioned table from section 4: the old table is renamed, db/init.sql
+-- creates the partitioned one (with its indexes, triggers and the current
+-- months), every month of existing data gets its partition, and the rows are
+-- copied over with their ids. Run it in a quiet window; purchases is locked
+-- for the whole copy:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/008_partition_purchases.sql
+--
+-- The copy runs with session_replication_role = replica (superuser only) so the
+-- rollup and notification triggers do not fire: the rollups already include
+-- these rows.
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+
+LOCK TABLE purchases IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE purchases RENAME TO purchases_unpartitioned;
+ALTER TABLE purchases_unpartitioned RENAME CONSTRAINT purchases_pkey TO purchases_unpartitioned_pkey;
+ALTER SEQUENCE purchases_id_seq RENAME TO purchases_unpartitioned_id_seq;
+ALTER INDEX IF EXISTS purchases_user_id_idx RENAME TO purchases_unpartitioned_user_id_idx;
+ALTER INDEX IF EXISTS purchases_supermarket_id_timestamp_idx RENAME TO purchases_unpartitioned_supermarket_id_timestamp_idx;
+ALTER INDEX IF EXISTS purchases_timestamp_idx RENAME TO purchases_unpartitioned_timestamp_idx;
+ALTER INDEX IF EXISTS purchases_item_list_idx RENAME TO purchases_unpartitioned_item_list_idx;
+
+\ir ../init.sql
+
+SELECT create_purchase_partitions(MIN(timestamp), MAX(timestamp)) FROM purchases_unpartitioned;
+
+SET LOCAL session_replication_role = replica;
+INSERT INTO purchases (id, supermarket_id, timestamp, user_id, item_list, total_amount)
+SELECT id, supermarket_id, timestamp, user_id, item_list, total_amount FROM purchases_unpartitioned;
+SET LOCAL session_replication_role = origin;
+
+SELECT setval(pg_get_serial_sequence('purchases', 'id'),
+              (SELECT COALESCE(MAX(id), 0) + 1 FROM purchases_unpartitioned), false);
+
+DROP TABLE purchases_unpartitioned;
+
+COMMIT;
+
+ANALYZE purchases;
@@ -0,0 +1,9 @@
+-- Migration 009: write-behind purchase journal
+--
+-- Installs purchase_journal_progress from db/init.sql (section 12), which the
+-- cash register needs when PURCHASE_JOURNAL_ENABLED=true. Run after 008, for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/009_purchase_journal.sql
+
+\ir ../init.sql
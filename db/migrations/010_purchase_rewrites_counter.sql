@@ -0,0 +1,12 @@
+-- Migration 010: purchase rewrite counter
+--
+-- Adds the 'purchase_rewrites' row to analytics_counters and the rollup
+-- functions from db/init.sql (section 7) that bump it whenever purchases are
+-- deleted, updated, truncated or the rollups rebuilt. The dashboard's columnar
+-- analytics polls it to notice history changes that keep MAX(id) unchanged.
+-- Run after 009, for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/010_purchase_rewrites_counter.sql
+
+\ir ../init.sql
@@ -0,0 +1,12 @@
+-- Migration 011: remove archived months from the rollups
+--
+-- Adds subtract_detached_purchases() from db/init.sql (section 11), which
+-- db.purchase_partitions calls for each month it detaches, so archived
+-- purchases leave the dashboard rollups and customer sketches. Months archived
+-- before this migration are still counted; run SELECT rebuild_purchase_rollups();
+-- once afterwards to drop them. Run after 010, for example:
+--
+--   docker compose exec -T db psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+--       -f /docker-entrypoint-initdb.d/migrations/011_archived_rollups.sql
+
+\ir ../init.sql
@@ -0,0 +1,6 @@
+#!/bin/bash
+# Runs once when the primary's data directory is initialized: allow streaming
+# replication connections, used by the db_replica service ("replica" compose profile)
+set -e
+
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -1,9 +1,18 @@
 """
 Shared database configuration utilities for the supermarket system.
 """
+import asyncio
 import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, AsyncIterator, Iterator, Optional, Union
+
 import psycopg2
-from typing import Dict, Any
+import psycopg2.extensions
+import psycopg2.pool
+
+from shared.metrics import METRICS_CONFIG, TimedCursor, observe_pool_wait, record_asyncpg_query
 
 
 def validate_env_vars() -> None:
@@ -15,20 +24,598 @@ def validate_env_vars() -> None:
         raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
 
-def get_db_config() -> Dict[str, Any]:
-    """Get database configuration from environment variables"""
+def _dsn_config(dsn: Optional[str]) -> Dict[str, Any]:
+    """Connection settings from a DSN, with anything it leaves out taken from POSTGRES_*"""
     validate_env_vars()
     
-    return {
+    config = {
         'dbname': os.getenv("POSTGRES_DB"),
         'user': os.getenv("POSTGRES_USER"),
         'password': os.getenv("POSTGRES_PASSWORD"),
         'host': os.getenv("POSTGRES_HOST", "db"),
         'port': os.getenv("POSTGRES_PORT", "5432")
     }
+    if dsn:
+        # Accepts both "host=... port=..." and postgresql:// URIs
+        config.update(psycopg2.extensions.parse_dsn(dsn))
+    return config
+
+
+def get_db_config() -> Dict[str, Any]:
+    """Get primary (read-write) database configuration from environment variables"""
+    return _dsn_config(os.getenv("POSTGRES_WRITE_DSN"))
+
+
+def get_read_db_config() -> Optional[Dict[str, Any]]:
+    """Get read replica configuration from POSTGRES_READ_DSN, or None when reads use the primary"""
+    dsn = os.getenv("POSTGRES_READ_DSN")
+    return _dsn_config(dsn) if dsn else None
 
 
 def get_db_connection() -> psycopg2.extensions.connection:
     """Get database connection using validated configuration"""
     config = get_db_config()
     return psycopg2.connect(**config)
+
+
+# ----- Connection pooling -----
+def get_pool_config() -> Dict[str, Any]:
+    """Get connection pool settings from environment variables"""
+    min_size = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    max_size = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+    if min_size < 0 or max_size < 1 or min_size > max_size:
+        raise ValueError(f"Invalid pool size: DB_POOL_MIN_SIZE={min_size}, DB_POOL_MAX_SIZE={max_size}")
+
+    return {
+        'min_size': min_size,
+        'max_size': max_size,
+        'timeout': float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        'health_check_interval': float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+    }
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within the timeout"""
+
+
+class DatabasePool:
+    """Thread-safe, bounded psycopg2 connection pool with health checks and statistics.
+
+    Callers block (up to ``timeout`` seconds) instead of failing when every
+    connection is checked out. A connection that has been idle for longer than
+    ``health_check_interval`` seconds is probed with ``SELECT 1`` before it is
+    handed out, and broken connections are discarded and replaced.
+    """
+
+    def __init__(self, service_name: str, db_config: Dict[str, Any], min_size: int = 1,
+                 max_size: int = 10, timeout: float = 30.0, health_check_interval: float = 30.0):
+        self.service_name = service_name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        if METRICS_CONFIG['enabled']:
+            # Times every statement for /metrics and the slow-query log
+            db_config = {'cursor_factory': TimedCursor, **db_config}
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, **db_config)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._last_used: Dict[int, float] = {}
+        self._stats: Dict[str, float] = {
+            'acquired': 0,
+            'in_use': 0,
+            'timeouts': 0,
+            'discarded': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        }
+
+    def _is_healthy(self, conn: psycopg2.extensions.connection) -> bool:
+        if conn.closed:
+            return False
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        with self._lock:
+            self._stats['health_checks'] += 1
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        """Check out a healthy connection, waiting for a free slot if necessary"""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeoutError(
+                f"Timed out after {self.timeout}s waiting for a database connection ({self.service_name})"
+            )
+
+        try:
+            conn = self._pool.getconn()
+            while not self._is_healthy(conn):
+                self._discard(conn)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        wait_ms = (time.monotonic() - started) * 1000
+        observe_pool_wait(self.service_name, wait_ms / 1000)
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['in_use'] += 1
+            self._stats['total_wait_ms'] += wait_ms
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+        return conn
+
+    def putconn(self, conn: psycopg2.extensions.connection, close: bool = False) -> None:
+        """Return a connection to the pool, rolling back any unfinished transaction"""
+        try:
+            if not close and not conn.closed:
+                try:
+                    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    def _discard(self, conn: psycopg2.extensions.connection) -> None:
+        self._last_used.pop(id(conn), None)
+        with self._lock:
+            self._stats['discarded'] += 1
+        self._pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg2.extensions.connection]:
+        """Context manager that checks out a connection and always returns it"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool usage statistics"""
+        with self._lock:
+            stats = dict(self._stats)
+        acquired = stats['acquired']
+        return {
+            'service': self.service_name,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'open_connections': len(self._pool._used) + len(self._pool._pool),
+            'idle_connections': len(self._pool._pool),
+            'in_use': int(stats['in_use']),
+            'acquired': int(acquired),
+            'timeouts': int(stats['timeouts']),
+            'discarded': int(stats['discarded']),
+            'health_checks': int(stats['health_checks']),
+            'health_check_failures': int(stats['health_check_failures']),
+            'avg_wait_ms': round(stats['total_wait_ms'] / acquired, 3) if acquired else 0.0,
+            'max_wait_ms': round(stats['max_wait_ms'], 3)
+        }
+
+    def close(self) -> None:
+        """Close every connection held by the pool"""
+        self._pool.closeall()
+        self._last_used.clear()
+
+
+# ----- Read replica routing -----
+def get_replica_config() -> Dict[str, Any]:
+    """Get read replica routing settings from environment variables"""
+    return {
+        'max_lag': float(os.getenv("DB_REPLICA_MAX_LAG", "5")),
+        'lag_check_interval': float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", "1")),
+        'retry_interval': float(os.getenv("DB_REPLICA_RETRY_INTERVAL", "10")),
+        'acquire_timeout': float(os.getenv("DB_REPLICA_ACQUIRE_TIMEOUT_MS", "50")) / 1000
+    }
+
+
+# Seconds the replica is behind the primary: zero while it is streaming and has replayed
+# everything it received (an idle primary sends no new transactions to time against)
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+             AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+    END;
+"""
+
+REPLICA_REPLAYED_QUERY = "SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn;"
+
+
+class ReplicaRoutingPool:
+    """Read-only pool that prefers a streaming replica and falls back to the primary.
+
+    Connections come from the replica while it is reachable and at most ``max_lag``
+    seconds behind; its lag is measured at most once per ``lag_check_interval``
+    seconds. Otherwise they come from the primary pool, and after a connection
+    error the replica is not tried again for ``retry_interval`` seconds. A
+    saturated replica pool is waited on for at most ``acquire_timeout`` seconds
+    before the read goes to the primary.
+    """
+
+    def __init__(self, service_name: str, primary: DatabasePool, replica_config: Dict[str, Any],
+                 pool_config: Dict[str, Any], max_lag: float = 5.0, lag_check_interval: float = 1.0,
+                 retry_interval: float = 10.0, acquire_timeout: float = 0.05):
+        self.service_name = service_name
+        self.primary = primary
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.retry_interval = retry_interval
+        self.acquire_timeout = acquire_timeout
+        self._replica_config = replica_config
+        self._pool_config = pool_config
+        self._replica: Optional[DatabasePool] = None
+        self._owners: Dict[int, DatabasePool] = {}
+        # Guards the routing state and counters below, like DatabasePool's lock
+        self._lock = threading.Lock()
+        # Held by the one thread measuring the lag; the others use the last measurement
+        self._lag_check_lock = threading.Lock()
+        self._lag: Optional[float] = None
+        self._lag_checked_at = 0.0
+        self._retry_at = 0.0
+        self._last_error: Optional[str] = None
+        self._stats = {'replica_reads': 0, 'primary_reads': 0, 'lag_fallbacks': 0, 'error_fallbacks': 0,
+                       'busy_fallbacks': 0}
+
+    def _replica_pool(self) -> Optional[DatabasePool]:
+        with self._lock:
+            if time.monotonic() < self._retry_at:
+                return None
+            if self._replica is not None:
+                return self._replica
+            try:
+                # Waiting out DB_POOL_TIMEOUT here would stall reads the primary could serve
+                self._replica = DatabasePool(f"{self.service_name}-replica", self._replica_config,
+                                             **{**self._pool_config, 'timeout': self.acquire_timeout})
+                return self._replica
+            except psycopg2.Error as e:
+                error = e
+        self._mark_down(error)
+        return None
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _mark_down(self, error: Exception) -> None:
+        with self._lock:
+            first = self._last_error is None
+            self._last_error = str(error).strip()
+            self._retry_at = time.monotonic() + self.retry_interval
+            self._stats['error_fallbacks'] += 1
+        if first:
+            print(f"⚠️ Read replica unavailable for {self.service_name}, reading from the primary: {error}")
+
+    def _lag_is_due(self) -> bool:
+        with self._lock:
+            return self._lag is None or time.monotonic() - self._lag_checked_at >= self.lag_check_interval
+
+    def _current_lag(self, conn: psycopg2.extensions.connection) -> float:
+        """The replica's lag, measured on conn when the last measurement is out of date"""
+        if self._lag_is_due() and self._lag_check_lock.acquire(blocking=False):
+            try:
+                # Another thread may have measured it while this one was checking
+                if self._lag_is_due():
+                    cur = conn.cursor()
+                    cur.execute(REPLICA_LAG_QUERY)
+                    lag = float(cur.fetchone()[0])
+                    cur.close()
+                    conn.rollback()
+                    with self._lock:
+                        self._lag = lag
+                        self._lag_checked_at = time.monotonic()
+            finally:
+                self._lag_check_lock.release()
+        with self._lock:
+            # Before the first measurement completes, reads go to the primary
+            return float("inf") if self._lag is None else self._lag
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        """Check out a replica connection if the replica is healthy and current, else a primary one"""
+        replica = self._replica_pool()
+        if replica is not None:
+            conn = None
+            try:
+                conn = replica.getconn()
+                lag = self._current_lag(conn)
+            except psycopg2.Error as e:
+                if conn is not None:
+                    replica.putconn(conn, close=True)
+                self._mark_down(e)
+            except PoolTimeoutError:
+                self._count('busy_fallbacks')
+            else:
+                if lag <= self.max_lag:
+                    with self._lock:
+                        self._last_error = None
+                        self._owners[id(conn)] = replica
+                        self._stats['replica_reads'] += 1
+                    return conn
+                replica.putconn(conn)
+                self._count('lag_fallbacks')
+
+        conn = self.primary.getconn()
+        with self._lock:
+            self._owners[id(conn)] = self.primary
+            self._stats['primary_reads'] += 1
+        return conn
+
+    def putconn(self, conn: psycopg2.extensions.connection, close: bool = False) -> None:
+        """Return a connection to the pool it came from"""
+        with self._lock:
+            owner = self._owners.pop(id(conn), self.primary)
+        owner.putconn(conn, close=close)
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg2.extensions.connection]:
+        """Context manager that checks out a connection and always returns it"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def wait_for_replay(self, lsn: str, timeout: Optional[float] = None) -> bool:
+        """Wait until the replica has replayed the primary's WAL up to ``lsn``.
+
+        Returns False if it has not after ``timeout`` seconds (default ``max_lag``);
+        reads then go to the primary until the next lag check.
+        """
+        replica = self._replica_pool()
+        if replica is None:
+            return False
+        deadline = time.monotonic() + (self.max_lag if timeout is None else timeout)
+        try:
+            with replica.connection() as conn:
+                cur = conn.cursor()
+                while True:
+                    cur.execute(REPLICA_REPLAYED_QUERY, (lsn,))
+                    replayed = cur.fetchone()[0]
+                    conn.rollback()
+                    if replayed:
+                        return True
+                    if time.monotonic() >= deadline:
+                        with self._lock:
+                            self._lag = float("inf")
+                            self._lag_checked_at = time.monotonic()
+                        return False
+                    time.sleep(0.01)
+        except PoolTimeoutError:
+            self._count('busy_fallbacks')
+            return False
+        except psycopg2.Error as e:
+            self._mark_down(e)
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Routing counters plus the statistics of both underlying pools"""
+        with self._lock:
+            replica = self._replica
+            stats = dict(self._stats)
+            lag, last_error = self._lag, self._last_error
+        if last_error is not None:
+            state = "unavailable"
+        elif lag is None:
+            state = "unknown"
+        else:
+            state = "ok" if lag <= self.max_lag else "lagging"
+        return {
+            **stats,
+            'replica_state': state,
+            'replica_lag_s': round(lag, 3) if lag is not None and lag != float("inf") else None,
+            'max_lag_s': self.max_lag,
+            'replica_error': last_error,
+            'replica': replica.stats() if replica is not None else None,
+            'primary': self.primary.stats()
+        }
+
+    def close(self) -> None:
+        """Close every connection held by both pools"""
+        if self._replica is not None:
+            self._replica.close()
+            self._replica = None
+        self.primary.close()
+
+
+_db_pool: Optional[Union[DatabasePool, ReplicaRoutingPool]] = None
+_db_pool_lock = threading.Lock()
+
+
+def init_db_pool(service_name: str, prefer_replica: bool = False) -> Union[DatabasePool, ReplicaRoutingPool]:
+    """Create the process-wide connection pool for a service (idempotent).
+
+    With ``prefer_replica`` and POSTGRES_READ_DSN set, the pool routes to the read
+    replica (see ReplicaRoutingPool); only use it for services that never write.
+    """
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            pool_config = get_pool_config()
+            _db_pool = DatabasePool(service_name, get_db_config(), **pool_config)
+            read_config = get_read_db_config()
+            if prefer_replica and read_config is not None:
+                _db_pool = ReplicaRoutingPool(service_name, _db_pool, read_config, pool_config,
+                                              **get_replica_config())
+        return _db_pool
+
+
+def get_db_pool() -> Union[DatabasePool, ReplicaRoutingPool]:
+    """Get the process-wide connection pool, failing if it was not initialized"""
+    if _db_pool is None:
+        raise RuntimeError("Database pool has not been initialized; call init_db_pool() first")
+    return _db_pool
+
+
+def close_db_pool() -> None:
+    """Close the process-wide connection pool if it exists"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.close()
+            _db_pool = None
+
+
+@contextmanager
+def pooled_connection() -> Iterator[psycopg2.extensions.connection]:
+    """Borrow a connection from the process-wide pool for the duration of a block"""
+    with get_db_pool().connection() as conn:
+        yield conn
+
+
+def reads_from_replica() -> bool:
+    """Whether the process-wide pool routes reads to a read replica"""
+    return isinstance(_db_pool, ReplicaRoutingPool)
+
+
+def wait_for_replica_replay(lsn: str) -> bool:
+    """Wait until the process-wide pool's replica has replayed ``lsn`` (True without a replica)"""
+    if isinstance(_db_pool, ReplicaRoutingPool):
+        return _db_pool.wait_for_replay(lsn)
+    return True
+
+
+# ----- Async connection pooling (asyncpg) -----
+async def _add_query_logger(conn: Any) -> None:
+    # Statement timings for /metrics and the slow-query log
+    conn.add_query_logger(record_asyncpg_query)
+
+
+class AsyncDatabasePool:
+    """asyncpg-backed pool with the same sizing, timeout and statistics as DatabasePool.
+
+    asyncpg replaces broken connections itself; idle connections are closed after
+    ``health_check_interval`` seconds so stale sockets are not handed out.
+    """
+
+    def __init__(self, service_name: str, pool: Any, min_size: int, max_size: int, timeout: float):
+        self.service_name = service_name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._pool = pool
+        self._stats: Dict[str, float] = {
+            'acquired': 0,
+            'in_use': 0,
+            'timeouts': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        }
+
+    @classmethod
+    async def create(cls, service_name: str, db_config: Dict[str, Any], min_size: int = 1,
+                     max_size: int = 10, timeout: float = 30.0,
+                     health_check_interval: float = 30.0) -> "AsyncDatabasePool":
+        # Optional dependency: only services running in async mode need asyncpg
+        import asyncpg
+
+        pool = await asyncpg.create_pool(
+            database=db_config['dbname'],
+            user=db_config['user'],
+            password=db_config['password'],
+            host=db_config['host'],
+            port=int(db_config['port']),
+            min_size=min_size,
+            max_size=max_size,
+            max_inactive_connection_lifetime=health_check_interval,
+            init=_add_query_logger if METRICS_CONFIG['enabled'] else None
+        )
+        return cls(service_name, pool, min_size, max_size, timeout)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Any]:
+        """Async context manager that checks out a connection and always returns it"""
+        started = time.monotonic()
+        try:
+            conn = await self._pool.acquire(timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            raise PoolTimeoutError(
+                f"Timed out after {self.timeout}s waiting for a database connection ({self.service_name})"
+            )
+
+        wait_ms = (time.monotonic() - started) * 1000
+        observe_pool_wait(self.service_name, wait_ms / 1000)
+        self._stats['acquired'] += 1
+        self._stats['in_use'] += 1
+        self._stats['total_wait_ms'] += wait_ms
+        self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+        try:
+            yield conn
+        finally:
+            self._stats['in_use'] -= 1
+            await self._pool.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool usage statistics"""
+        acquired = self._stats['acquired']
+        return {
+            'service': self.service_name,
+            'driver': 'asyncpg',
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'open_connections': self._pool.get_size(),
+            'idle_connections': self._pool.get_idle_size(),
+            'in_use': int(self._stats['in_use']),
+            'acquired': int(acquired),
+            'timeouts': int(self._stats['timeouts']),
+            'avg_wait_ms': round(self._stats['total_wait_ms'] / acquired, 3) if acquired else 0.0,
+            'max_wait_ms': round(self._stats['max_wait_ms'], 3)
+        }
+
+    async def close(self) -> None:
+        """Close every connection held by the pool"""
+        await self._pool.close()
+
+
+_async_db_pool: Optional[AsyncDatabasePool] = None
+
+
+async def init_async_db_pool(service_name: str) -> AsyncDatabasePool:
+    """Create the process-wide asyncpg pool for a service (idempotent)"""
+    global _async_db_pool
+    if _async_db_pool is None:
+        _async_db_pool = await AsyncDatabasePool.create(service_name, get_db_config(), **get_pool_config())
+    return _async_db_pool
+
+
+def get_async_db_pool() -> AsyncDatabasePool:
+    """Get the process-wide asyncpg pool, failing if it was not initialized"""
+    if _async_db_pool is None:
+        raise RuntimeError("Async database pool has not been initialized; call init_async_db_pool() first")
+    return _async_db_pool
+
+
+async def close_async_db_pool() -> None:
+    """Close the process-wide asyncpg pool if it exists"""
+    global _async_db_pool
+    if _async_db_pool is not None:
+        await _async_db_pool.close()
+        _async_db_pool = None
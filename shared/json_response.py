@@ -0,0 +1,45 @@
+"""
+Fast JSON encoding for the FastAPI services.
+
+``dumps`` renders compact UTF-8 JSON with orjson when it is installed and with the
+standard library otherwise; both produce the same document for the values the
+services return (Decimal as a number, UUID and datetime as strings).
+FastJSONResponse is the default response class of both apps.
+"""
+import json
+from decimal import Decimal
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    # Optional dependency: without orjson every response is encoded by the json module
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    """orjson fallback for types it does not encode natively, matching jsonable_encoder"""
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return jsonable_encoder(value)
+
+
+def dumps(content: Any) -> bytes:
+    """Compact JSON bytes for a response body or a cached result"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps()"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,267 @@
+"""
+Request and SQL instrumentation for the FastAPI services, served in the
+Prometheus text format at /metrics.
+
+MetricsMiddleware counts every request by route template and status. A sampled
+fraction of requests (METRICS_SAMPLE_RATE) is also timed, together with the
+number and total duration of the SQL statements it ran; statements are timed by
+TimedCursor, the cursor class of pooled psycopg2 connections, or by a query
+logger on asyncpg connections. Every statement slower than
+METRICS_SLOW_QUERY_MS is logged with its text, sampled or not, and the pools
+observe how long each checkout waited for a connection.
+"""
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import psycopg2.extensions
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SLOW_QUERY_MAX_CHARS = 2000
+
+
+def get_metrics_config() -> Dict[str, Any]:
+    """Get request and SQL instrumentation settings from environment variables"""
+    return {
+        'enabled': os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes"),
+        'sample_rate': float(os.getenv("METRICS_SAMPLE_RATE", "1")),
+        'slow_query_ms': float(os.getenv("METRICS_SLOW_QUERY_MS", "500"))
+    }
+
+
+METRICS_CONFIG = get_metrics_config()
+
+
+# ----- Metric types -----
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in items]
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # Per label set: one count per bucket plus +Inf, then the sum
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = [0.0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(values)) for key, values in self._values.items())
+        for key, values in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {_number(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(round(values[-1], 6))}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {_number(cumulative)}")
+        return lines
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status",
+                   ("method", "route", "status"))
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Latency of sampled HTTP requests",
+                             ("method", "route"))
+REQUEST_STATEMENTS = Histogram("http_request_sql_statements", "SQL statements run per sampled request",
+                               ("route",), STATEMENT_BUCKETS)
+REQUEST_SQL_DURATION = Histogram("http_request_sql_duration_seconds",
+                                 "Total SQL execution time per sampled request", ("route",))
+POOL_WAIT = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection", ("pool",))
+SLOW_QUERIES = Counter("db_slow_queries_total", "SQL statements slower than METRICS_SLOW_QUERY_MS", ("route",))
+_METRICS = (REQUESTS, REQUEST_DURATION, REQUEST_STATEMENTS, REQUEST_SQL_DURATION, POOL_WAIT, SLOW_QUERIES)
+
+
+# ----- Per-request trace -----
+class RequestTrace:
+    """SQL work of the request being handled, shared with the threadpool it runs in"""
+    __slots__ = ("scope", "sampled", "statements", "sql_seconds")
+
+    def __init__(self, scope: Dict[str, Any], sampled: bool):
+        self.scope = scope
+        self.sampled = sampled
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("metrics_request_trace", default=None)
+
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """The matched route template (e.g. /loyal-customers), so label values stay bounded"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def record_statement(statement: Any, seconds: float) -> None:
+    """Add one executed statement to the current request and log it if it was slow"""
+    trace = _current_trace.get()
+    if trace is not None and trace.sampled:
+        trace.statements += 1
+        trace.sql_seconds += seconds
+
+    slow_query_ms = METRICS_CONFIG['slow_query_ms']
+    if slow_query_ms > 0 and seconds * 1000 >= slow_query_ms:
+        route = route_label(trace.scope) if trace is not None else "background"
+        SLOW_QUERIES.inc(route)
+        if isinstance(statement, bytes):
+            statement = statement.decode("utf-8", "replace")
+        text = " ".join(str(statement).split())
+        if len(text) > SLOW_QUERY_MAX_CHARS:
+            text = text[:SLOW_QUERY_MAX_CHARS] + "..."
+        print(f"🐢 Slow query ({seconds * 1000:.0f} ms, {route}): {text}")
+
+
+def observe_pool_wait(pool: str, seconds: float) -> None:
+    POOL_WAIT.observe(seconds, pool)
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """psycopg2 cursor that times every statement for the request metrics and slow-query log"""
+
+    def execute(self, query: Any, vars: Any = None) -> None:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            # The statement text without its parameters, which may identify customers
+            record_statement(query, time.perf_counter() - started)
+
+    def executemany(self, query: Any, vars_list: Any) -> None:
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_statement(query, time.perf_counter() - started)
+
+    def copy_expert(self, sql: Any, file: Any, size: int = 8192) -> None:
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_statement(sql, time.perf_counter() - started)
+
+
+def record_asyncpg_query(record: Any) -> None:
+    """asyncpg query logger: runs in the context of the request that sent the query"""
+    record_statement(record.query, record.elapsed)
+
+
+# ----- ASGI middleware -----
+class MetricsMiddleware:
+    """Counts and (sampled) times requests by route, along with the SQL each one ran"""
+
+    def __init__(self, app: Any, exclude: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not METRICS_CONFIG['enabled']:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope, random.random() < METRICS_CONFIG['sample_rate'])
+        token = _current_trace.set(trace)
+        status = 500
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_trace.reset(token)
+            route = route_label(scope)
+            if route not in self.exclude:
+                REQUESTS.inc(scope["method"], route, str(status))
+                if trace.sampled:
+                    REQUEST_DURATION.observe(elapsed, scope["method"], route)
+                    REQUEST_STATEMENTS.observe(trace.statements, route)
+                    REQUEST_SQL_DURATION.observe(trace.sql_seconds, route)
+
+
+# ----- Exposition -----
+def _pool_lines(stats: Dict[str, Any]) -> List[str]:
+    pools = [stats]
+    if 'primary' in stats:
+        # Read replica routing: report both underlying pools
+        pools = [pool for pool in (stats['primary'], stats.get('replica')) if pool is not None]
+
+    lines = ["# HELP db_pool_connections Pooled connections by state", "# TYPE db_pool_connections gauge"]
+    for pool in pools:
+        name = _escape(pool['service'])
+        lines.append(f'db_pool_connections{{pool="{name}",state="in_use"}} {pool["in_use"]}')
+        lines.append(f'db_pool_connections{{pool="{name}",state="idle"}} {pool["idle_connections"]}')
+    lines += ["# HELP db_pool_timeouts_total Checkouts that gave up waiting for a connection",
+              "# TYPE db_pool_timeouts_total counter"]
+    lines += [f'db_pool_timeouts_total{{pool="{_escape(pool["service"])}"}} {pool["timeouts"]}' for pool in pools]
+    return lines
+
+
+def render_metrics(pool_stats: Optional[Dict[str, Any]] = None) -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines += metric.render()
+    if pool_stats is not None:
+        lines += _pool_lines(pool_stats)
+    return "\n".join(lines) + "\n"